@@ -1,14 +1,38 @@
 # app.py (Versión con Dashboard Corregido y Optimizado)
 
+import time
+_INICIO_IMPORTACION = time.perf_counter()  # tiempo de importación del módulo, informado al final
+import sys
 import dash
-from dash import Dash, dash_table, html, dcc, Input, Output, State, MATCH
+from dash import Dash, dash_table, html, dcc, Input, Output, State, MATCH, DiskcacheManager
 import pandas as pd
 import os
 import numpy as np
 import datetime
+import threading
+import sqlite3
+import operator
+import hashlib
+import pickle
+import zlib
+import tempfile
+import io
+import zipfile
+import functools
+import bisect
+import re
+import heapq
+import cProfile
+import importlib.util
+import uuid
+import json
+import flask
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
 from dateutil.relativedelta import relativedelta
-from fpdf import FPDF
-import plotly.express as px
+try: import fcntl  # bloqueos de tablas entre procesos (POSIX)
+except ImportError: fcntl = None
 
 # --- 1. CONFIGURACIÓN INICIAL Y DATOS (Sin Cambios) ---
 DATA_PATH = "data"
@@ -18,13 +42,118 @@ DIST1_FILE = os.path.join(DATA_PATH, "distribucion_1.csv")
 DIST2_FILE = os.path.join(DATA_PATH, "distribucion_2.csv")
 VALV_FILE = os.path.join(DATA_PATH, "valvulas.csv")
 FECHA_FILE = os.path.join(DATA_PATH, "fecha_inicio_riego.txt")
+PROGRAMACION_FILE = os.path.join(DATA_PATH, "programacion_riego.json")
 LIMITES_FILE = os.path.join(DATA_PATH, "limites_nutrientes.csv")
 PLAN_SEMANAL_FILE = os.path.join(DATA_PATH, "plan_semanal_guardado.csv")
 APLIC_REALES_FILE = os.path.join(DATA_PATH, "aplicaciones_reales.csv")
+PLANES_PATH = os.path.join(DATA_PATH, "planes")
+DB_FILE = os.path.join(DATA_PATH, "planificador.sqlite")
+STORAGE_BACKEND = os.environ.get('PLANIFICADOR_STORAGE', 'sqlite')  # 'sqlite' o 'csv'
+TABLAS_CSV = [REQ_FILE, FERT_FILE, DIST1_FILE, DIST2_FILE, VALV_FILE, LIMITES_FILE, PLAN_SEMANAL_FILE, APLIC_REALES_FILE]
 
 if not os.path.exists(DATA_PATH): os.makedirs(DATA_PATH)
 if not os.path.exists('assets'): os.makedirs('assets')
 
+# --- Métricas de rendimiento ---
+# Latencia de callbacks, tamaño de payloads y tiempos/filas de almacenamiento, expuestos en formato de texto Prometheus en /metrics
+# Cada proceso acumula las suyas; los trabajos en segundo plano las envían por la cola de cache_trabajos y el servidor las incorpora al servir /metrics
+CUBETAS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CUBETAS_BYTES = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+CUBETAS_FILAS = (10, 100, 1e3, 1e4, 1e5, 1e6)
+CALLBACK_LENTO_S = float(os.environ.get('PLANIFICADOR_CALLBACK_LENTO_S', '0'))  # > 0: los callbacks corren bajo cProfile y se vuelcan los que superan este tiempo
+PERFILES_PATH = os.path.join(DATA_PATH, "perfiles")
+PERFILES_MAX = int(os.environ.get('PLANIFICADOR_PERFILES_MAX', '50'))
+METRICAS = {  # nombre -> (tipo, ayuda, cubetas)
+    'planificador_callback_segundos': ('histogram', 'Duración de los callbacks de Dash', CUBETAS_SEGUNDOS),
+    'planificador_callback_errores_total': ('counter', 'Callbacks terminados con una excepción', None),
+    'planificador_callback_lentos_total': ('counter', 'Callbacks que superaron PLANIFICADOR_CALLBACK_LENTO_S', None),
+    'planificador_peticion_bytes': ('histogram', 'Tamaño del cuerpo de las peticiones a callbacks', CUBETAS_BYTES),
+    'planificador_respuesta_bytes': ('histogram', 'Tamaño de las respuestas de callbacks', CUBETAS_BYTES),
+    'planificador_almacenamiento_segundos': ('histogram', 'Duración de lecturas y escrituras de tablas', CUBETAS_SEGUNDOS),
+    'planificador_almacenamiento_filas': ('histogram', 'Filas leídas o escritas por operación', CUBETAS_FILAS),
+}
+def _etiquetas_prometheus(etiquetas):
+    if not etiquetas: return ''
+    return '{' + ','.join(f'{k}="' + str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"' for k, v in etiquetas) + '}'
+def texto_prometheus(nombre, tipo, ayuda, series):
+    # series: [(etiquetas como tupla de pares, valor)]
+    return [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} {tipo}"] + [f"{nombre}{_etiquetas_prometheus(etiquetas)} {float(valor)!r}" for etiquetas, valor in series]
+class Metricas:
+    def __init__(self): self._series = {}; self._lock = threading.Lock()  # (nombre, etiquetas) -> valor del contador o [conteo por cubeta..., +Inf, suma, total]
+    def registrar(self, nombre, etiquetas, valor):
+        tipo, _, cubetas = METRICAS[nombre]; clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            if tipo == 'counter': self._series[clave] = self._series.get(clave, 0) + valor; return
+            serie = self._series.get(clave)
+            if serie is None: serie = self._series[clave] = [0] * (len(cubetas) + 3)
+            serie[bisect.bisect_left(cubetas, valor)] += 1; serie[-2] += valor; serie[-1] += 1
+    def texto(self):
+        with self._lock: series = {clave: (list(v) if isinstance(v, list) else v) for clave, v in self._series.items()}
+        lineas = []
+        for nombre, (tipo, ayuda, cubetas) in METRICAS.items():
+            propias = sorted((etiquetas, v) for (n, etiquetas), v in series.items() if n == nombre)
+            if tipo == 'counter': lineas += texto_prometheus(nombre, tipo, ayuda, propias); continue
+            lineas += texto_prometheus(nombre, tipo, ayuda, [])
+            for etiquetas, serie in propias:
+                acumulado = np.cumsum(serie[:-2])
+                lineas += [f"{nombre}_bucket{_etiquetas_prometheus(etiquetas + (('le', le),))} {int(n)}" for le, n in zip([repr(float(c)) for c in cubetas] + ['+Inf'], acumulado)]
+                lineas += [f"{nombre}_sum{_etiquetas_prometheus(etiquetas)} {float(serie[-2])!r}", f"{nombre}_count{_etiquetas_prometheus(etiquetas)} {serie[-1]}"]
+        return lineas
+_metricas = Metricas()
+_pid_servidor = None  # proceso que atiende peticiones HTTP (lo fija before_request); los demás son trabajos en segundo plano
+
+def registrar_metrica(nombre, etiquetas, valor):
+    if _pid_servidor is not None and os.getpid() != _pid_servidor: cache_trabajos().push((nombre, etiquetas, valor), prefix='metrica', expire=TRABAJOS_TTL_S)
+    else: _metricas.registrar(nombre, etiquetas, valor)
+def incorporar_metricas_pendientes():
+    while True:
+        clave, observacion = cache_trabajos().pull(prefix='metrica')
+        if clave is None: return
+        _metricas.registrar(*observacion)
+def _volcar_perfil(perfil, nombre, duracion):
+    os.makedirs(PERFILES_PATH, exist_ok=True)
+    archivo = os.path.join(PERFILES_PATH, f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{nombre}-{duracion * 1000:.0f}ms-{os.getpid()}.prof")
+    perfil.dump_stats(archivo)
+    registrar_metrica('planificador_callback_lentos_total', {'callback': nombre}, 1)
+    print(f"Callback lento: {nombre} tardó {duracion:.3f} s (perfil en {archivo})", file=sys.stderr, flush=True)
+    perfiles = sorted(os.listdir(PERFILES_PATH))  # el nombre empieza con la fecha: orden cronológico
+    for viejo in perfiles[:max(0, len(perfiles) - PERFILES_MAX)]:
+        try: os.remove(os.path.join(PERFILES_PATH, viejo))
+        except OSError: pass
+def medir_callback(funcion):
+    # Va debajo de @app.callback: latencia y errores por callback (PreventUpdate no es error) y perfil cProfile de los lentos
+    etiquetas = {'callback': funcion.__name__}
+    @functools.wraps(funcion)
+    def medido(*args, **kwargs):
+        perfil = cProfile.Profile() if CALLBACK_LENTO_S > 0 else None
+        if perfil is not None:
+            try: perfil.enable()
+            except ValueError: perfil = None  # ya hay otro perfilador activo en este hilo
+        inicio, error = time.perf_counter(), False
+        try: return funcion(*args, **kwargs)
+        except dash.exceptions.PreventUpdate: raise
+        except BaseException: error = True; raise
+        finally:
+            duracion = time.perf_counter() - inicio
+            if perfil is not None: perfil.disable()
+            registrar_metrica('planificador_callback_segundos', etiquetas, duracion)
+            if error: registrar_metrica('planificador_callback_errores_total', etiquetas, 1)
+            if perfil is not None and duracion >= CALLBACK_LENTO_S: _volcar_perfil(perfil, funcion.__name__, duracion)
+    return medido
+def medir_almacenamiento(operacion):
+    # Tiempo y filas de cada lectura/escritura de tabla, por backend, operación y tabla
+    def decorador(metodo):
+        @functools.wraps(metodo)
+        def medido(self, filepath, *args, **kwargs):
+            inicio = time.perf_counter(); resultado = metodo(self, filepath, *args, **kwargs)
+            etiquetas = {'backend': self.nombre, 'operacion': operacion, 'tabla': os.path.splitext(os.path.basename(filepath))[0]}
+            registrar_metrica('planificador_almacenamiento_segundos', etiquetas, time.perf_counter() - inicio)
+            df = args[0] if operacion in ('escribir', 'aplicar_cambios') else (resultado[0] if isinstance(resultado, tuple) else resultado)
+            registrar_metrica('planificador_almacenamiento_filas', etiquetas, len(df))
+            return resultado
+        return medido
+    return decorador
+
 # --- Funciones para definir datos por defecto (Sin Cambios) ---
 def definir_requerimientos(): return pd.DataFrame({'Sector': ["Chacra Vieja", "Chacra Pivot", "Chacra Isla", "Chacra Isla", "Chacra Isla", "Chacra Isla"], 'Anio': [2011, 2012, 2016, 2017, 2018, 2019], 'Sup_ha': [11, 38, 30, 34, 14, 55], 'N': [180, 200, 190, 180, 170, 140], 'P': [70, 65, 60, 45, 40, 30], 'K': [240, 230, 230, 180, 140, 120], 'Mg': [30, 25, 20, 18, 15, 15]})
 def definir_fertilizantes(): return pd.DataFrame({'Producto': ["BIOINICIO", "NITRON", "BIOPRODUCCION", "BIOPREMIUM"], 'N': [0.03, 0.28, 0, 0], 'P2O5': [0.20, 0, 0, 0], 'K2O': [0, 0, 0.20, 0], 'S': [0, 0.03, 0.08, 0.06], 'MgO': [0, 0, 0, 0.06], 'Densidad': [1.188, 1.320, 1.250, 1.350], 'Precio': [2.5, 1.8, 2.0, 3.0]})
@@ -33,94 +162,1261 @@ def definir_distribucion2(): return pd.DataFrame({'Mes': ["Octubre", "Noviembre"
 def definir_valvulas(): return pd.DataFrame({'Año': [2011, 2012, 2016, 2017, 2018, 2018.1, 2019, 2019.1], 'Valvula_1': [12, 4.6, 8.0, 5, 7.8, 6, 11, 8], 'Valvula_2': [26, 6.4, 9.1, 5, 7.7, np.nan, 12, np.nan], 'Valvula_3': [np.nan, np.nan, 8.5, 5, 10.4, np.nan, 12, np.nan], 'Valvula_4': [np.nan, np.nan, 9.7, 5, 8.8, np.nan, 10, np.nan]})
 def definir_limites(): return pd.DataFrame({'Nutriente': ['N', 'P', 'K', 'Mg'], 'Limite_kg_ha_app': [40, 20, 35, 5]})
 
+# --- Almacenamiento de tablas (CSV o SQLite) ---
+# Las tablas se identifican por su ruta CSV histórica (REQ_FILE, APLIC_REALES_FILE, ...); el backend SQLite usa el nombre base como tabla
+COLUMNAS_INDICE_APLICACIONES = ('Sector', 'Válvula', 'Fecha Estimada')
+# Los guardados de seguimiento mandan solo las celdas cambiadas [(id, columna, valor)]. En CSV van a un diario JSONL por tabla (<tabla>.diario.jsonl),
+# escrito con append + fsync bajo bloqueo, que se reproduce al leer y se compacta en la base al superar DIARIO_MAX_BYTES. En SQLite son UPDATE por id en una transacción
+DIARIO_MAX_BYTES = int(os.environ.get('PLANIFICADOR_DIARIO_KB', '256')) * 1024
+_bloqueos_hilo = threading.local()  # tablas que el hilo actual ya tiene bloqueadas (bloqueo reentrante)
+_bloqueos_locales = {}  # sin fcntl el bloqueo solo excluye a los hilos del mismo proceso
+_bloqueos_locales_lock = threading.Lock()
+def leer_diario(ruta, desde=0):
+    # Cambios desde el byte 'desde' hasta la última línea completa; una línea cortada por una caída se descarta
+    try:
+        with open(ruta, 'rb') as f: f.seek(desde); datos = f.read()
+    except FileNotFoundError: return [], 0
+    fin = datos.rfind(b'\n') + 1; cambios = []
+    for linea in datos[:fin].splitlines():
+        try: cambios.append(tuple(json.loads(linea)))
+        except ValueError: continue
+    return cambios, desde + fin
+def reproducir_cambios(df, cambios):
+    # Último valor por (id, columna); los ids que ya no están en la tabla se ignoran
+    if not cambios or 'id' not in df.columns: return df
+    ultimos = pd.DataFrame(cambios, columns=['id', 'columna', 'valor']).drop_duplicates(['id', 'columna'], keep='last')
+    df = df.copy(); ids = pd.Index(df['id'])
+    for col, grupo in ultimos.groupby('columna', sort=False):
+        pos = ids.get_indexer(grupo['id']); validas = pos >= 0
+        valores = (df[col] if col in df.columns else pd.Series(np.nan, index=df.index)).to_numpy(dtype=object, copy=True)
+        valores[pos[validas]] = grupo['valor'].to_numpy(dtype=object)[validas]
+        df[col] = pd.Series(valores, index=df.index).infer_objects()  # mismos tipos que al releer el CSV
+    return df
+class AlmacenamientoCSV:
+    nombre = 'csv'
+    def __init__(self): self._replicas = {}; self._replicas_lock = threading.Lock()  # ruta -> (firma de la base, bytes del diario ya reproducidos, tabla)
+    @staticmethod
+    def ruta_diario(filepath): return os.path.splitext(filepath)[0] + '.diario.jsonl'
+    @contextmanager
+    def bloqueo(self, filepath):
+        # Exclusión entre hilos y procesos (flock sobre <tabla>.lock) para leer-modificar-escribir una tabla
+        tomadas = _bloqueos_hilo.__dict__.setdefault('tablas', set())
+        if filepath in tomadas: yield; return
+        ruta = os.path.splitext(filepath)[0] + '.lock'
+        if fcntl is None:
+            with _bloqueos_locales_lock: lock = _bloqueos_locales.setdefault(ruta, threading.Lock())
+            lock.acquire()
+        else: fd = os.open(ruta, os.O_RDWR | os.O_CREAT, 0o644); fcntl.flock(fd, fcntl.LOCK_EX)
+        tomadas.add(filepath)
+        try: yield
+        finally:
+            tomadas.discard(filepath)
+            if fcntl is None: lock.release()
+            else: fcntl.flock(fd, fcntl.LOCK_UN); os.close(fd)
+    def existe(self, filepath): return os.path.exists(filepath) and os.path.getsize(filepath) > 0
+    def firma(self, filepath):
+        st = os.stat(filepath); diario = self.ruta_diario(filepath)
+        return (st.st_mtime_ns, st.st_size, os.path.getsize(diario) if os.path.exists(diario) else 0)
+    @medir_almacenamiento('leer')
+    def leer(self, filepath):
+        # Base + diario; si la base no cambió desde la última lectura solo se reproducen las líneas nuevas del diario
+        diario = self.ruta_diario(filepath)
+        if not os.path.exists(diario): return pd.read_csv(filepath)
+        st = os.stat(filepath); firma_base = (st.st_mtime_ns, st.st_size)
+        with self._replicas_lock: previa = self._replicas.get(filepath)
+        if previa is not None and previa[0] == firma_base and previa[1] <= os.path.getsize(diario): _, desde, df = previa
+        else: desde, df = 0, pd.read_csv(filepath)
+        cambios, hasta = leer_diario(diario, desde)
+        df = reproducir_cambios(df, cambios)
+        with self._replicas_lock: self._replicas[filepath] = (firma_base, hasta, df)
+        return df
+    @medir_almacenamiento('escribir')
+    def escribir(self, filepath, df):
+        # La tabla entera reemplaza también a los cambios pendientes del diario
+        with self.bloqueo(filepath): self._descartar_diario(filepath); self._escribir_base(filepath, df)
+    def _escribir_base(self, filepath, df):
+        # Escritura atómica: archivo temporal en el mismo directorio + os.replace
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filepath) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', newline='') as f: df.to_csv(f, index=False)
+            os.replace(tmp, filepath)
+        except BaseException:
+            if os.path.exists(tmp): os.remove(tmp)
+            raise
+    def _descartar_diario(self, filepath):
+        if os.path.exists(self.ruta_diario(filepath)): os.remove(self.ruta_diario(filepath))
+        with self._replicas_lock: self._replicas.pop(filepath, None)
+    @medir_almacenamiento('aplicar_cambios')
+    def aplicar_cambios(self, filepath, cambios):
+        # Una sola escritura en modo append por guardado; la base se reescribe solo al compactar
+        if not cambios: return
+        texto = ''.join(json.dumps([i, c, v], ensure_ascii=False) + '\n' for i, c, v in cambios).encode('utf-8')
+        diario = self.ruta_diario(filepath)
+        with self.bloqueo(filepath):
+            fd = os.open(diario, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                if os.fstat(fd).st_size:
+                    with open(diario, 'rb') as f: f.seek(-1, os.SEEK_END); cortada = f.read(1) != b'\n'
+                    if cortada: texto = b'\n' + texto  # línea incompleta de una escritura interrumpida: queda aislada y se descarta al leer
+                os.write(fd, texto); os.fsync(fd)
+            finally: os.close(fd)
+            if os.path.getsize(diario) > DIARIO_MAX_BYTES: self.compactar(filepath)
+    def compactar(self, filepath):
+        # Primero la base nueva y después se borra el diario: si se corta en el medio, reproducir el diario otra vez no cambia nada
+        with self.bloqueo(filepath):
+            if not os.path.exists(self.ruta_diario(filepath)): return
+            self._escribir_base(filepath, self.leer(filepath)); self._descartar_diario(filepath)
+    def eliminar(self, filepath):
+        with self.bloqueo(filepath):
+            self._descartar_diario(filepath)
+            if os.path.exists(filepath): os.remove(filepath)
+    def leer_texto(self, filepath):
+        if not os.path.exists(filepath): return None
+        with open(filepath, 'r') as f: return f.read()
+    def escribir_texto(self, filepath, texto):
+        with open(filepath, 'w') as f: f.write(texto)
+    @medir_almacenamiento('consultar')
+    def consultar(self, filepath, sector=None, anio=None, fecha=None, fecha_desde=None, fecha_hasta=None, solo_aplicadas=False, ordenar=False):
+        try: df = _leer_tabla_cacheada(filepath) if self.existe(filepath) else pd.DataFrame()
+        except pd.errors.EmptyDataError: df = pd.DataFrame()
+        if df.empty: return df
+        mascara = np.ones(len(df), dtype=bool)
+        if sector is not None: mascara &= (df['Sector'] == sector).to_numpy()
+        if anio is not None: mascara &= (pd.to_numeric(df['Año Plantación'], errors='coerce') == anio).to_numpy()
+        if fecha is not None: mascara &= (df['Fecha Estimada'].astype(str) == fecha).to_numpy()
+        if fecha_desde is not None: mascara &= (df['Fecha Estimada'].astype(str) >= fecha_desde).to_numpy()
+        if fecha_hasta is not None: mascara &= (df['Fecha Estimada'].astype(str) <= fecha_hasta).to_numpy()
+        if solo_aplicadas: mascara &= (df['Fecha Aplicación Real'].notna() & (df['Fecha Aplicación Real'].astype(str) != '')).to_numpy()
+        df = df[mascara]
+        return df.sort_values(by=['Fecha Estimada', 'Válvula'], kind='stable') if ordenar else df
+    def contar(self, filepath, **filtros): return len(self.consultar(filepath, **filtros))
+    @medir_almacenamiento('consultar_pagina')
+    def consultar_pagina(self, filepath, filtros=(), orden=(), anio=None, offset=0, limite=None): return paginar_frame(self.consultar(filepath), filtros, orden, anio, offset, limite)
+
+def paginar_frame(df, filtros=(), orden=(), anio=None, offset=0, limite=None):
+    # filtros: [(columna, operador, valor)] con los operadores de filter_query de DataTable; orden: [(columna, ascendente)]
+    if anio is not None and 'Año Plantación' in df.columns: df = df[(pd.to_numeric(df['Año Plantación'], errors='coerce') == anio).to_numpy()]
+    for col, op, valor in filtros:
+        if col in df.columns: df = df[_mascara_filtro(df[col], op, valor)]
+    orden = [(c, asc) for c, asc in orden if c in df.columns]
+    if orden: df = df.sort_values(by=[c for c, _ in orden], ascending=[asc for _, asc in orden], kind='stable')
+    return df.iloc[offset:(offset + limite) if limite else None], len(df)
+
+OPERADORES_FILTRO = {'eq': operator.eq, 'ne': operator.ne, 'lt': operator.lt, 'le': operator.le, 'gt': operator.gt, 'ge': operator.ge}
+OPERADORES_FILTRO_SQL = {'eq': '=', 'ne': '!=', 'lt': '<', 'le': '<=', 'gt': '>', 'ge': '>='}
+def _mascara_filtro(serie, op, valor):
+    # Fechas del modelo compacto: se filtran como el texto 'YYYY-MM-DD' que ve la tabla
+    if serie.name in COLUMNAS_FECHA and pd.api.types.is_integer_dtype(serie): serie = pd.Series(fechas_desde_dias(serie.to_numpy()), index=serie.index, name=serie.name)
+    if op == 'blank': return (serie.isna() | (serie.astype(str) == '')).to_numpy()
+    insensible = op[0] == 'i'; op = op[1:] if insensible else op  # 'icontains', 'ieq', ...: sin distinguir mayúsculas
+    if isinstance(valor, (int, float)) and op in OPERADORES_FILTRO and pd.api.types.is_numeric_dtype(serie): return OPERADORES_FILTRO[op](serie, valor).to_numpy()
+    texto, valor = serie.astype(str), str(valor)
+    if insensible: texto, valor = texto.str.lower(), valor.lower()
+    if op == 'contains': return texto.str.contains(valor, regex=False).to_numpy(dtype=bool, na_value=False)
+    if op == 'datestartswith': return texto.str.startswith(valor).to_numpy(dtype=bool, na_value=False)
+    return OPERADORES_FILTRO[op](texto, valor).to_numpy(dtype=bool, na_value=False)
+
+class AlmacenamientoSQLite(AlmacenamientoCSV):
+    # Una conexión por hilo y proceso; WAL permite lecturas concurrentes mientras otro worker escribe
+    nombre = 'sqlite'
+    def __init__(self, db_path, data_path=DATA_PATH):
+        self.db_path = db_path; self._local = threading.local()
+        with self._transaccion() as con:
+            con.execute('CREATE TABLE IF NOT EXISTS _versiones (tabla TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+            con.execute('CREATE TABLE IF NOT EXISTS _parametros (clave TEXT PRIMARY KEY, valor TEXT)')
+        importar_csv_a_sqlite(self, data_path); self._migrar_cantidades(); self._migrar_numeros_como_texto()
+    def _conexion(self):
+        con = getattr(self._local, 'con', None)
+        if con is None or getattr(self._local, 'pid', None) != os.getpid():
+            con = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            con.execute('PRAGMA journal_mode=WAL'); con.execute('PRAGMA synchronous=NORMAL')
+            con.create_function('minusculas', 1, lambda texto: texto.lower() if isinstance(texto, str) else texto, deterministic=True)
+            self._local.con, self._local.pid = con, os.getpid()
+        return con
+    @contextmanager
+    def _transaccion(self):
+        con = self._conexion(); con.execute('BEGIN IMMEDIATE')
+        try: yield con
+        except BaseException: con.execute('ROLLBACK'); raise
+        else: con.execute('COMMIT')
+    @staticmethod
+    def tabla(filepath): return os.path.splitext(os.path.basename(filepath))[0]
+    @staticmethod
+    def _q(nombre): return '"' + str(nombre).replace('"', '""') + '"'
+    def existe(self, filepath):
+        return self._conexion().execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (self.tabla(filepath),)).fetchone() is not None
+    def firma(self, filepath):
+        fila = self._conexion().execute('SELECT version FROM _versiones WHERE tabla=?', (self.tabla(filepath),)).fetchone()
+        return (fila[0] if fila else 0,)
+    @medir_almacenamiento('leer')
+    def leer(self, filepath): return self._leer_sql(f'SELECT * FROM {self._q(self.tabla(filepath))}')
+    def _leer_sql(self, sql, params=()):
+        cur = self._conexion().execute(sql, params)
+        df = pd.DataFrame.from_records(cur.fetchall(), columns=[c[0] for c in cur.description], coerce_float=True)
+        # Igual que read_csv: columnas completamente vacías quedan como float NaN
+        for col in df.columns[df.isna().all().to_numpy()]: df[col] = np.nan
+        return df
+    @medir_almacenamiento('escribir')
+    def escribir(self, filepath, df):
+        tabla = self._q(self.tabla(filepath))
+        df_sql = df.copy()
+        # Las cantidades son REAL aunque lleguen como texto o vacías (seguimiento nuevo): así filtran y ordenan como números y los UPDATE por id quedan numéricos
+        for col in df_sql.columns.intersection(COLUMNAS_CANTIDAD): df_sql[col] = pd.to_numeric(df_sql[col], errors='coerce')
+        # Como al releer un CSV: una columna de texto cuyos valores son todos números (celdas editadas en la UI llegan como texto) se guarda numérica
+        for col in df_sql.columns[[t == object or pd.api.types.is_string_dtype(t) for t in df_sql.dtypes]]:
+            valores = df_sql[col].where(df_sql[col] != ''); numeros = pd.to_numeric(valores, errors='coerce')
+            if valores.notna().any() and numeros.notna().sum() == valores.notna().sum(): df_sql[col] = numeros
+        columnas = ', '.join(f'{self._q(c)} {self._tipo_sql(c, df_sql[c].dtype)}' for c in df_sql.columns)
+        for col in df_sql.columns[[t.kind == 'M' for t in df_sql.dtypes]]: df_sql[col] = df_sql[col].dt.strftime('%Y-%m-%d')
+        # Como en CSV, las celdas vacías se guardan como nulos
+        filas = df_sql.astype(object).where(df_sql.notna() & (df_sql.astype(object) != ''), None).itertuples(index=False, name=None)
+        with self._transaccion() as con:
+            con.execute(f'DROP TABLE IF EXISTS {tabla}')
+            if len(df.columns):
+                con.execute(f'CREATE TABLE {tabla} ({columnas})')
+                con.executemany(f'INSERT INTO {tabla} VALUES ({", ".join("?" * len(df.columns))})', filas)
+                self._crear_indices(con, self.tabla(filepath), df.columns)
+            con.execute('INSERT INTO _versiones (tabla, version) VALUES (?, 1) ON CONFLICT(tabla) DO UPDATE SET version = version + 1', (self.tabla(filepath),))
+    @staticmethod
+    def _tipo_sql(columna, dtype):
+        if columna in COLUMNAS_CANTIDAD: return 'REAL'
+        return {'i': 'INTEGER', 'u': 'INTEGER', 'b': 'INTEGER', 'f': 'REAL'}.get(dtype.kind, 'TEXT')
+    def _migrar_cantidades(self):
+        # Bases creadas con las cantidades como TEXT se reescriben una vez con la tabla tal cual, ahora declarada REAL
+        for filepath in TABLAS_CSV:
+            tipos = {fila[1]: fila[2] for fila in self._conexion().execute(f'PRAGMA table_info({self._q(self.tabla(filepath))})')}
+            if any(tipos.get(col, 'REAL') != 'REAL' for col in COLUMNAS_CANTIDAD): self.escribir(filepath, self.leer(filepath))
+    def _migrar_numeros_como_texto(self):
+        # Bases escritas antes de que escribir convirtiera las columnas de texto numéricas: cada tabla se reescribe una vez
+        if self._conexion().execute("SELECT 1 FROM _parametros WHERE clave='_migrado_numeros'").fetchone(): return
+        for filepath in TABLAS_CSV:
+            if self.existe(filepath): self.escribir(filepath, self.leer(filepath))
+        with self._transaccion() as con: con.execute("INSERT OR REPLACE INTO _parametros (clave, valor) VALUES ('_migrado_numeros', ?)", (datetime.datetime.now().isoformat(),))
+    @medir_almacenamiento('aplicar_cambios')
+    def aplicar_cambios(self, filepath, cambios):
+        # UPDATE por id en una sola transacción: el WAL de SQLite hace de diario y sus checkpoints de compactación
+        if not cambios: return
+        tabla = self._q(self.tabla(filepath))
+        with self._transaccion() as con:
+            columnas = {fila[1] for fila in con.execute(f'PRAGMA table_info({tabla})')}
+            con.execute(f'CREATE INDEX IF NOT EXISTS {self._q("idx_" + self.tabla(filepath) + "_id")} ON {tabla} ("id")')
+            for col in dict.fromkeys(c for _, c, _ in cambios):
+                if col not in columnas: con.execute(f'ALTER TABLE {tabla} ADD COLUMN {self._q(col)}' + (' REAL' if col in COLUMNAS_CANTIDAD else ''))
+                con.executemany(f'UPDATE {tabla} SET {self._q(col)} = ? WHERE "id" = ?', [(v, i) for i, c, v in cambios if c == col])
+            con.execute('INSERT INTO _versiones (tabla, version) VALUES (?, 1) ON CONFLICT(tabla) DO UPDATE SET version = version + 1', (self.tabla(filepath),))
+    def _crear_indices(self, con, tabla, columnas):
+        if all(c in columnas for c in COLUMNAS_INDICE_APLICACIONES):
+            con.execute(f'CREATE INDEX {self._q("idx_" + tabla + "_sector_valvula_fecha")} ON {self._q(tabla)} ({", ".join(map(self._q, COLUMNAS_INDICE_APLICACIONES))})')
+            con.execute(f'CREATE INDEX {self._q("idx_" + tabla + "_fecha")} ON {self._q(tabla)} ("Fecha Estimada")')
+        if 'Año Plantación' in columnas:
+            con.execute(f'CREATE INDEX {self._q("idx_" + tabla + "_anio")} ON {self._q(tabla)} ("Año Plantación")')
+    def eliminar(self, filepath):
+        with self._transaccion() as con:
+            con.execute(f'DROP TABLE IF EXISTS {self._q(self.tabla(filepath))}')
+            con.execute('DELETE FROM _parametros WHERE clave=?', (self.tabla(filepath),))
+            con.execute('INSERT INTO _versiones (tabla, version) VALUES (?, 1) ON CONFLICT(tabla) DO UPDATE SET version = version + 1', (self.tabla(filepath),))
+    def leer_texto(self, filepath):
+        fila = self._conexion().execute('SELECT valor FROM _parametros WHERE clave=?', (self.tabla(filepath),)).fetchone()
+        return fila[0] if fila else None
+    def escribir_texto(self, filepath, texto):
+        with self._transaccion() as con: con.execute('INSERT OR REPLACE INTO _parametros (clave, valor) VALUES (?, ?)', (self.tabla(filepath), texto))
+    @medir_almacenamiento('consultar')
+    def consultar(self, filepath, sector=None, anio=None, fecha=None, fecha_desde=None, fecha_hasta=None, solo_aplicadas=False, ordenar=False):
+        if not self.existe(filepath): return pd.DataFrame()
+        where, params = self._filtros_sql(sector, anio, fecha, fecha_desde, fecha_hasta, solo_aplicadas)
+        orden = ' ORDER BY "Fecha Estimada", "Válvula"' if ordenar else ''
+        return self._leer_sql(f'SELECT * FROM {self._q(self.tabla(filepath))}{where}{orden}', params)
+    def contar(self, filepath, **filtros):
+        if not self.existe(filepath): return 0
+        where, params = self._filtros_sql(**filtros)
+        return self._conexion().execute(f'SELECT COUNT(*) FROM {self._q(self.tabla(filepath))}{where}', params).fetchone()[0]
+    @medir_almacenamiento('consultar_pagina')
+    def consultar_pagina(self, filepath, filtros=(), orden=(), anio=None, offset=0, limite=None):
+        if not self.existe(filepath): return pd.DataFrame(), 0
+        tabla = self._q(self.tabla(filepath))
+        columnas = [fila[1] for fila in self._conexion().execute(f'PRAGMA table_info({tabla})')]
+        where, params = self._filtros_sql(anio=anio)
+        condiciones = [where[len(' WHERE '):]] if where else []
+        for col, op, valor in filtros:
+            if col not in columnas: continue
+            if op == 'blank': condiciones.append(f"({self._q(col)} IS NULL OR CAST({self._q(col)} AS TEXT) = '')"); continue
+            insensible = op[0] == 'i'; op = op[1:] if insensible else op
+            if isinstance(valor, (int, float)) and op in OPERADORES_FILTRO_SQL: condiciones.append(f'{self._q(col)} {OPERADORES_FILTRO_SQL[op]} ?'); params.append(valor); continue
+            # instr/substr en lugar de LIKE: distingue mayúsculas igual que el filtro en pandas; minusculas() es str.lower, como .str.lower()
+            texto, valor = (f'minusculas(CAST({self._q(col)} AS TEXT))', str(valor).lower()) if insensible else (f'CAST({self._q(col)} AS TEXT)', str(valor))
+            if op == 'contains': condiciones.append(f'instr({texto}, ?) > 0'); params.append(valor)
+            elif op == 'datestartswith': condiciones.append(f'substr({texto}, 1, ?) = ?'); params.extend([len(valor), valor])
+            else: condiciones.append(f'{texto if insensible else self._q(col)} {OPERADORES_FILTRO_SQL[op]} ?'); params.append(valor)
+        where = (' WHERE ' + ' AND '.join(condiciones)) if condiciones else ''
+        total = self._conexion().execute(f'SELECT COUNT(*) FROM {tabla}{where}', params).fetchone()[0]
+        orden_sql = ', '.join([f'{self._q(c)} {"ASC" if asc else "DESC"}' for c, asc in orden if c in columnas] + ['rowid'])
+        return self._leer_sql(f'SELECT * FROM {tabla}{where} ORDER BY {orden_sql} LIMIT ? OFFSET ?', params + [limite if limite else -1, offset]), total
+    @staticmethod
+    def _filtros_sql(sector=None, anio=None, fecha=None, fecha_desde=None, fecha_hasta=None, solo_aplicadas=False):
+        condiciones, params = [], []
+        if sector is not None: condiciones.append('"Sector" = ?'); params.append(sector)
+        if anio is not None: condiciones.append('"Año Plantación" = ?'); params.append(anio)
+        if fecha is not None: condiciones.append('"Fecha Estimada" = ?'); params.append(fecha)
+        if fecha_desde is not None: condiciones.append('"Fecha Estimada" >= ?'); params.append(fecha_desde)
+        if fecha_hasta is not None: condiciones.append('"Fecha Estimada" <= ?'); params.append(fecha_hasta)
+        if solo_aplicadas: condiciones.append('"Fecha Aplicación Real" IS NOT NULL')
+        return (' WHERE ' + ' AND '.join(condiciones) if condiciones else ''), params
+
+def importar_csv_a_sqlite(almacen, data_path=DATA_PATH):
+    # Importación única de los CSV existentes; queda registrada en _parametros y no vuelve a correr
+    con = almacen._conexion()
+    if con.execute("SELECT 1 FROM _parametros WHERE clave='_importado_csv'").fetchone(): return
+    csv = AlmacenamientoCSV()
+    for filepath in TABLAS_CSV:
+        ruta = os.path.join(data_path, os.path.basename(filepath))
+        if not almacen.existe(filepath) and csv.existe(ruta):
+            try: almacen.escribir(filepath, csv.leer(ruta))
+            except pd.errors.EmptyDataError: pass
+    for filepath in (FECHA_FILE, PROGRAMACION_FILE):
+        ruta = os.path.join(data_path, os.path.basename(filepath))
+        if almacen.leer_texto(filepath) is None and os.path.exists(ruta): almacen.escribir_texto(filepath, csv.leer_texto(ruta))
+    with almacen._transaccion() as con: con.execute("INSERT OR REPLACE INTO _parametros (clave, valor) VALUES ('_importado_csv', ?)", (datetime.datetime.now().isoformat(),))
+
+_almacenamiento = None
+_almacenamiento_lock = threading.Lock()
+def almacenamiento():
+    global _almacenamiento
+    with _almacenamiento_lock:
+        if _almacenamiento is None: _almacenamiento = AlmacenamientoSQLite(DB_FILE) if STORAGE_BACKEND == 'sqlite' else AlmacenamientoCSV()
+        return _almacenamiento
+def guardar_tabla(filepath, df): almacenamiento().escribir(filepath, df); invalidar_cache(filepath)
+def guardar_cambios_tabla(filepath, cambios): almacenamiento().aplicar_cambios(filepath, cambios); invalidar_cache(filepath)
+def eliminar_tabla(filepath): almacenamiento().eliminar(filepath); invalidar_cache(filepath)
+def leer_fecha_inicio(): return almacenamiento().leer_texto(FECHA_FILE)
+def guardar_fecha_inicio(fecha): almacenamiento().escribir_texto(FECHA_FILE, fecha)
+def leer_programacion():
+    texto = almacenamiento().leer_texto(PROGRAMACION_FILE)
+    return dict(PROGRAMACION_DEFECTO, **(json.loads(texto) if texto else {}))
+def guardar_programacion(programacion): almacenamiento().escribir_texto(PROGRAMACION_FILE, json.dumps(programacion))
+
+# --- Caché en memoria de tablas (clave: ruta + firma del backend, LRU acotado por memoria) ---
+# La firma es mtime/tamaño en CSV y un contador de versión por tabla en SQLite
+# Las tablas se entregan como copias superficiales: con Copy-on-Write (pandas >= 3, fijado en requirements.txt) comparten los datos con la cacheada
+# y escribir sobre una tabla entregada copia solo la columna tocada, nunca altera la cacheada
+CACHE_MAX_BYTES = int(os.environ.get('PLANIFICADOR_CACHE_MB', '64')) * 1024 * 1024
+_cache_tablas = OrderedDict()  # ruta -> (firma, df, bytes)
+_cache_lock = threading.Lock()
+_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidaciones': 0, 'bytes': 0}
+
+def _leer_tabla_cacheada(filepath):
+    firma = almacenamiento().firma(filepath)
+    with _cache_lock:
+        entrada = _cache_tablas.get(filepath)
+        if entrada is not None and entrada[0] == firma:
+            _cache_tablas.move_to_end(filepath); _cache_stats['hits'] += 1
+            return entrada[1].copy(deep=False)
+        _cache_stats['misses'] += 1
+    df = almacenamiento().leer(filepath)
+    tam = int(df.memory_usage(deep=True).sum())
+    with _cache_lock:
+        _descartar_de_cache(filepath)
+        if tam <= CACHE_MAX_BYTES:
+            _cache_tablas[filepath] = (firma, df, tam); _cache_stats['bytes'] += tam
+            while _cache_stats['bytes'] > CACHE_MAX_BYTES:
+                _, (_, _, tam_viejo) = _cache_tablas.popitem(last=False); _cache_stats['bytes'] -= tam_viejo; _cache_stats['evictions'] += 1
+    return df.copy(deep=False)
+def _descartar_de_cache(filepath):
+    entrada = _cache_tablas.pop(filepath, None)
+    if entrada is not None: _cache_stats['bytes'] -= entrada[2]
+    return entrada is not None
+def invalidar_cache(*filepaths):
+    with _cache_lock:
+        for filepath in (filepaths or list(_cache_tablas)):
+            if _descartar_de_cache(filepath): _cache_stats['invalidaciones'] += 1
+def estadisticas_cache():
+    with _cache_lock: return dict(_cache_stats, entradas=len(_cache_tablas))
+
+# --- Modelo compacto de planes ---
+# Representación interna tipada de planes y aplicaciones: textos repetidos como categorías (ordenadas), cantidades en float64 (los litros que guardan los planes son los calculados),
+# fechas como días desde 1970 en int32 (DIA_NULO si falta) y válvulas en formato largo. Lo guardado y lo que se muestra o exporta sigue en el formato de siempre.
+DIA_NULO = np.iinfo(np.int32).min
+COLUMNAS_CATEGORIA = ['Sector', 'Producto', 'Válvula', 'Mes Plan', 'Mes', 'Nutriente Cubierto']
+COLUMNAS_FECHA = ['Fecha Estimada', 'Fecha Aplicación Real']
+COLUMNA_PLAN_ORIGINAL = 'Litros Planeados Originales'  # plan semanal sin ajustes: el auto-ajuste del seguimiento siempre parte de él
+COLUMNAS_CANTIDAD = ['Litros Planeados', COLUMNA_PLAN_ORIGINAL, 'Litros Reales Aplicados']
+def dias_desde_fechas(serie):
+    # Texto ISO, datetime o vacío -> días en int32 (una sola conversión por columna)
+    fechas = serie if pd.api.types.is_datetime64_any_dtype(serie) else pd.to_datetime(serie.where(serie.astype(str) != ''), errors='coerce', format='ISO8601')
+    dias = fechas.to_numpy(dtype='datetime64[D]')
+    return np.where(np.isnat(dias), DIA_NULO, dias.astype(np.int64)).astype(np.int32)
+def fechas_desde_dias(dias, unidad='D'):
+    # Días -> texto 'YYYY-MM-DD' (o 'YYYY-MM' con unidad='M'); solo se formatean los valores distintos
+    dias = np.asarray(dias)
+    unicos, inversa = np.unique(dias, return_inverse=True)
+    textos = np.where(unicos == DIA_NULO, None, np.datetime_as_string(unicos.astype('datetime64[D]').astype(f'datetime64[{unidad}]'), unit=unidad)).astype(object)
+    return textos[inversa.reshape(-1)]
+def compactar_plan(df):
+    compacto = df.copy()
+    for col in compacto.columns:
+        if col in COLUMNAS_CATEGORIA: compacto[col] = compacto[col].astype('category')
+        elif col in COLUMNAS_FECHA: compacto[col] = dias_desde_fechas(compacto[col])
+        elif col in COLUMNAS_CANTIDAD: compacto[col] = pd.to_numeric(compacto[col], errors='coerce').astype(np.float64)
+        elif col == 'Año Plantación' and pd.api.types.is_integer_dtype(compacto[col]): compacto[col] = compacto[col].astype(np.int16)
+    return compacto
+def expandir_plan(df):
+    # Inverso de compactar_plan; las tablas que ya están en formato de almacenamiento pasan sin copiarse
+    convertir = [col for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype) or (col in COLUMNAS_FECHA and pd.api.types.is_integer_dtype(df[col])) or df[col].dtype == np.float32 or df[col].dtype == np.int16]
+    if not convertir: return df
+    df = df.copy()
+    for col in convertir:
+        if isinstance(df[col].dtype, pd.CategoricalDtype): df[col] = df[col].astype(df[col].cat.categories.dtype)
+        elif col in COLUMNAS_FECHA and pd.api.types.is_integer_dtype(df[col]): df[col] = fechas_desde_dias(df[col].to_numpy())
+        elif df[col].dtype == np.float32: df[col] = df[col].to_numpy().astype(str).astype(np.float64)  # planes registrados con cantidades en float32: vía el decimal más corto, 12.3 y no 12.300000190734863
+        else: df[col] = df[col].astype(np.int64)
+    return df
+def indice_valvulas_largo(df_valvulas):
+    # Tabla ancha 'Año', Valvula_1..N -> filas (Año Plantación, Subbloque, Válvula, Superficie). El decimal de 'Año' es el sub-bloque (2018.1 -> 2018, 1).
+    # Una válvula está activa en un (año, sub-bloque) si no tiene nulos en ninguna de sus filas y la superficie de la primera es positiva
+    anio = pd.to_numeric(df_valvulas['Año'], errors='coerce').to_numpy(dtype=float)
+    cols_valv = [c for c in df_valvulas.columns if c != 'Año']
+    valores = df_valvulas[cols_valv].to_numpy(dtype=float)[~np.isnan(anio)]; anio = anio[~np.isnan(anio)]
+    vintage = np.floor(anio).astype(np.int64); subbloque = np.rint((anio - vintage) * 10).astype(np.int64)
+    # Grupos (año, sub-bloque) en orden de primera aparición
+    _, primero, grupo = np.unique(vintage * 100 + subbloque, return_index=True, return_inverse=True)
+    rango = np.empty(len(primero), dtype=np.int64); rango[np.argsort(primero, kind='stable')] = np.arange(len(primero))
+    grupo, primero = rango[grupo.reshape(-1)], np.sort(primero)
+    nulos = np.zeros((len(primero), len(cols_valv)), dtype=np.int64); np.add.at(nulos, grupo, np.isnan(valores))
+    sup = valores[primero]
+    activas = (nulos == 0) & (sup > 0)
+    i_grupo, i_col = np.nonzero(activas)  # orden fila mayor: por (año, sub-bloque) y luego por columna, como el recorrido original
+    return pd.DataFrame({'Año Plantación': vintage[primero][i_grupo].astype(np.int16), 'Subbloque': subbloque[primero][i_grupo].astype(np.int8),
+                         'Válvula': pd.Categorical.from_codes(i_col, categories=cols_valv), 'Superficie': sup[i_grupo, i_col]})
+
 # --- Funciones de Lógica ---
 def cargar_o_crear(filepath, default_function):
-    if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
-        try: return pd.read_csv(filepath)
+    if almacenamiento().existe(filepath):
+        try: return _leer_tabla_cacheada(filepath)
         except pd.errors.EmptyDataError: return default_function()
     else:
-        df = default_function(); df.to_csv(filepath, index=False); return df
-def generar_plan_mensual_economico():
+        df = default_function(); guardar_tabla(filepath, df); return df
+ANIOS_DISTRIBUCION_1 = [2011, 2012, 2016, 2017]
+def distribucion_para_anio(anio, df_dist1, df_dist2): return df_dist1 if anio in ANIOS_DISTRIBUCION_1 else df_dist2
+COL_MAP_NUTRIENTES = {'N': 'N', 'P': 'P2O5', 'K': 'K2O', 'Mg': 'MgO'}
+COLUMNAS_PLAN_MENSUAL = ['Sector', 'Año Plantación', 'Mes', 'Nutriente Cubierto', 'Producto', 'Dosis_kg_ha', 'Total_kg', 'Dosis_lt_ha', 'Total_lt', 'Precio_usd_ha', 'Costo_total_usd']
+
+def tablas_plan_mensual(): return cargar_o_crear(REQ_FILE, definir_requerimientos), cargar_o_crear(FERT_FILE, definir_fertilizantes), cargar_o_crear(DIST1_FILE, definir_distribucion1), cargar_o_crear(DIST2_FILE, definir_distribucion2)
+def generar_plan_mensual_economico(modo='incremental', tablas=None):
     try:
-        df_req = cargar_o_crear(REQ_FILE, definir_requerimientos); df_fert = cargar_o_crear(FERT_FILE, definir_fertilizantes); df_dist1 = cargar_o_crear(DIST1_FILE, definir_distribucion1); df_dist2 = cargar_o_crear(DIST2_FILE, definir_distribucion2)
-        col_map_nutrientes = {'N': 'N', 'P': 'P2O5', 'K': 'K2O', 'Mg': 'MgO'}; resultados_list = []
-        for _, req_row in df_req.iterrows():
-            if pd.isna(req_row['Anio']) or pd.isna(req_row['Sup_ha']) or req_row['Sup_ha'] <= 0: continue
-            anio_req = int(req_row['Anio']); dist = df_dist1 if anio_req in [2011, 2012, 2016, 2017] else df_dist2
-            for _, dist_row in dist.iterrows():
-                req_nutrientes_mes = {'N': req_row['N'] * dist_row['N'], 'P': req_row['P'] * dist_row['P'], 'K': req_row['K'] * dist_row['K'], 'Mg': req_row['Mg'] * dist_row['Mg']}
-                for nutriente, req_kg_ha in req_nutrientes_mes.items():
-                    if pd.isna(req_kg_ha) or req_kg_ha <= 0: continue
-                    col_fert = col_map_nutrientes.get(nutriente)
-                    if not col_fert: continue
-                    fert_disponibles = df_fert[df_fert[col_fert] > 0]
-                    if fert_disponibles.empty: continue
-                    best_option, min_cost = None, float('inf')
-                    for _, fert_row in fert_disponibles.iterrows():
-                        concentracion, precio_kg, densidad = fert_row[col_fert], fert_row['Precio'], fert_row['Densidad']
-                        if any(pd.isna([concentracion, precio_kg, densidad])) or densidad == 0 or concentracion == 0: continue
-                        kg_producto_ha_final = req_kg_ha / concentracion
-                        costo_total = kg_producto_ha_final * req_row['Sup_ha'] * precio_kg
-                        if costo_total < min_cost:
-                            min_cost = costo_total
-                            best_option = {'Sector': req_row['Sector'], 'Año Plantación': req_row['Anio'], 'Mes': dist_row['Mes'], 'Nutriente Cubierto': nutriente, 'Producto': fert_row['Producto'], 'Dosis_kg_ha': kg_producto_ha_final, 'Total_kg': kg_producto_ha_final * req_row['Sup_ha'], 'Dosis_lt_ha': (kg_producto_ha_final / densidad), 'Total_lt': (kg_producto_ha_final * req_row['Sup_ha'] / densidad), 'Precio_usd_ha': kg_producto_ha_final * precio_kg, 'Costo_total_usd': costo_total}
-                    if best_option: resultados_list.append(best_option)
-        if not resultados_list: return pd.DataFrame({'Mensaje': ["No se generaron opciones."]})
-        return pd.DataFrame(resultados_list)
+        df_req, df_fert, df_dist1, df_dist2 = tablas if tablas is not None else tablas_plan_mensual()
+        return calcular_plan_mensual(df_req, df_fert, df_dist1, df_dist2, modo=modo)
     except Exception as e: return pd.DataFrame({'Error': [f"Ocurrió un error: {e}"]})
-def generar_plan_semanal(df_plan_mensual, df_valvulas, df_limites, fecha_inicio_riego_str):
+def calcular_plan_mensual(df_req, df_fert, df_dist1, df_dist2, modo='incremental'):
+    # 'referencia' conserva el recorrido fila a fila original para pruebas de equivalencia; 'incremental' reutiliza los sector-mes ya calculados
+    if modo == 'referencia': resultados_list = _plan_mensual_referencia(df_req, df_fert, df_dist1, df_dist2)
+    elif modo == 'incremental': resultados_list = _plan_mensual_incremental(df_req, df_fert, df_dist1, df_dist2)
+    elif modo == 'vectorizado': resultados_list = _plan_mensual_vectorizado(df_req, df_fert, df_dist1, df_dist2)
+    else: raise ValueError(f"Modo de cálculo desconocido: {modo}")
+    if resultados_list is None or len(resultados_list) == 0: return pd.DataFrame({'Mensaje': ["No se generaron opciones."]})
+    return pd.DataFrame(resultados_list)
+def _plan_mensual_referencia(df_req, df_fert, df_dist1, df_dist2):
+    resultados_list = []
+    for _, req_row in df_req.iterrows():
+        if pd.isna(req_row['Anio']) or pd.isna(req_row['Sup_ha']) or req_row['Sup_ha'] <= 0: continue
+        anio_req = int(req_row['Anio']); dist = distribucion_para_anio(anio_req, df_dist1, df_dist2)
+        for _, dist_row in dist.iterrows():
+            req_nutrientes_mes = {'N': req_row['N'] * dist_row['N'], 'P': req_row['P'] * dist_row['P'], 'K': req_row['K'] * dist_row['K'], 'Mg': req_row['Mg'] * dist_row['Mg']}
+            for nutriente, req_kg_ha in req_nutrientes_mes.items():
+                if pd.isna(req_kg_ha) or req_kg_ha <= 0: continue
+                col_fert = COL_MAP_NUTRIENTES.get(nutriente)
+                if not col_fert: continue
+                fert_disponibles = df_fert[df_fert[col_fert] > 0]
+                if fert_disponibles.empty: continue
+                best_option, min_cost = None, float('inf')
+                for _, fert_row in fert_disponibles.iterrows():
+                    concentracion, precio_kg, densidad = fert_row[col_fert], fert_row['Precio'], fert_row['Densidad']
+                    if any(pd.isna([concentracion, precio_kg, densidad])) or densidad == 0 or concentracion == 0: continue
+                    kg_producto_ha_final = req_kg_ha / concentracion
+                    costo_total = kg_producto_ha_final * req_row['Sup_ha'] * precio_kg
+                    if costo_total < min_cost:
+                        min_cost = costo_total
+                        best_option = {'Sector': req_row['Sector'], 'Año Plantación': req_row['Anio'], 'Mes': dist_row['Mes'], 'Nutriente Cubierto': nutriente, 'Producto': fert_row['Producto'], 'Dosis_kg_ha': kg_producto_ha_final, 'Total_kg': kg_producto_ha_final * req_row['Sup_ha'], 'Dosis_lt_ha': (kg_producto_ha_final / densidad), 'Total_lt': (kg_producto_ha_final * req_row['Sup_ha'] / densidad), 'Precio_usd_ha': kg_producto_ha_final * precio_kg, 'Costo_total_usd': costo_total}
+                if best_option: resultados_list.append(best_option)
+    return resultados_list
+def _plan_mensual_vectorizado(df_req, df_fert, df_dist1, df_dist2, posiciones=False):
+    # Grilla sector x mes x nutriente x producto construida una sola vez; el producto más barato se elige con argmin
+    nutrientes = list(COL_MAP_NUTRIENTES.keys())
+    sup = pd.to_numeric(df_req['Sup_ha'], errors='coerce').to_numpy(dtype=float)
+    anios = pd.to_numeric(df_req['Anio'], errors='coerce').to_numpy(dtype=float)
+    validas = ~np.isnan(anios) & ~np.isnan(sup) & (sup > 0)
+    if not validas.any() or df_fert.empty: return (None, None, None) if posiciones else None
+    conc = np.stack([pd.to_numeric(df_fert[COL_MAP_NUTRIENTES[n]], errors='coerce').to_numpy(dtype=float) for n in nutrientes])  # (nutriente, producto)
+    precio = pd.to_numeric(df_fert['Precio'], errors='coerce').to_numpy(dtype=float); densidad = pd.to_numeric(df_fert['Densidad'], errors='coerce').to_numpy(dtype=float)
+    candidato = (conc > 0) & ~np.isnan(precio) & ~np.isnan(densidad) & (densidad != 0)
+    conc_segura = np.where(candidato, conc, 1.0)
+    req_nut = df_req[nutrientes].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)  # (fila, nutriente)
+    usa_dist1 = np.isin(np.trunc(anios), ANIOS_DISTRIBUCION_1)
+    bloques = []
+    for dist, mascara in ((df_dist1, validas & usa_dist1), (df_dist2, validas & ~usa_dist1)):
+        filas = np.flatnonzero(mascara)
+        if filas.size == 0 or dist.empty: continue
+        frac = dist[nutrientes].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)  # (mes, nutriente)
+        req_kg_ha = req_nut[filas][:, None, :] * frac[None, :, :]  # (fila, mes, nutriente)
+        kg_ha = req_kg_ha[..., None] / conc_segura[None, None, :, :]  # (fila, mes, nutriente, producto)
+        with np.errstate(invalid='ignore'):
+            costo = kg_ha * sup[filas][:, None, None, None] * precio[None, None, None, :]
+        costo = np.where(candidato[None, None, :, :] & ~np.isnan(costo), costo, np.inf)
+        mejor = np.argmin(costo, axis=3)
+        costo_min = np.take_along_axis(costo, mejor[..., None], axis=3)[..., 0]
+        with np.errstate(invalid='ignore'):
+            elegido = (req_kg_ha > 0) & np.isfinite(costo_min)
+        i_f, i_m, i_n = np.nonzero(elegido)
+        if i_f.size == 0: continue
+        bloques.append((filas[i_f], i_m, i_n, mejor[i_f, i_m, i_n], req_kg_ha[i_f, i_m, i_n], costo_min[i_f, i_m, i_n], dist['Mes'].to_numpy()[i_m]))
+    if not bloques: return (None, None, None) if posiciones else None
+    fila, i_mes, i_nut, i_prod, req_kg_ha, costo_total, meses = (np.concatenate(partes) for partes in zip(*bloques))
+    orden = np.lexsort((i_nut, i_mes, fila)); fila, i_mes, i_nut, i_prod, req_kg_ha, costo_total, meses = fila[orden], i_mes[orden], i_nut[orden], i_prod[orden], req_kg_ha[orden], costo_total[orden], meses[orden]
+    kg_producto_ha_final = req_kg_ha / conc[i_nut, i_prod]; sup_fila = sup[fila]; precio_kg = precio[i_prod]; dens = densidad[i_prod]
+    df = pd.DataFrame({'Sector': df_req['Sector'].to_numpy()[fila], 'Año Plantación': df_req['Anio'].to_numpy()[fila], 'Mes': meses, 'Nutriente Cubierto': np.array(nutrientes, dtype=object)[i_nut], 'Producto': df_fert['Producto'].to_numpy()[i_prod],
+                         'Dosis_kg_ha': kg_producto_ha_final, 'Total_kg': kg_producto_ha_final * sup_fila, 'Dosis_lt_ha': kg_producto_ha_final / dens, 'Total_lt': kg_producto_ha_final * sup_fila / dens, 'Precio_usd_ha': kg_producto_ha_final * precio_kg, 'Costo_total_usd': costo_total}, columns=COLUMNAS_PLAN_MENSUAL)
+    # posiciones: fila de df_req y fila de la distribución de cada resultado, para repartirlos por sector-mes
+    return (df, fila, i_mes) if posiciones else df
+NIVELES_MESES_DIST = ["Octubre", "Noviembre", "Diciembre", "Enero", "Febrero/Marzo"]
+COLUMNAS_PLAN_SEMANAL = ['Sector', 'Año Plantación', 'Mes Plan', 'Producto', 'Válvula', 'Fecha Estimada', 'Litros Planeados']
+
+def generar_plan_semanal(df_plan_mensual, df_valvulas, df_limites, fecha_inicio_riego_str, modo='incremental', df_fert=None, programacion=None):
+    # programacion: None o modo 'lunes' deja cada aplicación en el lunes de su semana; 'capacidad' la reparte con programar_aplicaciones
     if df_plan_mensual.empty or "Mensaje" in df_plan_mensual.columns or "Error" in df_plan_mensual.columns: return pd.DataFrame({'Error': ["Se necesita un Plan Mensual válido."]})
     try:
         df_limites_dict = df_limites.set_index('Nutriente')['Limite_kg_ha_app'].to_dict()
+        # Un límite vacío o <= 0 haría infinitas (o indefinidas) las aplicaciones: los tres modos fallan igual en lugar de descartar el nutriente
+        limites = pd.to_numeric(pd.Series({n: df_limites_dict.get(n, 40) for n in df_plan_mensual['Nutriente Cubierto'].dropna().unique()}, dtype=object), errors='coerce')
+        invalidos = limites.index[~(np.isfinite(limites.to_numpy(dtype=float)) & (limites.to_numpy(dtype=float) > 0))]
+        if len(invalidos): raise ValueError(f"Límite por aplicación vacío o no positivo para: {', '.join(map(str, invalidos))}")
         fecha_inicio_plan_global = datetime.datetime.strptime(fecha_inicio_riego_str, '%Y-%m-%d').date()
-        df_fert = cargar_o_crear(FERT_FILE, definir_fertilizantes)
-        col_map_nutrientes = {'N': 'N', 'P': 'P2O5', 'K': 'K2O', 'Mg': 'MgO'}
-        niveles_meses_dist = ["Octubre", "Noviembre", "Diciembre", "Enero", "Febrero/Marzo"]
-        plan_semanal_list = []
-        for index, fila in df_plan_mensual.iterrows():
-            nutriente_actual = fila['Nutriente Cubierto']
-            max_kg_nutriente_puro_ha_app = float(df_limites_dict.get(nutriente_actual, 40))
-            anio_plan_vintage = fila['Año Plantación']
-            producto_info_list = df_fert[df_fert['Producto'] == fila['Producto']]
-            if producto_info_list.empty: continue
-            producto_info = producto_info_list.iloc[0]
-            concentracion_nutriente = producto_info.get(col_map_nutrientes.get(nutriente_actual))
-            if pd.isna(concentracion_nutriente) or concentracion_nutriente <= 0 or pd.isna(producto_info['Densidad']) or producto_info['Densidad'] <= 0: continue
-            valv_row = df_valvulas[df_valvulas['Año'] == fila['Año Plantación']]
-            if valv_row.empty: continue
-            valvulas_activas = valv_row.drop(columns=['Año']).dropna(axis=1)
-            if valvulas_activas.empty: continue
-            dosis_producto_ha_mes = fila['Dosis_kg_ha']
-            kg_nutriente_ha_mes = dosis_producto_ha_mes * concentracion_nutriente
-            num_total_aplicaciones = np.ceil(kg_nutriente_ha_mes / max_kg_nutriente_puro_ha_app) if kg_nutriente_ha_mes > 0 else 0
-            if num_total_aplicaciones == 0: continue
-            tasa_producto_ha_app_real = dosis_producto_ha_mes / num_total_aplicaciones
-            try: mes_offset = niveles_meses_dist.index(fila['Mes'])
-            except ValueError: continue
-            fecha_inicio_mes_teorico = (fecha_inicio_plan_global.replace(day=1) + relativedelta(months=mes_offset))
-            fecha_de_partida = max(fecha_inicio_plan_global, fecha_inicio_mes_teorico)
-            fechas_aplicacion = pd.to_datetime(pd.date_range(start=fecha_de_partida, periods=int(num_total_aplicaciones), freq='W-MON').date)
-            for valv_nombre, sup_valvula_series in valvulas_activas.items():
-                sup_valvula = sup_valvula_series.iloc[0]
-                if pd.isna(sup_valvula) or sup_valvula <= 0: continue
-                kg_producto_valvula_app = tasa_producto_ha_app_real * sup_valvula
-                lt_producto_valvula_app = kg_producto_valvula_app / producto_info['Densidad']
-                for app_idx in range(int(num_total_aplicaciones)):
-                    fecha_app_estimada = fechas_aplicacion[app_idx]
-                    plan_semanal_list.append({'Sector': fila['Sector'],'Año Plantación': anio_plan_vintage,'Mes Plan': fila['Mes'],'Producto': fila['Producto'],'Válvula': valv_nombre,'Fecha Estimada': fecha_app_estimada,'Litros Planeados': lt_producto_valvula_app})
-        return pd.DataFrame(plan_semanal_list) if plan_semanal_list else pd.DataFrame()
+        if df_fert is None: df_fert = cargar_o_crear(FERT_FILE, definir_fertilizantes)
+        if modo == 'referencia': df = _plan_semanal_referencia(df_plan_mensual, df_valvulas, df_limites_dict, fecha_inicio_plan_global, df_fert)
+        elif modo == 'incremental': df = _plan_semanal_incremental(df_plan_mensual, df_valvulas, df_limites_dict, fecha_inicio_plan_global, df_fert)
+        elif modo == 'vectorizado': df = _plan_semanal_vectorizado(df_plan_mensual, df_valvulas, df_limites_dict, fecha_inicio_plan_global, df_fert)
+        else: raise ValueError(f"Modo de cálculo desconocido: {modo}")
+        if programacion is not None and programacion.get('modo', 'lunes') != 'lunes': df = programar_aplicaciones(df, df_valvulas, programacion)
+        return df
     except Exception as e: print(f"Error EXCEPCIONAL en generar_plan_semanal: {e}"); return pd.DataFrame({'Error': [f"Error al generar plan semanal: {e}"]})
+def _plan_semanal_referencia(df_plan_mensual, df_valvulas, df_limites_dict, fecha_inicio_plan_global, df_fert):
+    plan_semanal_list = []
+    for index, fila in df_plan_mensual.iterrows():
+        nutriente_actual = fila['Nutriente Cubierto']
+        max_kg_nutriente_puro_ha_app = float(df_limites_dict.get(nutriente_actual, 40))
+        anio_plan_vintage = fila['Año Plantación']
+        producto_info_list = df_fert[df_fert['Producto'] == fila['Producto']]
+        if producto_info_list.empty: continue
+        producto_info = producto_info_list.iloc[0]
+        concentracion_nutriente = producto_info.get(COL_MAP_NUTRIENTES.get(nutriente_actual))
+        if pd.isna(concentracion_nutriente) or concentracion_nutriente <= 0 or pd.isna(producto_info['Densidad']) or producto_info['Densidad'] <= 0: continue
+        valv_row = df_valvulas[df_valvulas['Año'] == fila['Año Plantación']]
+        if valv_row.empty: continue
+        valvulas_activas = valv_row.drop(columns=['Año']).dropna(axis=1)
+        if valvulas_activas.empty: continue
+        dosis_producto_ha_mes = fila['Dosis_kg_ha']
+        kg_nutriente_ha_mes = dosis_producto_ha_mes * concentracion_nutriente
+        num_total_aplicaciones = np.ceil(kg_nutriente_ha_mes / max_kg_nutriente_puro_ha_app) if kg_nutriente_ha_mes > 0 else 0
+        if num_total_aplicaciones == 0: continue
+        tasa_producto_ha_app_real = dosis_producto_ha_mes / num_total_aplicaciones
+        try: mes_offset = NIVELES_MESES_DIST.index(fila['Mes'])
+        except ValueError: continue
+        fecha_inicio_mes_teorico = (fecha_inicio_plan_global.replace(day=1) + relativedelta(months=mes_offset))
+        fecha_de_partida = max(fecha_inicio_plan_global, fecha_inicio_mes_teorico)
+        fechas_aplicacion = pd.to_datetime(pd.date_range(start=fecha_de_partida, periods=int(num_total_aplicaciones), freq='W-MON').date)
+        for valv_nombre, sup_valvula_series in valvulas_activas.items():
+            sup_valvula = sup_valvula_series.iloc[0]
+            if pd.isna(sup_valvula) or sup_valvula <= 0: continue
+            kg_producto_valvula_app = tasa_producto_ha_app_real * sup_valvula
+            lt_producto_valvula_app = kg_producto_valvula_app / producto_info['Densidad']
+            for app_idx in range(int(num_total_aplicaciones)):
+                fecha_app_estimada = fechas_aplicacion[app_idx]
+                plan_semanal_list.append({'Sector': fila['Sector'],'Año Plantación': anio_plan_vintage,'Mes Plan': fila['Mes'],'Producto': fila['Producto'],'Válvula': valv_nombre,'Fecha Estimada': fecha_app_estimada,'Litros Planeados': lt_producto_valvula_app})
+    return pd.DataFrame(plan_semanal_list) if plan_semanal_list else pd.DataFrame()
+def _indice_valvulas(df_valvulas):
+    # Válvulas por año de plantación desde el índice largo; el plan usa el sub-bloque 0 (clave entera, sin igualdad de floats)
+    largo = indice_valvulas_largo(df_valvulas)
+    largo = largo[largo['Subbloque'].to_numpy() == 0]
+    anios, inicio = np.unique(largo['Año Plantación'].to_numpy(), return_index=True)
+    orden = np.argsort(inicio, kind='stable'); anios, inicio = anios[orden], inicio[orden]
+    return pd.Index(anios.astype(np.int64)), np.append(inicio, len(largo)), largo['Válvula'].to_numpy(dtype=object), largo['Superficie'].to_numpy(dtype=float)
+def _dias_desde_epoch(fecha): return (fecha - datetime.date(1970, 1, 1)).days
+def _plan_semanal_vectorizado(df_plan_mensual, df_valvulas, df_limites_dict, fecha_inicio_plan_global, df_fert, posiciones=False):
+    plan = df_plan_mensual.reset_index(drop=True)
+    # Búsquedas pre-indexadas de producto y válvulas
+    fert_idx = df_fert.drop_duplicates('Producto').set_index('Producto')
+    pos_prod = fert_idx.index.get_indexer(plan['Producto'])
+    nutrientes = list(COL_MAP_NUTRIENTES.keys())
+    conc_tabla = np.column_stack([pd.to_numeric(fert_idx[COL_MAP_NUTRIENTES[n]], errors='coerce').to_numpy(dtype=float) for n in nutrientes] + [np.full(len(fert_idx), np.nan)])
+    pos_nut = pd.Index(nutrientes).get_indexer(plan['Nutriente Cubierto']); pos_nut[pos_nut < 0] = len(nutrientes)
+    conc = np.where(pos_prod >= 0, conc_tabla[pos_prod, pos_nut], np.nan)
+    densidad = np.where(pos_prod >= 0, pd.to_numeric(fert_idx['Densidad'], errors='coerce').to_numpy(dtype=float)[pos_prod], np.nan)
+    limites = {n: float(df_limites_dict.get(n, 40)) for n in plan['Nutriente Cubierto'].unique()}
+    limite = plan['Nutriente Cubierto'].map(limites).to_numpy(dtype=float)
+    anios_valv, inicio_valv, nombres_valv, sup_valv = _indice_valvulas(df_valvulas)
+    pos_anio = anios_valv.get_indexer(pd.to_numeric(plan['Año Plantación'], errors='coerce').astype(float))
+    pos_anio_seguro = np.where(pos_anio >= 0, pos_anio, 0)
+    num_valvulas = np.where(pos_anio >= 0, inicio_valv[pos_anio_seguro + 1] - inicio_valv[pos_anio_seguro], 0)
+    # Cantidad de aplicaciones con ceil vectorizado
+    dosis = pd.to_numeric(plan['Dosis_kg_ha'], errors='coerce').to_numpy(dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        kg_nutriente = dosis * conc
+        num_apps = np.where(kg_nutriente > 0, np.ceil(kg_nutriente / limite), 0)
+    mes_offset = plan['Mes'].map({mes: i for i, mes in enumerate(NIVELES_MESES_DIST)}).to_numpy(dtype=float)
+    with np.errstate(invalid='ignore'):
+        validas = (conc > 0) & (densidad > 0) & (num_valvulas > 0) & (num_apps > 0) & ~np.isnan(mes_offset)
+    filas = np.flatnonzero(validas)
+    if filas.size == 0: return (pd.DataFrame(), np.empty(0, dtype=np.int64)) if posiciones else pd.DataFrame()
+    # Primer lunes desde el inicio de cada mes como desplazamiento entero en días (1970-01-01 fue jueves)
+    partida = {off: _dias_desde_epoch(max(fecha_inicio_plan_global, fecha_inicio_plan_global.replace(day=1) + relativedelta(months=off))) for off in range(len(NIVELES_MESES_DIST))}
+    dia_partida = np.array([partida[off] for off in mes_offset[filas].astype(int)], dtype=np.int64)
+    primer_lunes = dia_partida + (-(dia_partida + 3)) % 7
+    apps = num_apps[filas].astype(np.int64); valvs = num_valvulas[filas]
+    # Expansión fila -> válvula x aplicación con repeat sobre arreglos
+    por_fila = apps * valvs
+    origen = np.repeat(np.arange(filas.size), por_fila)
+    local = np.arange(origen.size) - np.repeat(np.cumsum(por_fila) - por_fila, por_fila)
+    i_valv = inicio_valv[pos_anio[filas]][origen] + local // apps[origen]
+    i_app = local % apps[origen]
+    fila_orig = filas[origen]
+    tasa = dosis[filas] / num_apps[filas]
+    litros = tasa[origen] * sup_valv[i_valv] / densidad[fila_orig]
+    dias = primer_lunes[origen] + 7 * i_app
+    df = pd.DataFrame({'Sector': plan['Sector'].to_numpy()[fila_orig], 'Año Plantación': plan['Año Plantación'].to_numpy()[fila_orig], 'Mes Plan': plan['Mes'].to_numpy()[fila_orig], 'Producto': plan['Producto'].to_numpy()[fila_orig],
+                       'Válvula': nombres_valv[i_valv], 'Fecha Estimada': pd.to_datetime(dias, unit='D'), 'Litros Planeados': litros}, columns=COLUMNAS_PLAN_SEMANAL)
+    return (df, fila_orig) if posiciones else df
+
+# --- Memoización incremental de planes ---
+# Cada fragmento (filas de un sector-mes del plan mensual, o filas semanales de una fila mensual) se guarda bajo la huella de sus entradas;
+# un cambio en la configuración solo recalcula los fragmentos cuya huella cambió. Los fragmentos son tramos (lote, inicio, fin) de un DataFrame calculado en bloque.
+MEMO_MAX_FRAGMENTOS = int(os.environ.get('PLANIFICADOR_MEMO_FRAGMENTOS', '50000'))
+MEMO_TTL_S = int(os.environ.get('PLANIFICADOR_MEMO_TTL_S', str(24 * 3600)))
+MEMO_LOTES_DECODIFICADOS = int(os.environ.get('PLANIFICADOR_MEMO_LOTES', '64'))  # lotes de la memo compartida ya deserializados por proceso
+class MemoFragmentos:
+    # LRU en el proceso y, si la memo tiene nombre, una copia compartida en la caché de trabajos: cada trabajo en segundo plano corre en un proceso nuevo
+    # y así reutiliza lo que calcularon los anteriores. En la compartida cada lote se guarda una vez junto con sus tramos, y un índice (claves y número
+    # de lote en arrays, del más viejo al más nuevo, acotado a max_entradas) dice en qué lote está cada fragmento. Los lotes ya deserializados quedan
+    # por número de lote en el proceso: un lote que el proceso ya tiene se reutiliza como el mismo objeto y _ensamblar lo toma en una sola pieza
+    def __init__(self, nombre=None, max_entradas=MEMO_MAX_FRAGMENTOS, max_lotes=MEMO_LOTES_DECODIFICADOS):
+        self.nombre, self.max_entradas, self.max_lotes = nombre, max_entradas, max_lotes; self._datos, self._lotes = OrderedDict(), OrderedDict(); self._lock = threading.Lock()
+        self._estadisticas = {'reutilizados': 0, 'calculados': 0}
+    def _clave(self, *partes): return '-'.join(('memo', self.nombre) + tuple(map(str, partes)))
+    @property
+    def estadisticas(self):
+        # Compartida: contadores de todos los procesos (en la app calculan los trabajos, no el servidor que sirve /metrics)
+        if self.nombre is None: return dict(self._estadisticas)
+        return {evento: cache_trabajos().get(self._clave(evento), 0) for evento in self._estadisticas}
+    def _contar(self, evento, n):
+        with self._lock: self._estadisticas[evento] += n
+        if self.nombre is not None and n: cache_trabajos().incr(self._clave(evento), n)
+    def _recordar(self, fragmentos):
+        for clave, tramo in fragmentos.items(): self._datos[clave] = tramo; self._datos.move_to_end(clave)
+        while len(self._datos) > self.max_entradas: self._datos.popitem(last=False)
+    def obtener(self, claves):
+        with self._lock:
+            encontrados = {}
+            for clave in claves:
+                if clave in self._datos: self._datos.move_to_end(clave); encontrados[clave] = self._datos[clave]
+        if self.nombre is not None and len(encontrados) < len(claves):
+            compartidos = self._obtener_compartidos([c for c in claves if c not in encontrados])
+            with self._lock: self._recordar(compartidos)
+            encontrados.update(compartidos)
+        self._contar('reutilizados', len(encontrados))
+        return encontrados
+    def _obtener_compartidos(self, claves):
+        cache = cache_trabajos(); indice = cache.get(self._clave('indice'))
+        if indice is None: return {}
+        pos = pd.Index(indice[0]).get_indexer(np.array(claves, dtype=np.uint64))
+        pedidas, encontrados = set(claves), {}
+        for lote_id in np.unique(indice[1][pos[pos >= 0]]).tolist():
+            guardado = self._lote_decodificado(cache, lote_id)
+            if guardado is None: continue  # lote vencido: sus fragmentos se recalculan
+            lote, tramos = guardado
+            for clave in pedidas.intersection(tramos): encontrados[clave] = (lote,) + tramos[clave]
+        return encontrados
+    def _lote_decodificado(self, cache, lote_id):
+        with self._lock:
+            if lote_id in self._lotes: self._lotes.move_to_end(lote_id); return self._lotes[lote_id]
+        guardado = cache.get(self._clave('lote', lote_id))
+        if guardado is not None: self._recordar_lote(lote_id, guardado)
+        return guardado
+    def _recordar_lote(self, lote_id, guardado):
+        with self._lock:
+            self._lotes[lote_id] = guardado; self._lotes.move_to_end(lote_id)
+            while len(self._lotes) > self.max_lotes: self._lotes.popitem(last=False)
+    def guardar(self, fragmentos):
+        with self._lock: self._recordar(fragmentos)
+        self._contar('calculados', len(fragmentos))
+        if self.nombre is not None and fragmentos: self._guardar_compartidos(fragmentos)
+    def _guardar_compartidos(self, fragmentos):
+        cache = cache_trabajos(); lotes = {}
+        for clave, (lote, ini, fin) in fragmentos.items(): lotes.setdefault(id(lote), (lote, {}))[1][clave] = (ini, fin)
+        claves, ids = [], []
+        for lote, tramos in lotes.values():
+            lote_id = cache.incr(self._clave('lotes'))
+            cache.set(self._clave('lote', lote_id), (lote, tramos), expire=MEMO_TTL_S, tag=self._clave()); self._recordar_lote(lote_id, (lote, tramos))
+            claves += tramos; ids += [lote_id] * len(tramos)
+        with cache.transact():
+            viejas, lotes_viejos = cache.get(self._clave('indice'), (np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)))
+            todas, lotes_todas = pd.Index(np.concatenate([viejas, np.array(claves, dtype=np.uint64)])), np.concatenate([lotes_viejos, np.array(ids, dtype=np.int64)])
+            ultimas = ~todas.duplicated(keep='last')
+            indice = (todas.to_numpy()[ultimas][-self.max_entradas:], lotes_todas[ultimas][-self.max_entradas:])
+            cache.set(self._clave('indice'), indice, expire=MEMO_TTL_S, tag=self._clave())
+        # Lotes que ya no tienen fragmentos en el índice
+        for lote_id in np.setdiff1d(lotes_viejos, indice[1]).tolist(): cache.delete(self._clave('lote', lote_id))
+    def limpiar(self):
+        with self._lock: self._datos.clear(); self._lotes.clear()
+        if self.nombre is not None: cache_trabajos().evict(self._clave())
+    def __len__(self): return len(self._datos)
+_memo_mensual, _memo_semanal = MemoFragmentos('mensual'), MemoFragmentos('semanal')
+
+def _hash_filas(df): return pd.util.hash_pandas_object(df, index=False).to_numpy() if len(df) else np.empty(0, dtype=np.uint64)
+def _tramos(lote, claves_lote, posicion_resultado):
+    # claves_lote[k] corresponde al grupo k; posicion_resultado (ordenada) indica a qué grupo pertenece cada fila del lote
+    limites = np.searchsorted(posicion_resultado, np.arange(len(claves_lote) + 1)) if posicion_resultado is not None else np.zeros(len(claves_lote) + 1, dtype=np.int64)
+    return {clave: (lote, int(limites[k]), int(limites[k + 1])) for k, clave in enumerate(claves_lote)}
+def _ensamblar(tramos):
+    # Un take por lote con las filas de todos sus tramos y un take final que devuelve las filas al orden de los tramos
+    lotes, de_lote, inicio, fin = {}, [], [], []
+    for lote, ini, f in tramos:
+        if f <= ini: continue
+        de_lote.append(lotes.setdefault(id(lote), (len(lotes), lote))[0]); inicio.append(ini); fin.append(f)
+    if not inicio: return None
+    inicio, largos, de_lote = np.array(inicio, dtype=np.int64), np.array(fin, dtype=np.int64) - np.array(inicio, dtype=np.int64), np.array(de_lote, dtype=np.int64)
+    filas = np.repeat(inicio - np.cumsum(largos) + largos, largos) + np.arange(largos.sum())
+    if len(lotes) == 1: return next(iter(lotes.values()))[1].take(filas).reset_index(drop=True)
+    de_lote = np.repeat(de_lote, largos); orden = np.argsort(de_lote, kind='stable')
+    cortes = np.searchsorted(de_lote[orden], np.arange(len(lotes) + 1))
+    unido = pd.concat([lote.take(filas[orden[cortes[k]:cortes[k + 1]]]) for k, lote in lotes.values()], ignore_index=True)
+    lugar = np.empty_like(orden); lugar[orden] = np.arange(orden.size)
+    return unido.take(lugar).reset_index(drop=True)
+def _plan_mensual_incremental(df_req, df_fert, df_dist1, df_dist2):
+    # Huella de un sector-mes: fila de requerimientos + fila de la distribución que le corresponde + tabla de fertilizantes completa
+    contexto = np.uint64(int(huella(df_fert, list(df_req.columns), list(df_dist1.columns), list(df_dist2.columns))[:16], 16))
+    h_dist1, h_dist2 = _hash_filas(df_dist1), _hash_filas(df_dist2)
+    anios = pd.to_numeric(df_req['Anio'], errors='coerce').to_numpy(dtype=float)
+    usa_dist1 = np.isin(np.trunc(anios), ANIOS_DISTRIBUCION_1)
+    meses_fila = np.where(usa_dist1, len(h_dist1), len(h_dist2)); inicio = np.concatenate([[0], np.cumsum(meses_fila)])
+    h_dist = np.concatenate([h_dist1 if u else h_dist2 for u in usa_dist1]) if len(df_req) else np.empty(0, dtype=np.uint64)
+    claves = _hash_filas(pd.DataFrame({'requerimiento': np.repeat(_hash_filas(df_req), meses_fila), 'distribucion': h_dist, 'contexto': contexto})).tolist()
+    tramos = _memo_mensual.obtener(claves)
+    faltan = np.flatnonzero(np.bincount(np.repeat(np.arange(len(df_req)), meses_fila), weights=[c not in tramos for c in claves], minlength=len(df_req)) > 0)
+    if faltan.size:
+        lote, fila, i_mes = _plan_mensual_vectorizado(df_req.iloc[faltan], df_fert, df_dist1, df_dist2, posiciones=True)
+        inicio_grupos = np.concatenate([[0], np.cumsum(meses_fila[faltan])])
+        nuevos = _tramos(lote, [claves[k] for i in faltan for k in range(inicio[i], inicio[i + 1])], inicio_grupos[fila] + i_mes if lote is not None else None)
+        _memo_mensual.guardar(nuevos); tramos.update(nuevos)
+    return _ensamblar([tramos[c] for c in claves])
+def _huella_valvulas(nombres, superficies):
+    # Digest estable entre procesos (hash() cambia con PYTHONHASHSEED): la clave tiene que valer igual en todos los trabajos y en la memo compartida
+    h = hashlib.blake2b(digest_size=8); h.update('\0'.join(map(str, nombres)).encode()); h.update(b'|'); h.update(np.asarray(superficies, dtype=np.float64).tobytes())
+    return int.from_bytes(h.digest(), 'little')
+COLUMNAS_HUELLA_SEMANAL = ['Sector', 'Año Plantación', 'Mes', 'Nutriente Cubierto', 'Producto', 'Dosis_kg_ha']
+def _plan_semanal_incremental(df_plan_mensual, df_valvulas, df_limites_dict, fecha_inicio_plan_global, df_fert):
+    # Huella de una fila mensual: sus columnas de cálculo + concentraciones/densidad de su producto + límite del nutriente + válvulas de su año
+    plan = df_plan_mensual.reset_index(drop=True)
+    contexto = np.uint64(int(huella(list(df_valvulas.columns), list(df_fert.columns), fecha_inicio_plan_global.toordinal())[:16], 16))
+    fert_idx = df_fert.drop_duplicates('Producto').set_index('Producto')
+    h_prod = np.append(_hash_filas(fert_idx[[COL_MAP_NUTRIENTES[n] for n in COL_MAP_NUTRIENTES] + ['Densidad']]), np.uint64(0))
+    limites = {n: float(df_limites_dict.get(n, 40)) for n in plan['Nutriente Cubierto'].unique()}
+    anios_valv, inicio_valv, nombres_valv, sup_valv = _indice_valvulas(df_valvulas)
+    valv = [_huella_valvulas(nombres_valv[a:b], sup_valv[a:b]) for a, b in zip(inicio_valv[:-1], inicio_valv[1:])]
+    h_valv = np.append(np.array(valv, dtype=np.uint64), np.uint64(0))[anios_valv.get_indexer(pd.to_numeric(plan['Año Plantación'], errors='coerce'))]
+    claves = _hash_filas(pd.DataFrame({'fila': _hash_filas(plan[COLUMNAS_HUELLA_SEMANAL]), 'producto': h_prod[fert_idx.index.get_indexer(plan['Producto'])], 'limite': plan['Nutriente Cubierto'].map(limites).to_numpy(dtype=float),
+                                       'valvulas': h_valv, 'contexto': contexto})).tolist()
+    tramos = _memo_semanal.obtener(claves)
+    faltan = [i for i, c in enumerate(claves) if c not in tramos]
+    if faltan:
+        lote, fila = _plan_semanal_vectorizado(plan.iloc[faltan], df_valvulas, df_limites_dict, fecha_inicio_plan_global, df_fert, posiciones=True)
+        nuevos = _tramos(lote, [claves[i] for i in faltan], fila if len(fila) else None)
+        _memo_semanal.guardar(nuevos); tramos.update(nuevos)
+    df = _ensamblar([tramos[c] for c in claves])
+    return df if df is not None else pd.DataFrame()
+
+# --- Programación de las aplicaciones dentro de la semana ---
+# El planificador deja cada aplicación en el lunes de su semana. En modo 'capacidad' se reparten entre los días habilitados respetando los litros
+# que el inyector aplica por día y las horas de riego de cada válvula por día (una aplicación ocupa a su válvula superficie x horas por ha).
+# Greedy por semana: primero lo atrasado y dentro de cada semana de origen las aplicaciones más grandes, cada una al día menos cargado donde entra (min-heap de días por litros asignados);
+# lo que no entra pasa a la semana siguiente, antes que las aplicaciones propias de esa semana. Si algo quedaría después de la última semana
+# de la temporada la programación falla con un mensaje en lugar de estirar el plan
+PROGRAMACION_DEFECTO = {'modo': 'lunes', 'dias': [0, 1, 2, 3, 4, 5], 'capacidad_l_dia': 12000, 'horas_por_ha': 0.5, 'horas_valvula_dia': 12}
+MODOS_PROGRAMACION = {'lunes': 'Todas las aplicaciones el lunes (sin límites)', 'capacidad': 'Repartir en la semana según capacidad'}
+DIAS_SEMANA = ['Lun', 'Mar', 'Mié', 'Jue', 'Vie', 'Sáb', 'Dom']
+def programacion_desde_formulario(modo=None, dias=None, capacidad_l_dia=None, horas_por_ha=None, horas_valvula_dia=None):
+    # Campos vacíos del formulario de configuración toman el valor por defecto
+    valores = {'modo': modo, 'dias': None if dias is None else sorted(int(d) for d in dias), 'capacidad_l_dia': capacidad_l_dia, 'horas_por_ha': horas_por_ha, 'horas_valvula_dia': horas_valvula_dia}
+    return {clave: PROGRAMACION_DEFECTO[clave] if valor is None else valor for clave, valor in valores.items()}
+def programar_aplicaciones(df_plan, df_valvulas, programacion):
+    if df_plan.empty or 'Fecha Estimada' not in df_plan.columns: return df_plan
+    dias_habilitados = sorted({int(d) for d in programacion.get('dias') or []})
+    cap_l, horas_por_ha, cap_v = float(programacion['capacidad_l_dia']), float(programacion['horas_por_ha']), float(programacion['horas_valvula_dia'])
+    if not dias_habilitados or cap_l <= 0 or cap_v <= 0 or horas_por_ha < 0: raise ValueError("La programación por capacidad necesita días habilitados y capacidades positivas")
+    dias = dias_desde_fechas(df_plan['Fecha Estimada']).astype(np.int64)
+    semana = dias - (dias + 3) % 7  # lunes de la semana (el 1970-01-01 fue jueves)
+    litros = np.nan_to_num(pd.to_numeric(df_plan['Litros Planeados'], errors='coerce').to_numpy(dtype=float))
+    largo = indice_valvulas_largo(df_valvulas); largo = largo[largo['Subbloque'].to_numpy() == 0]
+    sup = pd.Series(largo['Superficie'].to_numpy(), index=pd.MultiIndex.from_arrays([largo['Año Plantación'].to_numpy(dtype=np.int64), largo['Válvula'].to_numpy(dtype=object)]))
+    pos = sup.index.get_indexer(pd.MultiIndex.from_arrays([pd.to_numeric(df_plan['Año Plantación'], errors='coerce').fillna(-1).to_numpy(dtype=np.int64), df_plan['Válvula'].to_numpy(dtype=object)]))
+    horas = np.where(pos >= 0, sup.to_numpy()[np.maximum(pos, 0)], 0.0) * horas_por_ha
+    valvula = df_plan.groupby(['Sector', 'Año Plantación', 'Válvula'], sort=False, observed=True).ngroup().to_numpy()
+    # Todo se recorre en el orden global (semana del plan, litros descendentes): las atrasadas van antes y dentro de cada semana de origen las grandes primero
+    orden = np.lexsort((-litros, semana))
+    semanas = semana[orden]
+    # Una aplicación de más litros que la capacidad diaria solo va a un día vacío: para el inyector ocupa el día entero
+    litros_o = np.minimum(litros[orden], cap_l); fin_temporada = int(semanas[-1]) if len(semanas) else 0
+    fin_grupo = np.searchsorted(semanas, semanas, side='right').tolist()
+    litros_l, horas_l, valvula_l, orden_l = litros_o.tolist(), horas[orden].tolist(), valvula[orden].tolist(), orden.tolist()
+    asignado = dias.copy(); arrastre = []; i = 0; lunes = None
+    while i < len(orden) or arrastre:
+        lunes = lunes + 7 if arrastre else int(semanas[i])
+        if lunes > fin_temporada:
+            raise ValueError(f"La capacidad configurada no alcanza: {len(arrastre)} aplicaciones quedarían después de la última semana de la temporada ({fechas_desde_dias(np.array([fin_temporada]))[0]}). "
+                             "Aumente la capacidad del inyector, las horas por válvula o los días de riego.")
+        j = int(np.searchsorted(semanas, lunes, side='right'))
+        lote = arrastre + list(range(i, j)); i, arrastre = j, []
+        lit_lote = litros_o[lote]; min_l = np.minimum.accumulate(lit_lote[::-1])[::-1].tolist()
+        libre_l = {lunes + d: cap_l for d in dias_habilitados}; uso_valvula = {}  # (día, válvula) -> horas de riego ocupadas
+        monticulo = [(0.0, lunes + d) for d in dias_habilitados]
+        t = 0
+        while t < len(lote):
+            k = lote[t]; descartados, elegido, v = [], None, valvula_l[k]
+            larga = horas_l[k] > cap_v  # más horas de las que la válvula riega en un día: solo con la válvula libre ese día, sin dejar de respetar el inyector
+            while monticulo:
+                carga, dia = heapq.heappop(monticulo)
+                horas_libres = cap_v - uso_valvula.get((dia, v), 0.0)
+                if litros_l[k] <= libre_l[dia] + 1e-9 and (horas_libres == cap_v if larga else horas_l[k] <= horas_libres + 1e-9): elegido = dia; break
+                descartados.append((carga, dia))
+            for c in descartados: heapq.heappush(monticulo, c)
+            if elegido is None:
+                max_libre = max(libre_l.values())
+                if max_libre + 1e-9 < min_l[t]: arrastre += lote[t:]; break  # el inyector ya no tiene lugar para nada de lo que falta
+                if litros_l[k] > max_libre + 1e-9:
+                    # Las siguientes de su misma semana de origen que tampoco entran en el inyector pasan juntas (búsqueda binaria: vienen en litros descendentes)
+                    u = bisect.bisect_left(lote, fin_grupo[k], t)
+                    salto = t + int(np.searchsorted(-lit_lote[t:u], -max_libre - 1e-9, side='left'))
+                    arrastre += lote[t:max(salto, t + 1)]; t = max(salto, t + 1); continue
+                arrastre.append(k); t += 1; continue
+            asignado[orden_l[k]] = elegido; libre_l[elegido] -= litros_l[k]; uso_valvula[(elegido, v)] = uso_valvula.get((elegido, v), 0.0) + horas_l[k]
+            heapq.heappush(monticulo, (cap_l - libre_l[elegido], elegido))
+            t += 1
+    df = df_plan.copy(); df['Fecha Estimada'] = pd.to_datetime(asignado, unit='D')
+    return df
+
+# --- Cubo agregado del dashboard (Sector x Año Plantación x mes de aplicación x Producto) ---
+# Se reconstruye solo si cambian las aplicaciones o los precios por fuera de guardar_datos_reales; cada guardado lo actualiza por delta
+DIMENSIONES_CUBO = ['Sector', 'Año Plantación', 'Mes', 'Producto']
+MEDIDAS_CUBO = ['Litros Planeados', 'Litros Reales Aplicados', 'Costo Planeado', 'Costo Real', 'Aplicaciones']
+# El cubo vigente queda en la caché de trabajos junto con la firma de las tablas de las que sale: un guardado hecho en otro worker (gunicorn o trabajo
+# en segundo plano) se ve como firma nueva y el cubo actualizado se lee de ahí en lugar de reconstruirlo desde todo el historial. _cubo es la copia del proceso
+CLAVE_CUBO = 'cubo-dashboard'
+_cubo = {'firma': None, 'datos': None}
+_cubo_lock = threading.Lock()
+
+def _firma_cubo():
+    alm = almacenamiento(); return tuple(alm.firma(f) if alm.existe(f) else None for f in (APLIC_REALES_FILE, FERT_FILE))
+def _agregar_al_cubo(df, df_fert):
+    if df.empty or 'Fecha Aplicación Real' not in df.columns: return pd.DataFrame(columns=DIMENSIONES_CUBO + MEDIDAS_CUBO).set_index(DIMENSIONES_CUBO)
+    dias_real = dias_desde_fechas(df['Fecha Aplicación Real'])
+    aplicado = dias_real != DIA_NULO
+    d = df[aplicado]
+    precios = df_fert.drop_duplicates('Producto').set_index('Producto')
+    kg_a_usd = (d['Producto'].map(pd.to_numeric(precios['Densidad'], errors='coerce')).fillna(0) * d['Producto'].map(pd.to_numeric(precios['Precio'], errors='coerce')).fillna(0)).to_numpy(dtype=float)
+    planeados = pd.to_numeric(d['Litros Planeados'], errors='coerce').fillna(0).to_numpy(dtype=float)
+    reales = pd.to_numeric(d['Litros Reales Aplicados'], errors='coerce').fillna(0).to_numpy(dtype=float)
+    filas = pd.DataFrame({'Sector': d['Sector'].to_numpy(), 'Año Plantación': d['Año Plantación'].astype(int).to_numpy(), 'Mes': fechas_desde_dias(dias_real[aplicado], 'M'), 'Producto': d['Producto'].to_numpy(),
+                          'Litros Planeados': planeados, 'Litros Reales Aplicados': reales, 'Costo Planeado': planeados * kg_a_usd, 'Costo Real': reales * kg_a_usd, 'Aplicaciones': np.ones(len(d), dtype=np.int64)})
+    return filas.groupby(DIMENSIONES_CUBO).sum()
+def _cubo_vigente(firma):
+    with _cubo_lock:
+        if _cubo['datos'] is not None and _cubo['firma'] == firma: return _cubo['datos']
+    compartido = cache_trabajos().get(CLAVE_CUBO)
+    if compartido is None or compartido[0] != firma: return None
+    with _cubo_lock: _cubo.update(firma=firma, datos=compartido[1])
+    return compartido[1]
+def _publicar_cubo(firma, datos):
+    with _cubo_lock: _cubo.update(firma=firma, datos=datos)
+    cache_trabajos().set(CLAVE_CUBO, (firma, datos), expire=MEMO_TTL_S)
+def descartar_cubo():
+    with _cubo_lock: _cubo.update(firma=None, datos=None)
+    cache_trabajos().delete(CLAVE_CUBO)
+def cubo_dashboard():
+    # La firma se toma antes de leer: un guardado que llega en el medio deja un cubo con firma vieja, que no se usa
+    firma = _firma_cubo()
+    datos = _cubo_vigente(firma)
+    if datos is None:
+        datos = _agregar_al_cubo(almacenamiento().consultar(APLIC_REALES_FILE, solo_aplicadas=True), cargar_o_crear(FERT_FILE, definir_fertilizantes))
+        _publicar_cubo(firma, datos)
+    return datos
+def actualizar_cubo(df_antes, df_despues, firma_antes):
+    # Delta = aporte nuevo - aporte anterior de las filas que cambiaron; si las tablas no se pueden alinear fila a fila se descarta el cubo
+    claves = ['Sector', 'Válvula', 'Fecha Estimada']; medidas = ['Año Plantación', 'Producto', 'Litros Planeados', 'Litros Reales Aplicados', 'Fecha Aplicación Real']
+    cubo = _cubo_vigente(firma_antes)
+    alineadas = cubo is not None and len(df_antes) == len(df_despues) and all(c in df_antes.columns and c in df_despues.columns for c in claves + medidas)
+    alineadas = alineadas and all((df_antes[c].astype(str).to_numpy() == df_despues[c].astype(str).to_numpy()).all() for c in claves)
+    if not alineadas: descartar_cubo(); return
+    cambiadas = np.zeros(len(df_antes), dtype=bool)
+    for col in medidas:
+        antes, despues = df_antes[col], df_despues[col]
+        if col.startswith('Litros'): antes, despues = pd.to_numeric(antes, errors='coerce'), pd.to_numeric(despues, errors='coerce')
+        cambiadas |= ~((antes.to_numpy() == despues.to_numpy()) | (antes.isna().to_numpy() & despues.isna().to_numpy()))
+    if cambiadas.any():
+        df_fert = cargar_o_crear(FERT_FILE, definir_fertilizantes)
+        cubo = cubo.add(_agregar_al_cubo(df_despues[cambiadas], df_fert), fill_value=0).sub(_agregar_al_cubo(df_antes[cambiadas], df_fert), fill_value=0)
+        cubo = cubo[cubo['Aplicaciones'] != 0]
+    _publicar_cubo(_firma_cubo(), cubo)
+
+# --- Registro de planes en el servidor ---
+# Los planes quedan en el servidor (pickle comprimido en memoria y en disco para que cualquier worker los resuelva); los dcc.Store guardan solo el handle
+PLANES_TTL_S = int(os.environ.get('PLANIFICADOR_PLANES_TTL_S', str(6 * 3600)))
+PLANES_MAX_BYTES = int(os.environ.get('PLANIFICADOR_PLANES_MB', '128')) * 1024 * 1024
+PLANES_DECODIFICADOS = int(os.environ.get('PLANIFICADOR_PLANES_DECODIFICADOS', '4'))  # planes ya descomprimidos por worker: paginar, ordenar o filtrar no vuelve a deserializar
+
+def huella(*partes):
+    # Hash de contenido de las entradas de un plan: tablas (valores, columnas y tipos) o valores simples
+    h = hashlib.sha256()
+    for parte in partes:
+        if isinstance(parte, pd.DataFrame):
+            h.update(repr((list(parte.columns), [str(t) for t in parte.dtypes])).encode())
+            h.update(pd.util.hash_pandas_object(parte, index=False).to_numpy().tobytes())
+        else: h.update(repr(parte).encode())
+        h.update(b'|')
+    return h.hexdigest()[:32]
+HANDLE_PLAN_RE = re.compile(r'(mensual|semanal)-[0-9a-f]{32}')  # el handle llega de un dcc.Store: lo controla el cliente
+class RegistroPlanes:
+    def __init__(self, ruta, ttl_s=PLANES_TTL_S, max_bytes=PLANES_MAX_BYTES, max_decodificados=PLANES_DECODIFICADOS):
+        self.ruta, self.ttl_s, self.max_bytes, self.max_decodificados = ruta, ttl_s, max_bytes, max_decodificados
+        self._memoria = OrderedDict()  # handle -> (blob, instante de creación); el orden es el de último acceso (LRU)
+        self._decodificados = OrderedDict()  # handle -> (DataFrame compacto, instante de creación); LRU chico
+        self._bytes = 0; self._lock = threading.Lock()
+        os.makedirs(ruta, exist_ok=True)
+    def _archivo(self, handle): return os.path.join(self.ruta, f"{handle}.plan")
+    @staticmethod
+    def valido(handle): return isinstance(handle, str) and HANDLE_PLAN_RE.fullmatch(handle) is not None
+    def guardar(self, handle, df):
+        if not self.valido(handle): raise ValueError(f"Handle de plan inválido: {handle!r}")
+        blob = zlib.compress(pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        fd, tmp = tempfile.mkstemp(dir=self.ruta, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f: f.write(blob)
+        os.replace(tmp, self._archivo(handle))
+        with self._lock: self._decodificados.pop(handle, None); self._recordar(handle, blob, os.path.getmtime(self._archivo(handle)))
+        self.purgar()
+        return handle
+    def obtener(self, handle):
+        # Antes de tocar el disco: un handle como '../../x' saldría de la carpeta de planes y haría deserializar cualquier archivo .plan
+        if not self.valido(handle): return None
+        with self._lock:
+            decodificado = self._decodificados.get(handle)
+            if decodificado is not None and self._vigente(decodificado[1]): self._decodificados.move_to_end(handle); return decodificado[0].copy(deep=False)
+            entrada = self._memoria.get(handle)
+            if entrada is not None and self._vigente(entrada[1]): self._memoria.move_to_end(handle); blob, creado = entrada
+            else: blob = None
+        if blob is None:
+            archivo = self._archivo(handle)
+            try:
+                creado = os.path.getmtime(archivo)
+                if not self._vigente(creado): return None
+                with open(archivo, 'rb') as f: blob = f.read()
+            except OSError: return None
+            with self._lock: self._recordar(handle, blob, creado)
+        df = pickle.loads(zlib.decompress(blob))
+        with self._lock:
+            self._decodificados[handle] = (df, creado); self._decodificados.move_to_end(handle)
+            while len(self._decodificados) > self.max_decodificados: self._decodificados.popitem(last=False)
+        return df.copy(deep=False)
+    def contiene(self, handle):
+        # Misma regla que obtener: un plan vencido no cuenta aunque su archivo siga en disco hasta el próximo purgar
+        if not self.valido(handle): return False
+        with self._lock:
+            entrada = self._memoria.get(handle)
+            if entrada is not None and self._vigente(entrada[1]): return True
+        try: return self._vigente(os.path.getmtime(self._archivo(handle)))
+        except OSError: return False
+    def _vigente(self, creado, ahora=None): return (ahora or time.time()) - creado <= self.ttl_s
+    def _recordar(self, handle, blob, creado):
+        viejo = self._memoria.pop(handle, None)
+        if viejo is not None: self._bytes -= len(viejo[0])
+        self._memoria[handle] = (blob, creado); self._bytes += len(blob)
+        while self._bytes > self.max_bytes and len(self._memoria) > 1:
+            _, (blob_viejo, _) = self._memoria.popitem(last=False); self._bytes -= len(blob_viejo)
+    def purgar(self):
+        # Vencimiento por TTL desde la creación, igual en memoria y en disco (el mtime del archivo es el instante de creación)
+        ahora = time.time()
+        with self._lock:
+            for handle in [h for h, (_, creado) in self._memoria.items() if not self._vigente(creado, ahora)]:
+                self._bytes -= len(self._memoria.pop(handle)[0])
+            for handle in [h for h, (_, creado) in self._decodificados.items() if not self._vigente(creado, ahora)]: del self._decodificados[handle]
+        for nombre in os.listdir(self.ruta):
+            archivo = os.path.join(self.ruta, nombre)
+            try:
+                if not self._vigente(os.path.getmtime(archivo), ahora): os.remove(archivo)
+            except OSError: pass
+
+_registro_planes = None
+def registro_planes():
+    global _registro_planes
+    if _registro_planes is None: _registro_planes = RegistroPlanes(PLANES_PATH)
+    return _registro_planes
+
+# --- Trabajos en segundo plano ---
+# Generación de planes, exportaciones y órdenes PDF corren como background callbacks de Dash en procesos aparte; el estado vive en un diskcache local (sin broker externo)
+TRABAJOS_PATH = os.path.join(DATA_PATH, "trabajos")
+TRABAJOS_TTL_S = int(os.environ.get('PLANIFICADOR_TRABAJOS_TTL_S', '600'))
+# La caché (y psutil/multiprocess del gestor) se crean con el primer trabajo, no al importar: scripts y workers que no sirven callbacks no la abren
+_cache_trabajos = None
+_cache_trabajos_lock = threading.Lock()
+def cache_trabajos():
+    global _cache_trabajos
+    with _cache_trabajos_lock:
+        if _cache_trabajos is None:
+            import diskcache
+            _cache_trabajos = diskcache.Cache(TRABAJOS_PATH)
+        return _cache_trabajos
+class _CacheTrabajosDiferida:
+    # Dash guarda la caché del gestor en la función de cada trabajo al registrar el callback: este intermediario la abre recién al usarla
+    def __getattr__(self, nombre): return getattr(cache_trabajos(), nombre)
+class GestorTrabajos(DiskcacheManager):
+    # Sin el __init__ de DiskcacheManager, que exige una diskcache.Cache ya abierta e importa psutil/multiprocess (se importan al lanzar el primer trabajo).
+    # Deja los mismos atributos que el constructor público de las versiones de Dash fijadas en requirements.txt (lo verifica tests/test_dashboard.py)
+    def __init__(self, expire=None):
+        self.handle, self.expire = _CacheTrabajosDiferida(), expire; super(DiskcacheManager, self).__init__(None)
+gestor_trabajos = GestorTrabajos()
+
+TRABAJOS_ESPERA_S = int(os.environ.get('PLANIFICADOR_TRABAJOS_ESPERA_S', str(TRABAJOS_TTL_S)))  # plazo para esperar un trabajo idéntico que corre en otro proceso
+def _inicio_proceso(pid):
+    import psutil  # importación diferida: solo para los candados de trabajos
+    try: return psutil.Process(pid).create_time()
+    except psutil.NoSuchProcess: return None
+def _candado_huerfano(duenio):
+    # El proceso dueño ya no existe (trabajo cancelado) o su pid lo reutiliza otro proceso; los candados de versiones anteriores guardan solo el pid
+    pid, inicio = (duenio, None) if isinstance(duenio, int) else duenio[:2]
+    actual = _inicio_proceso(pid)
+    return actual is None or (inicio is not None and actual != inicio)
+def _soltar_candado(clave_candado, duenio):
+    # Solo si sigue siendo de ese dueño: un candado vencido por TTL pudo haberlo tomado otro trabajo
+    with cache_trabajos().transact():
+        if cache_trabajos().get(clave_candado) == duenio: cache_trabajos().delete(clave_candado)
+def trabajo_unico(clave, calcular, esperando=None, plazo_s=None):
+    # Solicitudes idénticas concurrentes esperan al trabajo que tomó el candado y reutilizan su resultado; el candado de un proceso muerto se libera
+    # y si el dueño no termina dentro del plazo se deja de esperar con TimeoutError (el candado vence solo con el TTL de los trabajos)
+    clave_resultado, clave_candado = f"resultado-{clave}", f"candado-{clave}"
+    propio = (os.getpid(), _inicio_proceso(os.getpid()), uuid.uuid4().hex)
+    limite = time.monotonic() + (TRABAJOS_ESPERA_S if plazo_s is None else plazo_s)
+    while True:
+        resultado = cache_trabajos().get(clave_resultado)
+        if resultado is not None: return resultado
+        if cache_trabajos().add(clave_candado, propio, expire=TRABAJOS_TTL_S): break
+        duenio = cache_trabajos().get(clave_candado)
+        if duenio is not None and _candado_huerfano(duenio): _soltar_candado(clave_candado, duenio); continue
+        if time.monotonic() >= limite: raise TimeoutError(f"El trabajo idéntico en curso ({clave}) no terminó en {TRABAJOS_ESPERA_S if plazo_s is None else plazo_s} s")
+        if esperando: esperando()
+        time.sleep(0.2)
+    try:
+        resultado = calcular()
+        if resultado is not None: cache_trabajos().set(clave_resultado, resultado, expire=TRABAJOS_TTL_S)
+        return resultado
+    finally: _soltar_candado(clave_candado, propio)
+ESTILO_PANEL_PROGRESO = {'display': 'flex', 'gap': '10px', 'alignItems': 'center', 'marginBottom': '10px'}
+def panel_progreso(panel): return html.Div(id=f'panel-progreso-{panel}', style={'display': 'none'}, children=[html.Progress(id=f'barra-progreso-{panel}', value=0, max=1), html.Span(id=f'texto-progreso-{panel}'), html.Button("Cancelar", id=f'btn-cancelar-{panel}', className="Button Button-secondary")])
+def opciones_trabajo(panel, boton):
+    # Progreso (texto, valor, máximo), cancelación y botón deshabilitado mientras el trabajo corre
+    return dict(background=True, progress=[Output(f'texto-progreso-{panel}', 'children'), Output(f'barra-progreso-{panel}', 'value'), Output(f'barra-progreso-{panel}', 'max')], progress_default=["", 0, 1],
+                cancel=[Input(f'btn-cancelar-{panel}', 'n_clicks')], running=[(Output(boton, 'disabled'), True, False), (Output(f'panel-progreso-{panel}', 'style'), ESTILO_PANEL_PROGRESO, {'display': 'none'})])
+
+# --- Órdenes de trabajo en PDF ---
+# Las órdenes en lote se reparten en un pool de procesos; cada worker lee y decodifica los logos una sola vez y las filas se escriben desde listas de columnas ya formateadas
+LOGOS_ORDEN = ('assets/Logo Fortin Castre.jpg', 'assets/Logo Rivera Grande.jpg')
+PDF_WORKERS = int(os.environ.get('PLANIFICADOR_PDF_WORKERS', str(min(4, os.cpu_count() or 1))))
+PDF_MIN_ORDENES_POOL = 8  # por debajo no compensa levantar procesos
+
+@functools.lru_cache(maxsize=None)
+def _recursos_pdf_orden():
+    # Logos leídos y decodificados una sola vez por proceso (fpdf vuelve a parsear los bytes en cada documento) y fuentes de la orden ya creadas;
+    # cada documento arranca con copias registradas bajo la ruta del logo, así header() los reutiliza sin leer ni hashear la imagen en cada página
+    from fpdf.image_datastructures import ImageCache
+    from fpdf.image_parsing import preload_image
+    from fpdf.fonts import CoreFont
+    imagenes = ImageCache()
+    for ruta in LOGOS_ORDEN: preload_image(imagenes, ruta)
+    return imagenes, {clave: CoreFont(i + 1, clave, clave[len('helvetica'):]) for i, clave in enumerate(('helvetica', 'helveticaB', 'helveticaI'))}
+SIGUE, SALTO = dict(new_x='RIGHT', new_y='TOP'), dict(new_x='LMARGIN', new_y='NEXT')  # equivalentes a ln=0 / ln=1 sin la API obsoleta (que inspecciona la pila en cada celda)
+@functools.lru_cache(maxsize=None)
+def _clase_pdf_orden():
+    # fpdf se importa recién al generar la primera orden
+    from fpdf import FPDF
+    class PDFOrden(FPDF):
+        def __init__(self):
+            super().__init__()
+            imagenes, fuentes = _recursos_pdf_orden()
+            self.image_cache.images.update((ruta, type(info)(info, usages=0)) for ruta, info in imagenes.images.items()); self.image_cache.icc_profiles.update(imagenes.icc_profiles)
+            self.fonts.update(fuentes)
+        def header(self): self.image(LOGOS_ORDEN[0], 10, 8, 33); self.set_font('helvetica', 'B', 15); self.cell(0, 10, 'Orden de Trabajo de Fertilización', 0, align='C', **SALTO); self.image(LOGOS_ORDEN[1], 170, 8, 33); self.ln(10)
+        def footer(self): self.set_y(-15); self.set_font('helvetica', 'I', 8); self.cell(0, 10, f'Página {self.page_no()}', 0, align='C', **SIGUE)
+    return PDFOrden
+def nuevo_pdf_orden(): return _clase_pdf_orden()()
+def filas_orden(df):
+    # Columnas de la orden como listas de texto, formateadas en bloque
+    litros = pd.to_numeric(df['Litros Planeados'], errors='coerce').to_numpy(dtype=float)
+    return [df['Sector'].astype(str).tolist(), df['Válvula'].astype(str).tolist(), df['Producto'].astype(str).tolist(), [f"{l:.2f}" for l in litros.tolist()]]
+def escribir_orden(pdf, filas, subtitulo=None):
+    pdf.add_page(); pdf.set_font('helvetica', '', 10); pdf.cell(0, 10, f"Fecha de Emisión: {datetime.date.today().strftime('%d/%m/%Y')}", 0, **SALTO)
+    if subtitulo: pdf.cell(0, 10, subtitulo, 0, **SALTO)
+    pdf.set_font('helvetica', 'B', 10)
+    pdf.cell(45, 7, 'Sector', 1, align='C', **SIGUE); pdf.cell(20, 7, 'Válvula', 1, align='C', **SIGUE); pdf.cell(45, 7, 'Producto', 1, align='C', **SIGUE); pdf.cell(30, 7, 'Litros a Aplicar', 1, align='C', **SIGUE); pdf.cell(40, 7, 'Litros Reales', 1, align='C', **SALTO)
+    pdf.set_font('helvetica', '', 10)
+    for sector, valvula, producto, litros in zip(*filas):
+        pdf.cell(45, 10, sector, 1, **SIGUE); pdf.cell(20, 10, valvula, 1, **SIGUE); pdf.cell(45, 10, producto, 1, **SIGUE); pdf.cell(30, 10, litros, 1, align='R', **SIGUE); pdf.cell(40, 10, '', 1, **SALTO)
+    pdf.ln(15); pdf.cell(0, 10, 'Observaciones:', 0, **SALTO); pdf.multi_cell(w=0, h=10, text='', border=1, align='L'); pdf.ln(25)
+    pdf.cell(90, 10, '_________________________', 0, align='C', **SIGUE); pdf.cell(90, 10, '_________________________', 0, align='C', **SALTO)
+    pdf.cell(90, 5, 'Firma Responsable Finca', 0, align='C', **SIGUE); pdf.cell(90, 5, 'Firma Operario', 0, align='C', **SALTO)
+def _iniciar_worker_pdf(): _clase_pdf_orden(); _recursos_pdf_orden()
+def _render_ordenes(ordenes):
+    # ordenes: [(nombre, subtítulo, filas)] -> [(nombre, bytes del PDF)]
+    resultado = []
+    for nombre, subtitulo, filas in ordenes:
+        pdf = nuevo_pdf_orden(); escribir_orden(pdf, filas, subtitulo); resultado.append((nombre, bytes(pdf.output())))
+    return resultado
+def ordenes_por_fecha_y_sector(df):
+    # Una orden por Fecha Estimada x Sector, en orden de fecha
+    ordenes = []
+    for (fecha, sector), grupo in df.groupby(['Fecha Estimada', 'Sector'], sort=True):
+        ordenes.append((f"orden_{fecha}_{str(sector).replace(' ', '_')}.pdf", f"Fecha de Riego: {pd.to_datetime(fecha).strftime('%d/%m/%Y')} - Sector: {sector}", filas_orden(grupo)))
+    return ordenes
+def ordenes_en_lote(ordenes, formato='zip', progreso=None):
+    # 'pdf': un único documento con una sección por orden; 'zip': un PDF por orden, renderizados en paralelo
+    if formato == 'pdf':
+        pdf = nuevo_pdf_orden()
+        for k, (_, subtitulo, filas) in enumerate(ordenes):
+            escribir_orden(pdf, filas, subtitulo)
+            if progreso: progreso(k + 1, len(ordenes))
+        return bytes(pdf.output())
+    usar_pool = len(ordenes) >= PDF_MIN_ORDENES_POOL and PDF_WORKERS > 1
+    tam = -(-len(ordenes) // (4 * PDF_WORKERS)) if usar_pool else max(len(ordenes), 1)
+    lotes = [ordenes[i:i + tam] for i in range(0, len(ordenes), tam)]
+    buffer = io.BytesIO(); hechas = 0
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf, (ProcessPoolExecutor(max_workers=PDF_WORKERS, initializer=_iniciar_worker_pdf) if usar_pool else nullcontext()) as pool:
+        for parte in (pool.map(_render_ordenes, lotes) if pool else map(_render_ordenes, lotes)):
+            for nombre, contenido in parte: zf.writestr(nombre, contenido)
+            hechas += len(parte)
+            if progreso: progreso(hechas, len(ordenes))
+    return buffer.getvalue()
+
+# --- Exportación de planes por bloques ---
+# Los archivos se escriben en disco de a bloques de filas (Excel en modo constant_memory, CSV por tramos, Parquet por row groups) y se sirven desde /descargas/<token>;
+# la memoria de la exportación queda acotada por el bloque y no por el tamaño del plan
+EXPORTACIONES_PATH = os.path.join(DATA_PATH, "exportaciones")
+EXPORT_BLOQUE_FILAS = int(os.environ.get('PLANIFICADOR_EXPORT_BLOQUE', '50000'))
+FORMATOS_EXPORTACION = {'xlsx': 'Excel', 'csv': 'CSV', 'parquet': 'Parquet'}
+DIVISIONES_EXPORTACION = {'Año Plantación': 'anio', 'Sector': 'sector'}
+
+def _bloques(df, tam=None):
+    tam = tam or EXPORT_BLOQUE_FILAS
+    for inicio in range(0, len(df), tam): yield expandir_plan(df.iloc[inicio:inicio + tam])
+def _titulo_hoja(hoja): return re.sub(r'[\[\]:*?/\\]', ' ', str(hoja))[:31]  # Excel: hasta 31 caracteres y sin []:*?/\
+def escribir_excel(df, destino, hoja):
+    try: import xlsxwriter
+    except ImportError: xlsxwriter = None
+    if xlsxwriter is None:
+        # Sin xlsxwriter: openpyxl en modo write_only, que también escribe fila a fila
+        from openpyxl import Workbook
+        wb = Workbook(write_only=True); ws = wb.create_sheet(_titulo_hoja(hoja)); ws.append(list(df.columns))
+        for bloque in _bloques(df):
+            for fila in bloque.astype(object).where(bloque.notna(), None).itertuples(index=False, name=None): ws.append(fila)
+        wb.save(destino); return
+    wb = xlsxwriter.Workbook(destino, {'constant_memory': True}); ws = wb.add_worksheet(_titulo_hoja(hoja))
+    ws.write_row(0, 0, list(df.columns)); fila_excel = 1
+    for bloque in _bloques(df):
+        for fila in bloque.astype(object).where(bloque.notna(), None).itertuples(index=False, name=None): ws.write_row(fila_excel, 0, fila); fila_excel += 1
+    wb.close()
+def escribir_csv(df, destino):
+    with open(destino, 'w', newline='', encoding='utf-8') as f:
+        for i, bloque in enumerate(_bloques(df)): bloque.to_csv(f, header=(i == 0), index=False)
+def escribir_parquet(df, destino):
+    import pyarrow as pa, pyarrow.parquet as pq
+    escritor = None
+    try:
+        for bloque in _bloques(df):
+            tabla = pa.Table.from_pandas(bloque, preserve_index=False)
+            if escritor is None: escritor = pq.ParquetWriter(destino, tabla.schema)
+            escritor.write_table(tabla)
+        if escritor is None: pq.write_table(pa.Table.from_pandas(df, preserve_index=False), destino)
+    finally:
+        if escritor is not None: escritor.close()
+def formatos_disponibles():
+    formatos = dict(FORMATOS_EXPORTACION)
+    if importlib.util.find_spec('pyarrow') is None: formatos.pop('parquet')  # sin importarlo: pyarrow es pesado
+    if importlib.util.find_spec('xlsxwriter') is None and importlib.util.find_spec('openpyxl') is None: formatos.pop('xlsx')
+    return formatos
+def _escribir_formato(df, destino, formato, hoja):
+    if formato == 'xlsx': escribir_excel(df, destino, hoja)
+    elif formato == 'csv': escribir_csv(df, destino)
+    elif formato == 'parquet': escribir_parquet(df, destino)
+    else: raise ValueError(f"Formato de exportación desconocido: {formato}")
+def purgar_exportaciones():
+    ahora = time.time()
+    for nombre in os.listdir(EXPORTACIONES_PATH):
+        archivo = os.path.join(EXPORTACIONES_PATH, nombre)
+        try:
+            if ahora - os.path.getmtime(archivo) > TRABAJOS_TTL_S: os.remove(archivo)
+        except OSError: pass
+def exportar_plan(df, nombre_base, formato, hoja, division=None, progreso=None):
+    # Devuelve el token de descarga; con división, un archivo por valor de la columna dentro de un ZIP
+    os.makedirs(EXPORTACIONES_PATH, exist_ok=True); purgar_exportaciones()
+    token = uuid.uuid4().hex; destino = os.path.abspath(os.path.join(EXPORTACIONES_PATH, token))
+    if division is None or division not in df.columns:
+        _escribir_formato(df, destino, formato, hoja); nombre = f"{nombre_base}.{formato}"
+        if progreso: progreso(1, 1)
+    else:
+        grupos = df.groupby(division, sort=True, observed=True); total = grupos.ngroups
+        with zipfile.ZipFile(destino, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for k, (valor, grupo) in enumerate(grupos):
+                parcial = f"{destino}.parte"
+                _escribir_formato(grupo, parcial, formato, f"{hoja} {valor}")
+                zf.write(parcial, f"{nombre_base}_{DIVISIONES_EXPORTACION.get(division, 'grupo')}_{str(valor).replace(' ', '_')}.{formato}"); os.remove(parcial)
+                if progreso: progreso(k + 1, total)
+        nombre = f"{nombre_base}_por_{DIVISIONES_EXPORTACION.get(division, 'grupo')}.zip"
+    cache_trabajos().set(f"descarga-{token}", (destino, nombre), expire=TRABAJOS_TTL_S)
+    return token
 
 # --- LAYOUT DE LA APP Y CALLBACKS ---
 external_stylesheets = ['https://fonts.googleapis.com/css2?family=Roboto:wght@300;400;500;700&display=swap', 'https://fonts.googleapis.com/css2?family=Material+Symbols+Outlined']
-app = Dash(__name__, suppress_callback_exceptions=True, external_stylesheets=external_stylesheets)
+app = Dash(__name__, suppress_callback_exceptions=True, external_stylesheets=external_stylesheets, background_callback_manager=gestor_trabajos)
 server = app.server
 app.title = "Planificador de Fertilización"
 
-# --- Carga de datos iniciales ---
-df_req_inicial = cargar_o_crear(REQ_FILE, definir_requerimientos)
-df_fert_inicial = cargar_o_crear(FERT_FILE, definir_fertilizantes)
-# (el resto de cargas iniciales se hacen dentro de los layouts)
+# --- Métricas del servidor ---
+_callbacks_por_salida = {}
+def _nombre_callback(salida):
+    if salida not in _callbacks_por_salida:
+        funcion = app.callback_map.get(salida, {}).get('callback')
+        if funcion is None: return 'desconocido'
+        _callbacks_por_salida[salida] = funcion.__name__
+    return _callbacks_por_salida[salida]
+@server.before_request
+def _registrar_pid_servidor():
+    global _pid_servidor; _pid_servidor = os.getpid()
+@server.after_request
+def _medir_payload_callback(respuesta):
+    if flask.request.path.endswith('/_dash-update-component') and not respuesta.direct_passthrough:
+        etiquetas = {'callback': _nombre_callback((flask.request.get_json(silent=True) or {}).get('output'))}
+        registrar_metrica('planificador_peticion_bytes', etiquetas, flask.request.content_length or 0)
+        registrar_metrica('planificador_respuesta_bytes', etiquetas, respuesta.content_length or len(respuesta.get_data()))
+    return respuesta
+@server.route('/metrics')
+def servir_metricas():
+    import psutil  # importación diferida: solo para la memoria del proceso
+    incorporar_metricas_pendientes()
+    cache = estadisticas_cache()
+    memos = {'mensual': _memo_mensual, 'semanal': _memo_semanal}
+    lineas = _metricas.texto()
+    lineas += texto_prometheus('planificador_importacion_segundos', 'gauge', 'Tiempo de importación del módulo', [((), TIEMPO_IMPORTACION_S)])
+    lineas += texto_prometheus('planificador_cache_tablas_total', 'counter', 'Aciertos, fallos, desalojos e invalidaciones de la caché de tablas', [((('evento', k),), cache[k]) for k in ('hits', 'misses', 'evictions', 'invalidaciones')])
+    lineas += texto_prometheus('planificador_cache_tablas_bytes', 'gauge', 'Memoria ocupada por la caché de tablas', [((), cache['bytes'])])
+    lineas += texto_prometheus('planificador_cache_tablas_entradas', 'gauge', 'Tablas en la caché', [((), cache['entradas'])])
+    lineas += texto_prometheus('planificador_memo_fragmentos_total', 'counter', 'Fragmentos de plan reutilizados o calculados', [((('plan', p), ('resultado', r)), memo.estadisticas[r]) for p, memo in memos.items() for r in ('reutilizados', 'calculados')])
+    lineas += texto_prometheus('planificador_memo_fragmentos_entradas', 'gauge', 'Fragmentos de plan memorizados', [((('plan', p),), len(memo)) for p, memo in memos.items()])
+    lineas += texto_prometheus('planificador_planes_memoria_bytes', 'gauge', 'Planes comprimidos en la memoria del registro', [((), registro_planes()._bytes)])
+    lineas += texto_prometheus('planificador_proceso_memoria_bytes', 'gauge', 'Memoria residente del proceso', [((), psutil.Process().memory_info().rss)])
+    return flask.Response('\n'.join(lineas) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# --- Carga de datos ---
+# Nada se lee al importar: el layout es una función que Dash evalúa en cada carga de página, con las tablas servidas desde la caché
 
 def crear_acordeon_item(titulo, content_id, children, icono='table_rows'):
     return html.Div([
@@ -138,13 +1434,14 @@ nav_sidebar = html.Div(className='nav-sidebar', children=[
 
 def crear_modal_configuracion():
     # Carga de datos para el modal
+    df_req = cargar_o_crear(REQ_FILE, definir_requerimientos)
+    df_fert = cargar_o_crear(FERT_FILE, definir_fertilizantes)
     df_dist1 = cargar_o_crear(DIST1_FILE, definir_distribucion1)
     df_dist2 = cargar_o_crear(DIST2_FILE, definir_distribucion2)
     df_valv = cargar_o_crear(VALV_FILE, definir_valvulas)
     df_limites = cargar_o_crear(LIMITES_FILE, definir_limites)
-    fecha_guardada = datetime.date.today().isoformat()
-    if os.path.exists(FECHA_FILE):
-        with open(FECHA_FILE, 'r') as f: fecha_guardada = f.read()
+    fecha_guardada = leer_fecha_inicio() or datetime.date.today().isoformat()
+    programacion = leer_programacion()
 
     return html.Div(id='modal-backdrop', style={'display': 'none'}, children=[
         html.Div(className='modal-container', children=[
@@ -152,9 +1449,15 @@ def crear_modal_configuracion():
             html.Div(className='modal-body', children=[
                 crear_acordeon_item("Acciones", "content-acciones", [html.Div(id='notificacion-parametros', style={'marginBottom': '10px'}), html.Button("Guardar Configuración", id="btn-guardar-parametros", className="Button Button-primary", style={'width': '100%'}), html.Button("Restaurar Defaults", id="btn-restaurar-parametros", className="Button Button-secondary", style={'width': '100%', 'marginTop': '10px'}),], icono='task_alt'),
                 crear_acordeon_item("Fecha de Inicio", "content-fecha", [dcc.DatePickerSingle(id='fecha-inicio-riego', date=fecha_guardada, style={'width': '100%'})], icono='calendar_month'),
+                crear_acordeon_item("Programación de Riego", "content-programacion", [
+                    dcc.RadioItems(id='programacion-modo', options=[{'label': etiqueta, 'value': modo} for modo, etiqueta in MODOS_PROGRAMACION.items()], value=programacion['modo']),
+                    html.Label("Días de riego:"), dcc.Checklist(id='programacion-dias', options=[{'label': dia, 'value': i} for i, dia in enumerate(DIAS_SEMANA)], value=programacion['dias'], inline=True),
+                    html.Label("Capacidad del inyector (L/día):"), dcc.Input(id='programacion-capacidad', type='number', min=0, value=programacion['capacidad_l_dia']),
+                    html.Label("Horas de riego por ha:"), dcc.Input(id='programacion-horas-ha', type='number', min=0, step=0.05, value=programacion['horas_por_ha']),
+                    html.Label("Horas de riego por válvula y día:"), dcc.Input(id='programacion-horas-valvula', type='number', min=0, max=24, value=programacion['horas_valvula_dia'])], icono='event_repeat'),
                 crear_acordeon_item("Límites de Nutrientes", "content-limites", [dash_table.DataTable(id='tabla-limites-nutrientes', columns=[{"name": i, "id": i} for i in df_limites.columns], data=df_limites.to_dict('records'), editable=True)], icono='scale'),
-                crear_acordeon_item("Requerimientos Anuales", "content-req", [dash_table.DataTable(id='tabla-req', columns=[{"name": i, "id": i} for i in df_req_inicial.columns], data=df_req_inicial.to_dict('records'), editable=True, row_deletable=True)], icono='grass'),
-                crear_acordeon_item("Fertilizantes", "content-fert", [dash_table.DataTable(id='tabla-fert', columns=[{"name": i, "id": i} for i in df_fert_inicial.columns], data=df_fert_inicial.to_dict('records'), editable=True, row_deletable=True)], icono='science'),
+                crear_acordeon_item("Requerimientos Anuales", "content-req", [dash_table.DataTable(id='tabla-req', columns=[{"name": i, "id": i} for i in df_req.columns], data=df_req.to_dict('records'), editable=True, row_deletable=True)], icono='grass'),
+                crear_acordeon_item("Fertilizantes", "content-fert", [dash_table.DataTable(id='tabla-fert', columns=[{"name": i, "id": i} for i in df_fert.columns], data=df_fert.to_dict('records'), editable=True, row_deletable=True)], icono='science'),
                 crear_acordeon_item("Distribución (2011-17)", "content-dist1", [dash_table.DataTable(id='tabla-dist1', columns=[{"name": i, "id": i} for i in df_dist1.columns], data=df_dist1.to_dict('records'), editable=True)], icono='percent'),
                 crear_acordeon_item("Distribución (2018-19)", "content-dist2", [dash_table.DataTable(id='tabla-dist2', columns=[{"name": i, "id": i} for i in df_dist2.columns], data=df_dist2.to_dict('records'), editable=True)], icono='percent'),
                 crear_acordeon_item("Superficies por Válvula", "content-valvulas", [dash_table.DataTable(id='tabla-valvulas', columns=[{"name": i, "id": i} for i in df_valv.columns], data=df_valv.to_dict('records'), editable=True)], icono='valve'),
@@ -162,23 +1465,33 @@ def crear_modal_configuracion():
         ])
     ])
 
-opciones_dropdown_anio = [{'label': 'Todos los Años', 'value': 'todos'}] + \
-    [{'label': str(anio), 'value': int(anio)} for anio in sorted(df_req_inicial['Anio'].unique())]
-opciones_dropdown_sector = [{'label': 'Todos los Sectores', 'value': 'todos'}] + \
-    [{'label': sec, 'value': sec} for sec in df_req_inicial['Sector'].unique()]
+# Opciones calculadas al armar cada layout, así reflejan los requerimientos guardados desde la configuración
+def opciones_dropdown_anio():
+    df_req = cargar_o_crear(REQ_FILE, definir_requerimientos)
+    return [{'label': 'Todos los Años', 'value': 'todos'}] + [{'label': str(anio), 'value': int(anio)} for anio in sorted(df_req['Anio'].unique())]
+def opciones_dropdown_sector():
+    df_req = cargar_o_crear(REQ_FILE, definir_requerimientos)
+    return [{'label': 'Todos los Sectores', 'value': 'todos'}] + [{'label': sec, 'value': sec} for sec in df_req['Sector'].unique()]
+
+def tabla_paginada(table_id, columns=None, **kwargs):
+    # Paginado, orden y filtro se resuelven en el servidor: al navegador solo viaja la página visible
+    return dash_table.DataTable(id=table_id, data=[], columns=columns or [], page_current=0, page_size=10, page_count=1, page_action='custom', sort_action='custom', sort_mode='multi', sort_by=[], filter_action='custom', filter_query='', style_table={'overflowX': 'auto'}, **kwargs)
 
 def layout_planificacion():
     # ... (sin cambios)
     return html.Div([
         html.Div(className='page-header', children=[html.H1("Planes de Fertilización")]),
         html.Div([html.Button("Generar Plan Mensual", id="btn-generar-mensual", className="Button Button-secondary"), html.Button("Generar Plan Semanal", id="btn-generar-semanal", className="Button Button-secondary")], style={'marginBottom': '20px', 'display': 'flex', 'gap': '10px'}),
-        html.Div([html.Div([html.Label("Filtrar por Año:"), dcc.Dropdown(id='dropdown-filtro-anio', options=opciones_dropdown_anio, value='todos', clearable=False, style={'width': '200px'})]),
-            html.Div([html.Button([html.I(className="material-symbols-outlined", children="download"), " Plan Mensual"], id="btn-download-mensual", className="Button Button-secondary"), html.Button([html.I(className="material-symbols-outlined", children="download"), " Plan Semanal"], id="btn-download-semanal", className="Button Button-secondary", style={'marginLeft': '10px'})])
+        panel_progreso('planes'),
+        html.Div([html.Div([html.Label("Filtrar por Año:"), dcc.Dropdown(id='dropdown-filtro-anio', options=opciones_dropdown_anio(), value='todos', clearable=False, style={'width': '200px'})]),
+            html.Div([dcc.Dropdown(id='dropdown-formato-exportacion', options=[{'label': etiqueta, 'value': formato} for formato, etiqueta in formatos_disponibles().items()], value=next(iter(formatos_disponibles())), clearable=False, style={'width': '110px'}),
+                      dcc.Dropdown(id='dropdown-division-exportacion', options=[{'label': 'Un archivo', 'value': 'ninguna'}, {'label': 'Por año', 'value': 'Año Plantación'}, {'label': 'Por sector', 'value': 'Sector'}], value='ninguna', clearable=False, style={'width': '140px'}),
+                      html.Button([html.I(className="material-symbols-outlined", children="download"), " Plan Mensual"], id="btn-download-mensual", className="Button Button-secondary"), html.Button([html.I(className="material-symbols-outlined", children="download"), " Plan Semanal"], id="btn-download-semanal", className="Button Button-secondary")], style={'display': 'flex', 'gap': '10px', 'alignItems': 'center'})
         ], style={'marginBottom': '20px', 'display': 'flex', 'alignItems': 'center', 'justifyContent': 'space-between'}),
         html.H4("Plan Mensual"),
-        dcc.Loading(type="circle", children=[html.Div(id='plan-mensual-container')]),
+        dcc.Loading(type="circle", children=[html.Div(id='plan-mensual-container', children=tabla_paginada('tabla-plan-mensual'))]),
         html.H4("Plan Semanal"),
-        dcc.Loading(type="circle", children=[html.Div(id='plan-semanal-container')])
+        dcc.Loading(type="circle", children=[html.Div(id='plan-semanal-container', children=tabla_paginada('tabla-plan-semanal'))])
     ])
 
 def layout_seguimiento():
@@ -198,12 +1511,19 @@ def layout_seguimiento():
         html.H4("Órden de Trabajo"),
         html.Div(style={'display': 'flex', 'alignItems': 'flex-end', 'gap': '15px', 'marginBottom': '20px'}, children=[
             html.Div([html.Label("Fecha de Riego"), dcc.DatePickerSingle(id='filtro-fecha-orden', style={'width': '150px'})]),
-            html.Div([html.Label("Sector"), dcc.Dropdown(id='filtro-sector-orden', options=opciones_dropdown_sector, placeholder="Todos", style={'width': '200px'})]),
-            html.Div([html.Label("Año Plantación"), dcc.Dropdown(id='filtro-anio-orden', options=opciones_dropdown_anio, placeholder="Todos", style={'width': '150px'})]),
+            html.Div([html.Label("Sector"), dcc.Dropdown(id='filtro-sector-orden', options=opciones_dropdown_sector(), placeholder="Todos", style={'width': '200px'})]),
+            html.Div([html.Label("Año Plantación"), dcc.Dropdown(id='filtro-anio-orden', options=opciones_dropdown_anio(), placeholder="Todos", style={'width': '150px'})]),
             html.Button([html.I(className="material-symbols-outlined", children="print"), "Generar Orden (PDF)"], id="btn-generar-orden-pdf", className="Button Button-secondary"),
         ]),
+        html.Div(style={'display': 'flex', 'alignItems': 'flex-end', 'gap': '15px', 'marginBottom': '20px'}, children=[
+            html.Div([html.Label("Semanas a Futuro"), dcc.Input(id='lote-semanas', type='number', min=1, max=12, step=1, value=2, style={'width': '100px'})]),
+            html.Div([html.Label("Formato"), dcc.RadioItems(id='lote-formato', options=[{'label': ' ZIP (un PDF por orden)', 'value': 'zip'}, {'label': ' PDF único', 'value': 'pdf'}], value='zip', inline=True)]),
+            html.Button([html.I(className="material-symbols-outlined", children="print"), "Órdenes en Lote (Fecha x Sector)"], id="btn-generar-ordenes-lote", className="Button Button-secondary"),
+        ]),
+        panel_progreso('orden'),
         html.H4("Aplicaciones Reales (Editable)"),
-        dcc.Loading(type="circle", children=[dash_table.DataTable(id='tabla-aplicaciones-reales', data=[], columns=columnas_seguimiento_inicial, row_deletable=False, page_size=10, style_table={'overflowX': 'auto'})]),
+        dcc.Store(id='store-seguimiento-version'), dcc.Store(id='store-ediciones-pendientes', data={}),
+        dcc.Loading(type="circle", children=[tabla_paginada('tabla-aplicaciones-reales', columns=columnas_seguimiento_inicial, row_deletable=False)]),
         html.Br(),
         html.Button("Guardar Datos y Auto-Ajustar Plan", id="btn-guardar-reales", className="Button Button-primary"),
         html.Div(id='notificacion-seguimiento', style={'marginTop': '20px'}),
@@ -217,22 +1537,15 @@ def kpi_card(title, value_id):
     ])
 
 def layout_dashboard():
-    # Obtener opciones de mes desde el plan de seguimiento real para los filtros
-    try:
-        df_reales = cargar_o_crear(APLIC_REALES_FILE, lambda: pd.DataFrame())
-        if not df_reales.empty and 'Fecha Estimada' in df_reales.columns:
-            df_reales['Mes Plan'] = pd.to_datetime(df_reales['Fecha Estimada']).dt.to_period('M').astype(str)
-            opciones_mes = [{'label': mes, 'value': mes} for mes in sorted(df_reales['Mes Plan'].unique())]
-        else:
-            opciones_mes = []
-    except Exception:
-        opciones_mes = []
+    # Opciones de mes: meses con aplicaciones registradas según el cubo (mismo criterio que usa el filtro)
+    try: opciones_mes = [{'label': mes, 'value': mes} for mes in sorted(cubo_dashboard().index.get_level_values('Mes').unique())]
+    except Exception: opciones_mes = []
 
     return html.Div([
         html.Div(className='page-header', children=[html.H1("Dashboard de Seguimiento")]),
         html.Div(className='dashboard-filters', children=[
-            html.Div([html.Label("Sector"), dcc.Dropdown(id='dash-filtro-sector', options=opciones_dropdown_sector, placeholder="Todos", style={'width': '100%'})]),
-            html.Div([html.Label("Año"), dcc.Dropdown(id='dash-filtro-anio', options=opciones_dropdown_anio, placeholder="Todos", style={'width': '100%'})]),
+            html.Div([html.Label("Sector"), dcc.Dropdown(id='dash-filtro-sector', options=opciones_dropdown_sector(), placeholder="Todos", style={'width': '100%'})]),
+            html.Div([html.Label("Año"), dcc.Dropdown(id='dash-filtro-anio', options=opciones_dropdown_anio(), placeholder="Todos", style={'width': '100%'})]),
             html.Div([html.Label("Mes"), dcc.Dropdown(id='dash-filtro-mes', options=opciones_mes, placeholder="Todos", style={'width': '100%'})]),
         ]),
         html.Div(className='kpi-container', children=[
@@ -248,24 +1561,27 @@ def layout_dashboard():
         dcc.Loading(type="circle", children=dcc.Graph(id='graph-por-sector', className='graph-card', style={'marginTop': '20px'})),
     ])
 
-app.layout = html.Div(className='app-container', children=[
-    dcc.Location(id='url', refresh=False),
-    dcc.Store(id='store-plan-mensual'), dcc.Store(id='store-plan-semanal'),
-    dcc.Download(id="download-excel-mensual"), dcc.Download(id="download-excel-semanal"),
-    dcc.Download(id="download-orden-pdf"),
-    nav_sidebar,
-    html.Div(className='main-content-wrapper', children=[
-        html.Div(className='logo-header', children=[
-            html.Img(src='/assets/Logo Fortin Castre.jpg', style={'height': '60px', 'marginRight': '20px'}),
-            html.Img(src='/assets/Logo Rivera Grande.jpg', style={'height': '60px', 'marginLeft': '20px'})
+def layout_app():
+    return html.Div(className='app-container', children=[
+        dcc.Location(id='url', refresh=False),
+        dcc.Store(id='store-plan-mensual'), dcc.Store(id='store-plan-semanal'),
+        dcc.Location(id='url-descarga', refresh=True),
+        dcc.Download(id="download-orden-pdf"), dcc.Download(id="download-ordenes-lote"),
+        nav_sidebar,
+        html.Div(className='main-content-wrapper', children=[
+            html.Div(className='logo-header', children=[
+                html.Img(src='/assets/Logo Fortin Castre.jpg', style={'height': '60px', 'marginRight': '20px'}),
+                html.Img(src='/assets/Logo Rivera Grande.jpg', style={'height': '60px', 'marginLeft': '20px'})
+            ]),
+            html.Div(className='main-content', id='page-content', children=layout_planificacion()),
         ]),
-        html.Div(className='main-content', id='page-content', children=layout_planificacion()),
-    ]),
-    crear_modal_configuracion()
-])
+        crear_modal_configuracion()
+    ])
+app.layout = layout_app
 
 # --- Callbacks ---
 @app.callback(Output('page-content', 'children'), Input('url', 'pathname'))
+@medir_callback
 def display_page(pathname):
     if pathname == '/seguimiento': return layout_seguimiento()
     if pathname == '/dashboard': return layout_dashboard()
@@ -274,26 +1590,28 @@ def display_page(pathname):
 # (Callbacks de modal, acordeón, guardar/restaurar, y generación de planes sin cambios)
 # ...
 @app.callback(Output('modal-backdrop', 'style'), [Input('btn-abrir-config', 'n_clicks'), Input('btn-cerrar-config', 'n_clicks')], prevent_initial_call=True)
+@medir_callback
 def toggle_config_modal(n_open, n_close):
     triggered_id = dash.callback_context.triggered_id
     if triggered_id == 'btn-abrir-config': return {'display': 'flex'}
     if triggered_id == 'btn-cerrar-config': return {'display': 'none'}
     return dash.no_update
 @app.callback([Output({'type': 'accordion-collapse', 'index': MATCH}, 'className'), Output({'type': 'accordion-toggle', 'index': MATCH}, 'className')], Input({'type': 'accordion-toggle', 'index': MATCH}, 'n_clicks'), [State({'type': 'accordion-collapse', 'index': MATCH}, 'className'), State({'type': 'accordion-toggle', 'index': MATCH}, 'className')], prevent_initial_call=True)
+@medir_callback
 def toggle_accordion(n, collapse_class, button_class):
     return ('accordion-content', 'accordion-button') if 'open' in collapse_class else ('accordion-content open', 'accordion-button open')
-@app.callback(Output('notificacion-parametros', 'children'), [Input('btn-guardar-parametros', 'n_clicks'), Input('btn-restaurar-parametros', 'n_clicks')], [State('tabla-req', 'data'), State('tabla-fert', 'data'), State('tabla-limites-nutrientes', 'data'), State('tabla-dist1', 'data'), State('tabla-dist2', 'data'), State('tabla-valvulas', 'data'), State('fecha-inicio-riego', 'date')], prevent_initial_call=True)
-def guardar_o_restaurar_parametros(n_g, n_r, req, fert, limites, d1, d2, valv, fecha):
+@app.callback(Output('notificacion-parametros', 'children'), [Input('btn-guardar-parametros', 'n_clicks'), Input('btn-restaurar-parametros', 'n_clicks')], [State('tabla-req', 'data'), State('tabla-fert', 'data'), State('tabla-limites-nutrientes', 'data'), State('tabla-dist1', 'data'), State('tabla-dist2', 'data'), State('tabla-valvulas', 'data'), State('fecha-inicio-riego', 'date'), State('programacion-modo', 'value'), State('programacion-dias', 'value'), State('programacion-capacidad', 'value'), State('programacion-horas-ha', 'value'), State('programacion-horas-valvula', 'value')], prevent_initial_call=True)
+@medir_callback
+def guardar_o_restaurar_parametros(n_g, n_r, req, fert, limites, d1, d2, valv, fecha, *formulario_programacion):
     ctx = dash.callback_context;
     if not ctx.triggered: return ""
     btn_id = ctx.triggered[0]['prop_id'].split('.')[0]
     if btn_id == 'btn-guardar-parametros':
-        pd.DataFrame(req).to_csv(REQ_FILE, index=False); pd.DataFrame(fert).to_csv(FERT_FILE, index=False); pd.DataFrame(limites).to_csv(LIMITES_FILE, index=False); pd.DataFrame(d1).to_csv(DIST1_FILE, index=False); pd.DataFrame(d2).to_csv(DIST2_FILE, index=False); pd.DataFrame(valv).to_csv(VALV_FILE, index=False)
-        with open(FECHA_FILE, 'w') as f: f.write(fecha)
+        guardar_tabla(REQ_FILE, pd.DataFrame(req)); guardar_tabla(FERT_FILE, pd.DataFrame(fert)); guardar_tabla(LIMITES_FILE, pd.DataFrame(limites)); guardar_tabla(DIST1_FILE, pd.DataFrame(d1)); guardar_tabla(DIST2_FILE, pd.DataFrame(d2)); guardar_tabla(VALV_FILE, pd.DataFrame(valv))
+        guardar_fecha_inicio(fecha); guardar_programacion(programacion_desde_formulario(*formulario_programacion))
         return html.P("¡Configuración guardada!", style={'color': '#1E8E3E', 'fontWeight': 'bold'})
     elif btn_id == 'btn-restaurar-parametros':
-        for f in [REQ_FILE, FERT_FILE, LIMITES_FILE, DIST1_FILE, DIST2_FILE, VALV_FILE, FECHA_FILE, PLAN_SEMANAL_FILE, APLIC_REALES_FILE]:
-            if os.path.exists(f): os.remove(f)
+        for f in [REQ_FILE, FERT_FILE, LIMITES_FILE, DIST1_FILE, DIST2_FILE, VALV_FILE, FECHA_FILE, PROGRAMACION_FILE, PLAN_SEMANAL_FILE, APLIC_REALES_FILE]: eliminar_tabla(f)
         return html.P("Valores restaurados. Refresca la página.", style={'color': 'blue', 'fontWeight': 'bold'})
     return ""
 def limpiar_y_preparar_tabla(df):
@@ -307,112 +1625,287 @@ def limpiar_y_preparar_tabla(df):
     numeric_cols = df.select_dtypes(include=np.number).columns; df[numeric_cols] = df[numeric_cols].round(2)
     cols = [{"name": i, "id": i} for i in df.columns]; data = df.to_dict('records')
     return data, cols
-@app.callback(Output('store-plan-mensual', 'data'), Input('btn-generar-mensual', 'n_clicks'), prevent_initial_call=True)
-def generar_y_almacenar_plan_mensual(n_clicks):
-    df_plan = generar_plan_mensual_economico(); return df_plan.to_dict('records')
-@app.callback(Output('store-plan-semanal', 'data'), Input('btn-generar-semanal', 'n_clicks'), [State('store-plan-mensual', 'data'), State('tabla-limites-nutrientes', 'data'), State('fecha-inicio-riego', 'date')], prevent_initial_call=True)
-def generar_y_almacenar_plan_semanal(n_clicks, plan_mensual_data, limites_data, fecha_guardada):
-    if not plan_mensual_data: return None
-    df_mensual = pd.DataFrame(plan_mensual_data); df_valv = cargar_o_crear(VALV_FILE, definir_valvulas); df_limites = pd.DataFrame(limites_data)
-    df_plan = generar_plan_semanal(df_mensual, df_valv, df_limites, fecha_guardada)
-    if not df_plan.empty and 'Fecha Estimada' in df_plan.columns:
-        df_plan['Fecha Estimada'] = pd.to_datetime(df_plan['Fecha Estimada'])
-        df_plan.sort_values(by=['Fecha Estimada', 'Válvula'], inplace=True)
-        df_plan['Fecha Estimada'] = df_plan['Fecha Estimada'].dt.strftime('%Y-%m-%d')
-        pd.DataFrame(df_plan).to_csv(PLAN_SEMANAL_FILE, index=False)
-        return df_plan.to_dict('records')
-    return None
-@app.callback(Output('plan-mensual-container', 'children'), [Input('store-plan-mensual', 'data'), Input('dropdown-filtro-anio', 'value')])
-def actualizar_vista_plan_mensual(plan_data, anio_seleccionado):
-    if not plan_data: return []
-    df = pd.DataFrame(plan_data).copy()
-    if anio_seleccionado != 'todos': df = df[df['Año Plantación'] == int(anio_seleccionado)]
-    data, cols = limpiar_y_preparar_tabla(df); return dash_table.DataTable(id='tabla-plan-mensual', data=data, columns=cols, page_size=10, style_table={'overflowX': 'auto'})
-@app.callback(Output('plan-semanal-container', 'children'), [Input('store-plan-semanal', 'data'), Input('dropdown-filtro-anio', 'value')])
-def actualizar_vista_plan_semanal(plan_data, anio_seleccionado):
-    if not plan_data: return []
-    df = pd.DataFrame(plan_data).copy()
-    if anio_seleccionado != 'todos': df = df[df['Año Plantación'] == int(anio_seleccionado)]
-    data, cols = limpiar_y_preparar_tabla(df); return dash_table.DataTable(id='tabla-plan-semanal', data=data, columns=cols, page_size=10, style_table={'overflowX': 'auto'})
-@app.callback(Output("download-excel-mensual", "data"), Input("btn-download-mensual", "n_clicks"), [State('store-plan-mensual', 'data'), State('dropdown-filtro-anio', 'value')], prevent_initial_call=True)
-def descargar_plan_mensual(n_clicks, data, anio_seleccionado):
-    if not n_clicks or not data or dash.callback_context.triggered_id != 'btn-download-mensual': raise dash.exceptions.PreventUpdate
-    df = pd.DataFrame(data).copy()
-    if anio_seleccionado != 'todos': df = df[df['Año Plantación'] == int(anio_seleccionado)]
-    nombre_archivo = f"plan_mensual_{anio_seleccionado}.xlsx" if anio_seleccionado != 'todos' else "plan_mensual_completo.xlsx"
-    return dcc.send_data_frame(df.to_excel, nombre_archivo, sheet_name="Plan Mensual", index=False)
-@app.callback(Output("download-excel-semanal", "data"), Input("btn-download-semanal", "n_clicks"), [State('store-plan-semanal', 'data'), State('dropdown-filtro-anio', 'value')], prevent_initial_call=True)
-def descargar_plan_semanal(n_clicks, data, anio_seleccionado):
-    if not n_clicks or not data or dash.callback_context.triggered_id != 'btn-download-semanal': raise dash.exceptions.PreventUpdate
-    df = pd.DataFrame(data).copy()
-    if anio_seleccionado != 'todos': df = df[df['Año Plantación'] == int(anio_seleccionado)]
-    nombre_archivo = f"plan_semanal_{anio_seleccionado}.xlsx" if anio_seleccionado != 'todos' else "plan_semanal_completo.xlsx"
-    return dcc.send_data_frame(df.to_excel, nombre_archivo, sheet_name="Plan Semanal", index=False)
-@app.callback(Output('tabla-aplicaciones-reales', 'data'), Input('btn-cargar-seguimiento', 'n_clicks'))
+# La marca de tiempo del clic distingue en la clave del trabajo de Dash solicitudes iguales de distintos usuarios; la deduplicación real la hace trabajo_unico
+@app.callback(Output('store-plan-mensual', 'data'), Input('btn-generar-mensual', 'n_clicks'), State('btn-generar-mensual', 'n_clicks_timestamp'), prevent_initial_call=True, **opciones_trabajo('planes', 'btn-generar-mensual'))
+@medir_callback
+def generar_y_almacenar_plan_mensual(set_progress, n_clicks, _marca):
+    set_progress(("Cargando tablas...", 0, 2))
+    tablas = tablas_plan_mensual(); handle = 'mensual-' + huella(*tablas)
+    def calcular():
+        if not registro_planes().contiene(handle): set_progress(("Calculando plan mensual...", 1, 2)); registro_planes().guardar(handle, compactar_plan(generar_plan_mensual_economico(tablas=tablas)))
+        return handle
+    return trabajo_unico(handle, calcular, esperando=lambda: set_progress(("Esperando un cálculo idéntico en curso...", 1, 2)))
+@app.callback(Output('store-plan-semanal', 'data'), Input('btn-generar-semanal', 'n_clicks'), [State('btn-generar-semanal', 'n_clicks_timestamp'), State('store-plan-mensual', 'data'), State('tabla-limites-nutrientes', 'data'), State('fecha-inicio-riego', 'date'), State('programacion-modo', 'value'), State('programacion-dias', 'value'), State('programacion-capacidad', 'value'), State('programacion-horas-ha', 'value'), State('programacion-horas-valvula', 'value')], prevent_initial_call=True, **opciones_trabajo('planes', 'btn-generar-semanal'))
+@medir_callback
+def generar_y_almacenar_plan_semanal(set_progress, n_clicks, _marca, handle_mensual, limites_data, fecha_guardada, *formulario_programacion):
+    set_progress(("Cargando tablas...", 0, 3))
+    df_mensual = registro_planes().obtener(handle_mensual)
+    if df_mensual is None: return None
+    df_valv = cargar_o_crear(VALV_FILE, definir_valvulas); df_limites = pd.DataFrame(limites_data); df_fert = cargar_o_crear(FERT_FILE, definir_fertilizantes)
+    programacion = programacion_desde_formulario(*formulario_programacion)
+    handle = 'semanal-' + huella(handle_mensual, df_valv, df_limites, fecha_guardada, df_fert, programacion)
+    def calcular():
+        df_plan = registro_planes().obtener(handle)
+        if df_plan is None:
+            set_progress(("Calculando plan semanal...", 1, 3))
+            df_plan = generar_plan_semanal(expandir_plan(df_mensual), df_valv, df_limites, fecha_guardada, df_fert=df_fert, programacion=programacion)
+            if df_plan.empty: return None
+            # Fechas en días enteros: se ordena sin volver a parsear texto. Un 'Error' (p. ej. la capacidad no alcanza) se registra igual para mostrarlo en la vista
+            if 'Fecha Estimada' in df_plan.columns: df_plan = compactar_plan(df_plan).sort_values(by=['Fecha Estimada', 'Válvula'], kind='stable', ignore_index=True)
+            registro_planes().guardar(handle, df_plan)
+        return handle
+    # El resultado del trabajo (solo el handle) puede venir de la caché: la tabla que leen seguimiento y dashboard se escribe siempre con el plan elegido
+    if trabajo_unico(handle, calcular, esperando=lambda: set_progress(("Esperando un cálculo idéntico en curso...", 1, 3))) is None: return None
+    df_plan = registro_planes().obtener(handle)
+    if df_plan is None: return None
+    if 'Fecha Estimada' in df_plan.columns: set_progress(("Guardando plan semanal...", 2, 3)); guardar_tabla(PLAN_SEMANAL_FILE, expandir_plan(df_plan))
+    return handle
+# '{columna} operador valor': el operador es el primer token después de '}' (los de palabra deben ir seguidos de espacio), nunca se busca dentro del valor
+_FILTRO_RE = re.compile(r'\s*\{(?P<columna>[^}]*)\}\s*(?P<operador>(?:is\s+[a-z]+|[a-z]+)(?=\s|$)|>=|<=|!=|<|>|=)(?P<valor>.*)$', re.DOTALL)
+OPERADORES_SIMBOLO_FILTRO = {'>=': 'ge', '<=': 'le', '!=': 'ne', '<': 'lt', '>': 'gt', '=': 'eq'}
+OPERADORES_TEXTO_FILTRO = ('contains', 'datestartswith')  # comparan el texto de la celda: el valor no se convierte a número
+def _parsear_filtro(filtro):
+    # Mismo formato que filter_query de DataTable. Prefijo 's' (distingue mayúsculas, el de siempre) o 'i' (no distingue): 'icontains' queda como operador 'icontains'.
+    # De los operadores unarios solo 'is blank' / 'is nil' ('blank'); cualquier otro es ValueError en lugar de ignorar el filtro en silencio
+    coincidencia = _FILTRO_RE.match(filtro)
+    if not coincidencia: raise ValueError(f"Filtro no reconocido: {filtro.strip()}")
+    nombre, operador, valor = coincidencia.group('columna'), re.sub(r'\s+', ' ', coincidencia.group('operador')), coincidencia.group('valor').strip()
+    if operador in ('is blank', 'is nil'): return nombre, 'blank', None
+    operador, prefijo = OPERADORES_SIMBOLO_FILTRO.get(operador, operador), ''
+    conocido = lambda op: op in OPERADORES_FILTRO or op in OPERADORES_TEXTO_FILTRO
+    if not conocido(operador) and operador[0] in 'is' and conocido(operador[1:]): prefijo, operador = operador[0], operador[1:]
+    if not conocido(operador): raise ValueError(f"Operador de filtro no soportado: {coincidencia.group('operador')}")
+    if valor and valor[0] == valor[-1] and valor[0] in ("'", '"', '`'): valor = valor[1:-1].replace('\\' + valor[0], valor[0])
+    elif operador in OPERADORES_FILTRO:
+        # Solo las comparaciones son numéricas; '2011' queda entero para que comparado como texto siga siendo '2011'
+        for convertir in (int, float):
+            try: valor = convertir(valor); break
+            except ValueError: pass
+    return nombre, ('i' if prefijo == 'i' else '') + operador, valor
+def pagina_de_tabla(origen, anio_seleccionado, page_current, page_size, sort_by, filter_query, orden_defecto=()):
+    # origen: ruta de una tabla del almacenamiento o un DataFrame ya resuelto (planes del registro)
+    try: filtros = [_parsear_filtro(parte) for parte in (filter_query or '').split(' && ') if parte.strip()]
+    except ValueError as e: return *limpiar_y_preparar_tabla(pd.DataFrame({'Error': [str(e)]})), 1
+    orden = [(s['column_id'], s['direction'] == 'asc') for s in sort_by or []] or list(orden_defecto)
+    page_size = page_size or 10
+    anio = int(anio_seleccionado) if anio_seleccionado not in (None, 'todos') else None
+    consultar = (lambda offset: paginar_frame(origen, filtros, orden, anio, offset, page_size)) if isinstance(origen, pd.DataFrame) else (lambda offset: almacenamiento().consultar_pagina(origen, filtros=filtros, orden=orden, anio=anio, offset=offset, limite=page_size))
+    df, total = consultar((page_current or 0) * page_size)
+    page_count = max(1, -(-total // page_size))
+    if df.empty and total > 0: df, _ = consultar((page_count - 1) * page_size)
+    cols = [{"name": i, "id": i} for i in df.columns if i != 'id']
+    data, _ = limpiar_y_preparar_tabla(expandir_plan(df)) if not df.empty else ([], [])
+    return data, cols, page_count
+@app.callback([Output('tabla-plan-mensual', 'data'), Output('tabla-plan-mensual', 'columns'), Output('tabla-plan-mensual', 'page_count')], [Input('store-plan-mensual', 'data'), Input('dropdown-filtro-anio', 'value'), Input('tabla-plan-mensual', 'page_current'), Input('tabla-plan-mensual', 'page_size'), Input('tabla-plan-mensual', 'sort_by'), Input('tabla-plan-mensual', 'filter_query')])
+@medir_callback
+def actualizar_vista_plan_mensual(handle, anio_seleccionado, page_current, page_size, sort_by, filter_query):
+    df = registro_planes().obtener(handle)
+    if df is None: return [], [], 1
+    return pagina_de_tabla(df, anio_seleccionado, page_current, page_size, sort_by, filter_query)
+@app.callback([Output('tabla-plan-semanal', 'data'), Output('tabla-plan-semanal', 'columns'), Output('tabla-plan-semanal', 'page_count')], [Input('store-plan-semanal', 'data'), Input('dropdown-filtro-anio', 'value'), Input('tabla-plan-semanal', 'page_current'), Input('tabla-plan-semanal', 'page_size'), Input('tabla-plan-semanal', 'sort_by'), Input('tabla-plan-semanal', 'filter_query')])
+@medir_callback
+def actualizar_vista_plan_semanal(handle, anio_seleccionado, page_current, page_size, sort_by, filter_query):
+    df = registro_planes().obtener(handle)
+    if df is None: return [], [], 1
+    return pagina_de_tabla(df, anio_seleccionado, page_current, page_size, sort_by, filter_query)
+def _exportar_plan_guardado(set_progress, handle, anio_seleccionado, formato, division, prefijo, hoja):
+    division = division if division in DIVISIONES_EXPORTACION else None
+    def exportar():
+        set_progress(("Preparando exportación...", 0, 1))
+        df = registro_planes().obtener(handle)
+        if df is None or 'Error' in df.columns or 'Mensaje' in df.columns: return None  # el mensaje ya se ve en la tabla del plan
+        if anio_seleccionado != 'todos': df = df[df['Año Plantación'] == int(anio_seleccionado)]
+        nombre_base = f"{prefijo}_{anio_seleccionado}" if anio_seleccionado != 'todos' else f"{prefijo}_completo"
+        return exportar_plan(df, nombre_base, formato, hoja, division, progreso=lambda hechos, total: set_progress((f"Archivos escritos: {hechos}/{total}", hechos, total)))
+    token = trabajo_unico(f"exportacion-{handle}-{anio_seleccionado}-{formato}-{division}", exportar, esperando=lambda: set_progress(("Esperando una exportación idéntica en curso...", 0, 1)))
+    if token is None: raise dash.exceptions.PreventUpdate
+    return f"/descargas/{token}"
+@app.callback(Output('url-descarga', 'href', allow_duplicate=True), Input("btn-download-mensual", "n_clicks"), [State("btn-download-mensual", "n_clicks_timestamp"), State('store-plan-mensual', 'data'), State('dropdown-filtro-anio', 'value'), State('dropdown-formato-exportacion', 'value'), State('dropdown-division-exportacion', 'value')], prevent_initial_call=True, **opciones_trabajo('planes', 'btn-download-mensual'))
+@medir_callback
+def descargar_plan_mensual(set_progress, n_clicks, _marca, handle, anio_seleccionado, formato, division):
+    if not n_clicks or not handle: raise dash.exceptions.PreventUpdate
+    return _exportar_plan_guardado(set_progress, handle, anio_seleccionado, formato, division, "plan_mensual", "Plan Mensual")
+@app.callback(Output('url-descarga', 'href', allow_duplicate=True), Input("btn-download-semanal", "n_clicks"), [State("btn-download-semanal", "n_clicks_timestamp"), State('store-plan-semanal', 'data'), State('dropdown-filtro-anio', 'value'), State('dropdown-formato-exportacion', 'value'), State('dropdown-division-exportacion', 'value')], prevent_initial_call=True, **opciones_trabajo('planes', 'btn-download-semanal'))
+@medir_callback
+def descargar_plan_semanal(set_progress, n_clicks, _marca, handle, anio_seleccionado, formato, division):
+    if not n_clicks or not handle: raise dash.exceptions.PreventUpdate
+    return _exportar_plan_guardado(set_progress, handle, anio_seleccionado, formato, division, "plan_semanal", "Plan Semanal")
+@server.route('/descargas/<token>')
+def servir_descarga(token):
+    # El archivo se envía desde disco por bloques; el token vence junto con el resultado del trabajo
+    descarga = cache_trabajos().get(f"descarga-{token}")
+    if descarga is None or not os.path.exists(descarga[0]): flask.abort(404)
+    return flask.send_file(descarga[0], as_attachment=True, download_name=descarga[1])
+COLUMNAS_EDITABLES_SEGUIMIENTO = ['Litros Reales Aplicados', 'Fecha Aplicación Real', 'Observaciones']
+@app.callback(Output('store-seguimiento-version', 'data'), Input('btn-cargar-seguimiento', 'n_clicks'))
+@medir_callback
 def cargar_seguimiento(n_clicks):
     if n_clicks is None: raise dash.exceptions.PreventUpdate
-    if not os.path.exists(APLIC_REALES_FILE) or os.path.getsize(APLIC_REALES_FILE) == 0:
+    # Cada aplicación lleva un 'id' estable (row id de DataTable) para que las ediciones de cualquier página vuelvan a su fila
+    if not almacenamiento().existe(APLIC_REALES_FILE):
         df_plan_sem = cargar_o_crear(PLAN_SEMANAL_FILE, lambda: pd.DataFrame())
-        if df_plan_sem.empty: return []
+        if df_plan_sem.empty: return None
+        df_plan_sem.insert(0, 'id', np.arange(len(df_plan_sem)))
+        df_plan_sem[COLUMNA_PLAN_ORIGINAL] = df_plan_sem['Litros Planeados']
         df_plan_sem['Litros Reales Aplicados'] = ''
         df_plan_sem['Fecha Aplicación Real'] = ''
         df_plan_sem['Observaciones'] = ''
-        df_plan_sem.to_csv(APLIC_REALES_FILE, index=False)
-        data, _ = limpiar_y_preparar_tabla(df_plan_sem)
-        return data
+        guardar_tabla(APLIC_REALES_FILE, df_plan_sem)
     else:
-        df_reales = pd.read_csv(APLIC_REALES_FILE)
-        if not df_reales.empty and 'Fecha Estimada' in df_reales.columns:
-            df_reales['Fecha Estimada'] = pd.to_datetime(df_reales['Fecha Estimada'])
-            df_reales.sort_values(by=['Fecha Estimada', 'Válvula'], inplace=True)
-            df_reales['Fecha Estimada'] = df_reales['Fecha Estimada'].dt.strftime('%Y-%m-%d')
-        data, _ = limpiar_y_preparar_tabla(df_reales)
-        return data
-@app.callback(Output('notificacion-seguimiento', 'children'), Input('btn-guardar-reales', 'n_clicks'), State('tabla-aplicaciones-reales', 'data'), prevent_initial_call=True)
-def guardar_datos_reales(n_clicks, data):
-    if not data: return html.P("No hay datos para guardar.", style={'color': 'orange'})
-    df = pd.DataFrame(data).copy(); df['Fecha Estimada'] = pd.to_datetime(df['Fecha Estimada'])
-    df_modificado = df.copy()
-    for index, row in df.iterrows():
-        try:
-            litros_reales = pd.to_numeric(row['Litros Reales Aplicados'], errors='coerce')
-            if pd.notna(litros_reales):
-                litros_planeados = pd.to_numeric(row['Litros Planeados'], errors='coerce')
-                if pd.isna(litros_planeados): litros_planeados = 0
-                diferencia = litros_reales - litros_planeados
-                if diferencia != 0:
-                    df_futuro = df_modificado[(df_modificado['Fecha Estimada'] > row['Fecha Estimada']) & (df_modificado['Válvula'] == row['Válvula']) & (df_modificado['Sector'] == row['Sector'])].sort_values(by='Fecha Estimada')
-                    if not df_futuro.empty:
-                        idx_siguiente_riego = df_futuro.index[0]
-                        valor_actual_planeado = df_modificado.loc[idx_siguiente_riego, 'Litros Planeados']
-                        valor_base_numerico = pd.to_numeric(valor_actual_planeado, errors='coerce')
-                        if pd.isna(valor_base_numerico): valor_base_numerico = 0
-                        df_modificado.loc[idx_siguiente_riego, 'Litros Planeados'] = valor_base_numerico + diferencia
-        except (ValueError, TypeError): continue
-    df_modificado['Fecha Estimada'] = df_modificado['Fecha Estimada'].dt.strftime('%Y-%m-%d')
-    df_modificado.to_csv(APLIC_REALES_FILE, index=False)
-    return html.P("¡Datos guardados y plan auto-ajustado con éxito!", style={'color': '#1E8E3E', 'fontWeight': 'bold'})
-@app.callback(Output("download-orden-pdf", "data"), Input("btn-generar-orden-pdf", "n_clicks"), [State('tabla-aplicaciones-reales', 'data'), State('filtro-fecha-orden', 'date'), State('filtro-sector-orden', 'value'), State('filtro-anio-orden', 'value')], prevent_initial_call=True)
-def generar_orden_trabajo_pdf(n_clicks, data, fecha, sector, anio):
-    if not n_clicks or not data: raise dash.exceptions.PreventUpdate
-    df = pd.DataFrame(data).copy(); df['Fecha Estimada'] = pd.to_datetime(df['Fecha Estimada']); df['Año Plantación'] = df['Año Plantación'].astype(int); df.sort_values(by=['Fecha Estimada', 'Válvula'], inplace=True)
-    if fecha: df = df[df['Fecha Estimada'].dt.date == pd.to_datetime(fecha).date()]
-    if sector and sector != 'todos': df = df[df['Sector'] == sector]
-    if anio and anio != 'todos': df = df[df['Año Plantación'] == int(anio)]
+        df_reales = cargar_o_crear(APLIC_REALES_FILE, lambda: pd.DataFrame())
+        if not df_reales.empty and 'id' not in df_reales.columns:
+            df_reales.insert(0, 'id', np.arange(len(df_reales))); guardar_tabla(APLIC_REALES_FILE, df_reales)
+        if not df_reales.empty and COLUMNA_PLAN_ORIGINAL not in df_reales.columns: guardar_tabla(APLIC_REALES_FILE, con_plan_original(df_reales))
+    return datetime.datetime.now().timestamp()
+@app.callback([Output('tabla-aplicaciones-reales', 'data'), Output('tabla-aplicaciones-reales', 'page_count')], [Input('store-seguimiento-version', 'data'), Input('tabla-aplicaciones-reales', 'page_current'), Input('tabla-aplicaciones-reales', 'page_size'), Input('tabla-aplicaciones-reales', 'sort_by'), Input('tabla-aplicaciones-reales', 'filter_query')], State('store-ediciones-pendientes', 'data'))
+@medir_callback
+def paginar_seguimiento(version, page_current, page_size, sort_by, filter_query, pendientes):
+    if version is None: return [], 1
+    data, cols, page_count = pagina_de_tabla(APLIC_REALES_FILE, None, page_current, page_size, sort_by, filter_query, orden_defecto=[('Fecha Estimada', True), ('Válvula', True)])
+    if [c['id'] for c in cols] == ['Error']: return [], 1  # filtro no soportado: la tabla de columnas fijas queda vacía en lugar de mostrarse sin filtrar
+    # Las ediciones aún no guardadas se vuelven a aplicar al cambiar de página
+    for fila in data: fila.update((pendientes or {}).get(str(fila.get('id')), {}))
+    return data, page_count
+def _celda_vacia(valor): return valor is None or valor == '' or (isinstance(valor, float) and np.isnan(valor))
+@app.callback(Output('store-ediciones-pendientes', 'data'), Input('tabla-aplicaciones-reales', 'data_timestamp'), [State('tabla-aplicaciones-reales', 'data'), State('tabla-aplicaciones-reales', 'data_previous'), State('store-ediciones-pendientes', 'data')], prevent_initial_call=True)
+@medir_callback
+def registrar_ediciones(data_timestamp, data, data_previous, pendientes):
+    pendientes = dict(pendientes or {})
+    previas = {fila.get('id'): fila for fila in data_previous or []}
+    for fila in data or []:
+        previa = previas.get(fila.get('id'))
+        if previa is None: continue
+        cambios = {col: fila.get(col) for col in COLUMNAS_EDITABLES_SEGUIMIENTO if fila.get(col) != previa.get(col) and not (_celda_vacia(fila.get(col)) and _celda_vacia(previa.get(col)))}
+        if cambios: pendientes.setdefault(str(fila['id']), {}).update(cambios)
+    return pendientes
+def aplicar_ediciones(df, pendientes):
+    # Devuelve la tabla con las ediciones {id: {columna: valor}} aplicadas y la máscara de filas cuyos litros reales cambiaron
+    df = df.copy(); editadas = np.zeros(len(df), dtype=bool)
+    if not pendientes or 'id' not in df.columns: return df, editadas
+    pos = pd.Index(df['id'].astype(str)).get_indexer(list(pendientes.keys()))
+    for col in COLUMNAS_EDITABLES_SEGUIMIENTO:
+        if col not in df.columns: df[col] = np.nan
+        df[col] = df[col].astype(object)
+    for p, cambios in zip(pos, pendientes.values()):
+        if p < 0: continue
+        for col, valor in cambios.items():
+            if col not in COLUMNAS_EDITABLES_SEGUIMIENTO: continue
+            df.iat[p, df.columns.get_loc(col)] = valor
+            if col == 'Litros Reales Aplicados': editadas[p] = True
+    return df, editadas
+COLUMNAS_DIARIO_SEGUIMIENTO = COLUMNAS_EDITABLES_SEGUIMIENTO + ['Litros Planeados', COLUMNA_PLAN_ORIGINAL]  # las ediciones y los ajustes automáticos
+def _valores_celda(serie, numerico):
+    # Vacíos como None, cantidades como float y el resto como texto: lo mismo que se obtiene al releer la tabla
+    if numerico:
+        v = pd.to_numeric(serie, errors='coerce').to_numpy(dtype=float); return np.where(np.isnan(v), None, v.astype(object))
+    vacia = (serie.isna() | (serie.astype(str) == '')).to_numpy()
+    return np.where(vacia, None, serie.astype(str).to_numpy(dtype=object))
+def cambios_por_celda(df_antes, df_despues, columnas):
+    # [(id, columna, valor)] de las celdas que difieren entre dos versiones alineadas de la tabla
+    cambios = []
+    for col in columnas:
+        if col not in df_despues.columns or 'id' not in df_despues.columns: continue
+        antes = _valores_celda(df_antes[col] if col in df_antes.columns else pd.Series(np.nan, index=df_antes.index), col in COLUMNAS_CANTIDAD)
+        despues = _valores_celda(df_despues[col], col in COLUMNAS_CANTIDAD)
+        distintas = np.flatnonzero(antes != despues)
+        cambios += [(int(i), col, v) for i, v in zip(df_despues['id'].to_numpy()[distintas], despues[distintas])]
+    return cambios
+def _bloques_riego(df, filas=None):
+    # Filas con fecha ordenadas por (Sector, Válvula, Fecha Estimada), la máscara de primera fila de cada fecha (el "siguiente riego", que recibe el arrastre)
+    # y la de primera fila de cada grupo. 'filas' limita a los grupos de esas filas
+    grupo = df.groupby(['Sector', 'Válvula'], sort=False).ngroup().to_numpy()
+    fechas = dias_desde_fechas(df['Fecha Estimada'])
+    con_fecha = (fechas != DIA_NULO) & (grupo >= 0)
+    sel = np.flatnonzero(con_fecha if filas is None else np.isin(grupo, np.unique(grupo[con_fecha & filas])) & con_fecha)
+    orden = sel[np.lexsort((fechas[sel], grupo[sel]))]
+    g, f = grupo[orden], fechas[orden]
+    nuevo_grupo = np.r_[True, g[1:] != g[:-1]][:len(orden)]
+    return orden, nuevo_grupo | np.r_[True, f[1:] != f[:-1]][:len(orden)], nuevo_grupo
+def _arrastres(primera, nuevo_grupo, diferencias, encadenar):
+    # Arrastre de cada fila (ordenadas como en _bloques_riego): la primera fila de cada fecha recibe la suma de las diferencias de la fecha anterior del grupo.
+    # Con 'encadenar' (filas con real) la diferencia de una primera fila descuenta además el arrastre que recibió: c_b = d_b - c_(b-1)
+    bloque = np.cumsum(primera) - 1
+    d = np.bincount(bloque, weights=diferencias, minlength=len(primera) and bloque[-1] + 1)
+    encadenada = np.zeros(len(d), dtype=bool); encadenada[bloque[primera & encadenar]] = True
+    # Una fecha sin encadenar o la primera del grupo abre una racha; dentro de ella c_b = d_b - c_(b-1) se resuelve con signos alternados
+    abre = nuevo_grupo[primera] | ~encadenada
+    inicio = np.flatnonzero(abre)[np.cumsum(abre) - 1]
+    signo = np.where((np.arange(len(d)) - inicio) % 2, -1.0, 1.0)
+    acumulado = np.cumsum(signo * d)
+    c = signo * (acumulado - np.r_[0, acumulado][inicio])
+    recibido = np.where(nuevo_grupo[primera], 0, np.r_[0, c[:-1]])
+    return np.where(primera, recibido[bloque], 0)
+def con_plan_original(df):
+    # Seguimientos guardados antes de la columna de originales: se deshace el ajuste ya aplicado (plan vigente - arrastre del riego anterior)
+    df = df.copy()
+    planeados = pd.to_numeric(df['Litros Planeados'], errors='coerce').to_numpy(dtype=float)
+    originales = pd.to_numeric(df[COLUMNA_PLAN_ORIGINAL], errors='coerce').to_numpy(dtype=float, copy=True) if COLUMNA_PLAN_ORIGINAL in df.columns else np.full(len(df), np.nan)
+    faltan = np.isnan(originales)
+    if faltan.any():
+        orden, primera, nuevo_grupo = _bloques_riego(df, faltan)
+        reales = pd.to_numeric(df['Litros Reales Aplicados'], errors='coerce').to_numpy(dtype=float)[orden]
+        arrastre = _arrastres(primera, nuevo_grupo, np.where(np.isnan(reales), 0, reales - np.nan_to_num(planeados[orden])), np.zeros(len(orden), dtype=bool))
+        originales[orden] = np.where(faltan[orden], planeados[orden] - arrastre, originales[orden])
+    df[COLUMNA_PLAN_ORIGINAL] = np.where(np.isnan(originales), planeados, originales)
+    return df
+def auto_ajustar_plan(df, editadas=None):
+    # Traslada (real - planeado) al siguiente riego del mismo Sector/Válvula en una sola pasada agrupada ordenada por (Sector, Válvula, Fecha Estimada)
+    # Cada grupo con litros reales editados ('editadas'; None = todos) se rehace entero desde los litros planeados originales y los reales vigentes,
+    # así re-editar, cargar fuera de orden o borrar un real deja la misma cadena que cargarlos de una vez
+    df_modificado = df.copy() if COLUMNA_PLAN_ORIGINAL in df.columns else con_plan_original(df)
+    orden, primera, nuevo_grupo = _bloques_riego(df_modificado, None if editadas is None else np.asarray(editadas, dtype=bool))
+    if not len(orden): return df_modificado
+    originales = np.nan_to_num(pd.to_numeric(df_modificado[COLUMNA_PLAN_ORIGINAL], errors='coerce').to_numpy(dtype=float)[orden])
+    reales = pd.to_numeric(df_modificado['Litros Reales Aplicados'], errors='coerce').to_numpy(dtype=float)[orden]
+    con_real = ~np.isnan(reales)
+    nuevos = originales + _arrastres(primera, nuevo_grupo, np.where(con_real, reales - originales, 0), con_real)
+    col = df_modificado.columns.get_loc('Litros Planeados')
+    df_modificado['Litros Planeados'] = df_modificado['Litros Planeados'].astype(float if pd.api.types.is_numeric_dtype(df_modificado['Litros Planeados']) else object)
+    df_modificado.iloc[orden, col] = nuevos
+    return df_modificado
+@app.callback([Output('notificacion-seguimiento', 'children'), Output('store-ediciones-pendientes', 'data', allow_duplicate=True), Output('store-seguimiento-version', 'data', allow_duplicate=True)], Input('btn-guardar-reales', 'n_clicks'), State('store-ediciones-pendientes', 'data'), prevent_initial_call=True)
+@medir_callback
+def guardar_datos_reales(n_clicks, pendientes):
+    # Solo se escriben las celdas que cambiaron; el bloqueo serializa leer-ajustar-escribir entre workers para que ningún guardado pise a otro
+    with almacenamiento().bloqueo(APLIC_REALES_FILE):
+        df_antes, firma_antes = cargar_o_crear(APLIC_REALES_FILE, lambda: pd.DataFrame()), _firma_cubo()
+        if df_antes.empty: return html.P("No hay datos para guardar.", style={'color': 'orange'}), dash.no_update, dash.no_update
+        df, editadas = aplicar_ediciones(df_antes if COLUMNA_PLAN_ORIGINAL in df_antes.columns else con_plan_original(df_antes), pendientes)
+        df_modificado = auto_ajustar_plan(df, editadas=editadas)
+        guardar_cambios_tabla(APLIC_REALES_FILE, cambios_por_celda(df_antes, df_modificado, COLUMNAS_DIARIO_SEGUIMIENTO))
+        actualizar_cubo(df_antes, df_modificado, firma_antes)
+    return html.P("¡Datos guardados y plan auto-ajustado con éxito!", style={'color': '#1E8E3E', 'fontWeight': 'bold'}), {}, datetime.datetime.now().timestamp()
+def _filtro_valor(valor): return valor if valor and valor != 'todos' else None
+@app.callback(Output("download-orden-pdf", "data"), Input("btn-generar-orden-pdf", "n_clicks"), [State("btn-generar-orden-pdf", "n_clicks_timestamp"), State('filtro-fecha-orden', 'date'), State('filtro-sector-orden', 'value'), State('filtro-anio-orden', 'value')], prevent_initial_call=True, **opciones_trabajo('orden', 'btn-generar-orden-pdf'))
+@medir_callback
+def generar_orden_trabajo_pdf(set_progress, n_clicks, _marca, fecha, sector, anio):
+    if not n_clicks: raise dash.exceptions.PreventUpdate
+    # Misma orden (filtros, datos guardados y día de emisión) -> mismo trabajo
+    clave = huella(fecha, sector, anio, almacenamiento().firma(APLIC_REALES_FILE), datetime.date.today().isoformat())
+    return trabajo_unico(f"orden-{clave}", lambda: _orden_trabajo_pdf(set_progress, fecha, sector, anio), esperando=lambda: set_progress(("Esperando una orden idéntica en curso...", 1, 2)))
+def _orden_trabajo_pdf(set_progress, fecha, sector, anio):
+    set_progress(("Consultando aplicaciones...", 0, 2))
+    # Filtros resueltos como consulta indexada sobre las aplicaciones guardadas
+    df = almacenamiento().consultar(APLIC_REALES_FILE, sector=_filtro_valor(sector), anio=int(anio) if _filtro_valor(anio) else None, fecha=pd.to_datetime(fecha).strftime('%Y-%m-%d') if fecha else None, ordenar=True)
     if df.empty: return None
-    class PDF(FPDF):
-        def header(self): self.image('assets/Logo Fortin Castre.jpg', 10, 8, 33); self.set_font('helvetica', 'B', 15); self.cell(0, 10, 'Orden de Trabajo de Fertilización', 0, 1, 'C'); self.image('assets/Logo Rivera Grande.jpg', 170, 8, 33); self.ln(10)
-        def footer(self): self.set_y(-15); self.set_font('helvetica', 'I', 8); self.cell(0, 10, f'Página {self.page_no()}', 0, 0, 'C')
-    pdf = PDF(); pdf.add_page(); pdf.set_font('helvetica', '', 10); pdf.cell(0, 10, f"Fecha de Emisión: {datetime.date.today().strftime('%d/%m/%Y')}", 0, 1); pdf.set_font('helvetica', 'B', 10)
-    pdf.cell(45, 7, 'Sector', 1, 0, 'C'); pdf.cell(20, 7, 'Válvula', 1, 0, 'C'); pdf.cell(45, 7, 'Producto', 1, 0, 'C'); pdf.cell(30, 7, 'Litros a Aplicar', 1, 0, 'C'); pdf.cell(40, 7, 'Litros Reales', 1, 1, 'C')
-    pdf.set_font('helvetica', '', 10)
-    for _, row in df.iterrows():
-        pdf.cell(45, 10, str(row['Sector']), 1, 0); pdf.cell(20, 10, str(row['Válvula']), 1, 0); pdf.cell(45, 10, str(row['Producto']), 1, 0)
-        pdf.cell(30, 10, f"{pd.to_numeric(row['Litros Planeados'], errors='coerce'):.2f}", 1, 0, 'R'); pdf.cell(40, 10, '', 1, 1)
-    pdf.ln(15); pdf.cell(0, 10, 'Observaciones:', 0, 1); pdf.multi_cell(w=0, h=10, text='', border=1, align='L'); pdf.ln(25)
-    pdf.cell(90, 10, '_________________________', 0, 0, 'C'); pdf.cell(90, 10, '_________________________', 0, 1, 'C')
-    pdf.cell(90, 5, 'Firma Responsable Finca', 0, 0, 'C'); pdf.cell(90, 5, 'Firma Operario', 0, 1, 'C')
+    set_progress(("Generando PDF...", 1, 2))
+    pdf = nuevo_pdf_orden(); escribir_orden(pdf, filas_orden(df))
     return dcc.send_bytes(lambda f: f.write(pdf.output()), f"orden_trabajo_{datetime.date.today()}.pdf")
+@app.callback(Output("download-ordenes-lote", "data"), Input("btn-generar-ordenes-lote", "n_clicks"), [State("btn-generar-ordenes-lote", "n_clicks_timestamp"), State('lote-semanas', 'value'), State('lote-formato', 'value'), State('filtro-sector-orden', 'value'), State('filtro-anio-orden', 'value')], prevent_initial_call=True, **opciones_trabajo('orden', 'btn-generar-ordenes-lote'))
+@medir_callback
+def generar_ordenes_en_lote(set_progress, n_clicks, _marca, semanas, formato, sector, anio):
+    if not n_clicks: raise dash.exceptions.PreventUpdate
+    # Una orden por fecha x sector desde hoy hasta las semanas pedidas, respetando los filtros de sector y año
+    desde = datetime.date.today(); hasta = desde + datetime.timedelta(weeks=int(semanas or 1), days=-1)
+    clave = huella(desde.isoformat(), hasta.isoformat(), formato, sector, anio, almacenamiento().firma(APLIC_REALES_FILE))
+    def generar():
+        set_progress(("Consultando aplicaciones...", 0, 1))
+        df = almacenamiento().consultar(APLIC_REALES_FILE, sector=_filtro_valor(sector), anio=int(anio) if _filtro_valor(anio) else None, fecha_desde=desde.isoformat(), fecha_hasta=hasta.isoformat(), ordenar=True)
+        if df.empty: return None
+        ordenes = ordenes_por_fecha_y_sector(df)
+        contenido = ordenes_en_lote(ordenes, formato, progreso=lambda hechas, total: set_progress((f"Órdenes generadas: {hechas}/{total}", hechas, total)))
+        return dcc.send_bytes(contenido, f"ordenes_trabajo_{desde}_{hasta}.{'pdf' if formato == 'pdf' else 'zip'}")
+    return trabajo_unico(f"lote-{clave}", generar, esperando=lambda: set_progress(("Esperando un lote idéntico en curso...", 0, 1)))
 
 # <<< NUEVO: Callback para el Dashboard >>>
 @app.callback(
@@ -423,53 +1916,39 @@ def generar_orden_trabajo_pdf(n_clicks, data, fecha, sector, anio):
     [Input('dash-filtro-sector', 'value'), Input('dash-filtro-anio', 'value'),
      Input('dash-filtro-mes', 'value'), Input('url', 'pathname')]
 )
+@medir_callback
 def update_dashboard(sector, anio, mes, pathname):
     if pathname != '/dashboard': raise dash.exceptions.PreventUpdate
 
-    df_reales = cargar_o_crear(APLIC_REALES_FILE, lambda: pd.DataFrame())
-    df_plan = cargar_o_crear(PLAN_SEMANAL_FILE, lambda: pd.DataFrame())
-    df_fert = cargar_o_crear(FERT_FILE, definir_fertilizantes)
-    
     empty_fig = {'layout': {'xaxis': {'visible': False}, 'yaxis': {'visible': False}, 'annotations': [{'text': 'No hay datos para mostrar', 'xref': 'paper', 'yref': 'paper', 'showarrow': False, 'font': {'size': 16}}]}}
-    if df_reales.empty:
+    cubo = cubo_dashboard()
+    apps_hechas_total = int(cubo['Aplicaciones'].sum())
+    if apps_hechas_total == 0:
         return "0 L", "0 L", "$ 0.00", "0 %", empty_fig, empty_fig, empty_fig
 
-    df_reales['Fecha Aplicación Real'] = pd.to_datetime(df_reales['Fecha Aplicación Real'], errors='coerce')
-    df_reales['Año Plantación'] = df_reales['Año Plantación'].astype(int)
-    df_aplicado = df_reales.dropna(subset=['Fecha Aplicación Real']).copy()
-
-    if df_aplicado.empty:
-        return "0 L", "0 L", "$ 0.00", "0 %", empty_fig, empty_fig, empty_fig
-        
-    df_filtrado = df_aplicado.copy()
-    if sector and sector != 'todos': df_filtrado = df_filtrado[df_filtrado['Sector'] == sector]
-    if anio and anio != 'todos': df_filtrado = df_filtrado[df_filtrado['Año Plantación'] == int(anio)]
-    if mes: df_filtrado = df_filtrado[df_filtrado['Fecha Aplicación Real'].dt.strftime('%Y-%m') == mes]
+    df_filtrado = cubo.reset_index()
+    if _filtro_valor(sector): df_filtrado = df_filtrado[df_filtrado['Sector'] == sector]
+    if _filtro_valor(anio): df_filtrado = df_filtrado[df_filtrado['Año Plantación'] == int(anio)]
+    if mes: df_filtrado = df_filtrado[df_filtrado['Mes'] == mes]
     
     if df_filtrado.empty:
         return "0 L", "0 L", "$ 0.00", "N/A", empty_fig, empty_fig, empty_fig
         
-    total_reales = pd.to_numeric(df_filtrado['Litros Reales Aplicados'], errors='coerce').sum()
-    total_planeados = pd.to_numeric(df_filtrado['Litros Planeados'], errors='coerce').sum()
+    total_reales = df_filtrado['Litros Reales Aplicados'].sum()
+    total_planeados = df_filtrado['Litros Planeados'].sum()
     dif_litros = total_reales - total_planeados
-
-    df_filtrado = pd.merge(df_filtrado, df_fert[['Producto', 'Precio', 'Densidad']], on='Producto', how='left').fillna(0)
-    costo_real = (pd.to_numeric(df_filtrado['Litros Reales Aplicados'], errors='coerce') * df_filtrado['Densidad']) * df_filtrado['Precio']
-    costo_planeado = (pd.to_numeric(df_filtrado['Litros Planeados'], errors='coerce') * df_filtrado['Densidad']) * df_filtrado['Precio']
-    desvio_costos = costo_real.sum() - costo_planeado.sum()
+    desvio_costos = df_filtrado['Costo Real'].sum() - df_filtrado['Costo Planeado'].sum()
     
-    df_plan['Fecha Estimada'] = pd.to_datetime(df_plan['Fecha Estimada'])
-    apps_plan_total = len(df_plan[df_plan['Fecha Estimada'] <= datetime.datetime.now()])
-    apps_hechas_total = len(df_aplicado)
+    apps_plan_total = almacenamiento().contar(PLAN_SEMANAL_FILE, fecha_hasta=datetime.date.today().isoformat())
     cumplimiento = (apps_hechas_total / apps_plan_total * 100) if apps_plan_total > 0 else 0
     
     df_grafico_prod = df_filtrado.groupby('Producto', as_index=False)[['Litros Planeados', 'Litros Reales Aplicados']].sum()
+    import plotly.express as px  # importación diferida: solo la usa el dashboard
     fig_prod = px.bar(df_grafico_prod, x='Producto', y=['Litros Planeados', 'Litros Reales Aplicados'], barmode='group', title='Aplicación por Producto (Lts)', labels={'value': 'Litros', 'variable': 'Tipo'})
     
     df_grafico_sec = df_filtrado.groupby('Sector', as_index=False)[['Litros Planeados', 'Litros Reales Aplicados']].sum()
     fig_sec = px.bar(df_grafico_sec, x='Sector', y=['Litros Planeados', 'Litros Reales Aplicados'], barmode='group', title='Aplicación por Sector (Lts)', labels={'value': 'Litros', 'variable': 'Tipo'})
 
-    df_filtrado['Costo Real'] = costo_real
     df_costos = df_filtrado.groupby('Producto', as_index=False)['Costo Real'].sum()
     fig_costos = px.pie(df_costos, names='Producto', values='Costo Real', title='Distribución de Costos por Producto', hole=.3)
 
@@ -479,5 +1958,8 @@ def update_dashboard(sector, anio, mes, pathname):
     return f"{total_reales:,.0f} L", f"{dif_litros:,.0f} L", f"U$D {desvio_costos:,.2f}", f"{cumplimiento:.1f}%", fig_prod, fig_sec, fig_costos
 
 
+TIEMPO_IMPORTACION_S = time.perf_counter() - _INICIO_IMPORTACION
+if os.environ.get('PLANIFICADOR_INFORMAR_INICIO', '0') == '1': print(f"app_planificador importado en {TIEMPO_IMPORTACION_S:.3f} s (pid {os.getpid()})", file=sys.stderr, flush=True)
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,158 @@
+# Benchmarks de los caminos críticos (planes, seguimiento, dashboard y órdenes PDF) sobre granjas sintéticas
+# Uso: python benchmarks/ejecutar_benchmarks.py [--escalas chica mediana grande] [--repeticiones 5] [--almacenamiento sqlite] [--guardar-linea-base]
+# Cada escala corre en un proceso nuevo dentro de un directorio temporal; devuelve código 1 si algún caso supera la línea base en más del umbral.
+# Los tiempos se comparan normalizados por un caso de calibración medido en la misma corrida (carga fija de pandas/numpy y Python, sin código de la app),
+# así una línea base grabada en otra máquina sigue sirviendo; contra una línea base sin calibración solo se comparan tiempos en la misma máquina
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import granja_sintetica
+
+RAIZ = granja_sintetica.RAIZ
+LINEA_BASE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lineas_base.json")
+UMBRAL_REGRESION = float(os.environ.get('PLANIFICADOR_BENCH_UMBRAL', '0.25'))  # 25% más lento o más memoria que la línea base
+MIN_DIFERENCIA_S, MIN_DIFERENCIA_MB = 0.005, 1.0  # por debajo de esto la diferencia se considera ruido
+EDICIONES_GUARDADO = 50
+
+def medir(funcion, preparar=None, repeticiones=5):
+    # Una corrida de calentamiento, 'repeticiones' cronometradas y una última bajo tracemalloc solo para el pico de memoria
+    if preparar: preparar()
+    funcion()
+    tiempos = []
+    for _ in range(repeticiones):
+        if preparar: preparar()
+        gc.collect(); inicio = time.perf_counter(); funcion(); tiempos.append(time.perf_counter() - inicio)
+    if preparar: preparar()
+    gc.collect(); tracemalloc.start()
+    try: funcion(); pico = tracemalloc.get_traced_memory()[1]
+    finally: tracemalloc.stop()
+    return {'tiempo_s': round(min(tiempos), 6), 'mediana_s': round(statistics.median(tiempos), 6), 'memoria_pico_mb': round(pico / 2**20, 3)}
+
+def carga_calibracion(filas=200_000):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'grupo': rng.integers(0, 1000, filas), 'valor': rng.random(filas), 'texto': rng.integers(0, 50, filas).astype(str)})
+    def calibrar():
+        df.groupby(['grupo', 'texto'])['valor'].sum(); df.sort_values('valor', kind='stable'); df['texto'].str.contains('4', regex=False).sum()
+        sum(i * i for i in range(filas))
+    return calibrar
+
+def medir_escala(escala, backend, repeticiones, semilla=0):
+    # La app resuelve data/ y su caché de trabajos contra el directorio actual: se importa dentro del directorio temporal
+    os.environ['PLANIFICADOR_STORAGE'] = backend
+    with tempfile.TemporaryDirectory(prefix='bench-planificador-') as tmp:
+        shutil.copytree(os.path.join(RAIZ, 'assets'), os.path.join(tmp, 'assets'))  # logos de las órdenes PDF
+        os.chdir(tmp); sys.path.insert(0, RAIZ)
+        import app_planificador as app
+        calibrar = carga_calibracion(); calibracion = [medir(calibrar, repeticiones=repeticiones)['tiempo_s']]
+        tamanios = granja_sintetica.escribir_granja(app, app.DATA_PATH, escala, semilla)
+        tablas = app.tablas_plan_mensual()
+        df_fert, df_valv, df_limites = tablas[1], app.cargar_o_crear(app.VALV_FILE, app.definir_valvulas), app.cargar_o_crear(app.LIMITES_FILE, app.definir_limites)
+        fecha_inicio = app.leer_fecha_inicio()
+        plan_mensual = app.generar_plan_mensual_economico(tablas=tablas)
+        plan_semanal = app.generar_plan_semanal(plan_mensual, df_valv, df_limites, fecha_inicio, df_fert=df_fert)
+        # Capacidad con 1.5x de holgura sobre la semana más cargada (6 días habilitados): factible en todas las escalas
+        semana_pico = pd.to_numeric(plan_semanal['Litros Planeados']).groupby(plan_semanal['Fecha Estimada']).sum().max()
+        programacion = dict(app.PROGRAMACION_DEFECTO, modo='capacidad', capacidad_l_dia=float(semana_pico) / 4)
+        aplicaciones = app.cargar_o_crear(app.APLIC_REALES_FILE, lambda: None)
+        # Ediciones de litros reales sobre aplicaciones pendientes de la temporada en curso, como las que deja la tabla de seguimiento
+        pendientes_df = aplicaciones[aplicaciones['Litros Reales Aplicados'].isna()].head(EDICIONES_GUARDADO)
+        pendientes = {str(i): {'Litros Reales Aplicados': round(litros * 1.1, 2), 'Fecha Aplicación Real': fecha} for i, litros, fecha in zip(pendientes_df['id'], pendientes_df['Litros Planeados'], pendientes_df['Fecha Estimada'])}
+        def restaurar_aplicaciones(): app.guardar_tabla(app.APLIC_REALES_FILE, aplicaciones); app.cubo_dashboard()
+        por_fecha = aplicaciones.groupby('Fecha Estimada').size()
+        fecha_orden = por_fecha.idxmax()
+        sector = aplicaciones['Sector'].iloc[0]
+        casos = {
+            'plan_mensual_frio': (lambda: app.generar_plan_mensual_economico(tablas=tablas), app._memo_mensual.limpiar),
+            'plan_mensual_memo': (lambda: app.generar_plan_mensual_economico(tablas=tablas), None),
+            'plan_semanal_frio': (lambda: app.generar_plan_semanal(plan_mensual, df_valv, df_limites, fecha_inicio, df_fert=df_fert), app._memo_semanal.limpiar),
+            'plan_semanal_memo': (lambda: app.generar_plan_semanal(plan_mensual, df_valv, df_limites, fecha_inicio, df_fert=df_fert), None),
+            'programacion_capacidad': (lambda: app.programar_aplicaciones(plan_semanal, df_valv, programacion), None),
+            'guardar_datos_reales': (lambda: app.guardar_datos_reales(1, pendientes), restaurar_aplicaciones),
+            'dashboard_frio': (lambda: app.update_dashboard(None, None, None, '/dashboard'), app.descartar_cubo),
+            'dashboard_filtrado': (lambda: app.update_dashboard(sector, None, None, '/dashboard'), None),
+            'orden_trabajo_pdf': (lambda: app._orden_trabajo_pdf(lambda progreso: None, fecha_orden, None, None), None),
+        }
+        resultados = {caso: medir(funcion, preparar, repeticiones) for caso, (funcion, preparar) in casos.items()}
+        tamanios.update(plan_mensual=len(plan_mensual), filas_orden_pdf=int(por_fecha.max()))
+        os.chdir(RAIZ)
+    # Calibración antes y después de los casos: el mínimo descarta las ráfagas de carga ajena de la máquina
+    calibracion.append(medir(calibrar, repeticiones=repeticiones)['tiempo_s'])
+    return {'tamanios': tamanios, 'calibracion_s': min(calibracion), 'casos': resultados}
+
+def info_maquina(): return {'python': platform.python_version(), 'plataforma': platform.platform(), 'cpus': os.cpu_count()}
+def cargar_linea_base(ruta):
+    if not os.path.exists(ruta): return {'maquina': None, 'resultados': {}}
+    with open(ruta) as f: return json.load(f)
+
+def factor_maquina(medicion, base, misma_maquina):
+    # Cuánto más lenta es esta corrida que la de la línea base; None si los tiempos no son comparables
+    if medicion.get('calibracion_s') and base.get('calibracion_s'): return medicion['calibracion_s'] / base['calibracion_s']
+    return 1.0 if misma_maquina else None
+
+def comparar(clave, medicion, base, umbral, misma_maquina=True):
+    # Regresión: más lento (normalizado por la calibración) o más memoria que la línea base por encima del umbral relativo y de la diferencia mínima absoluta
+    regresiones, factor = [], factor_maquina(medicion, base, misma_maquina)
+    for caso, actual in medicion['casos'].items():
+        previo = base.get('casos', {}).get(caso)
+        if previo is None: continue
+        for campo, minimo, escala in (('tiempo_s', MIN_DIFERENCIA_S, factor), ('memoria_pico_mb', MIN_DIFERENCIA_MB, 1.0)):
+            if escala is None: continue
+            esperado = previo[campo] * escala
+            if actual[campo] > esperado * (1 + umbral) and actual[campo] - esperado > minimo:
+                regresiones.append(f"{clave}/{caso}: {campo} {esperado:.4g} -> {actual[campo]:.4g} (+{(actual[campo] / esperado - 1) * 100:.0f}%)")
+    return regresiones
+
+def imprimir(clave, medicion, base, misma_maquina=True):
+    factor = factor_maquina(medicion, base, misma_maquina)
+    print(f"\n== {clave}  " + ", ".join(f"{k}={v}" for k, v in medicion['tamanios'].items()))
+    print(f"calibración {medicion['calibracion_s']:.4f} s" + (f", línea base x{factor:.2f}" if factor is not None else ", línea base de otra máquina sin calibración: tiempos sin comparar"))
+    print(f"{'caso':<22}{'mejor (s)':>11}{'mediana (s)':>13}{'pico (MB)':>11}{'base (s)':>11}")
+    for caso, r in medicion['casos'].items():
+        previo = base.get('casos', {}).get(caso, {}).get('tiempo_s')
+        previo = previo * factor if previo is not None and factor is not None else None
+        print(f"{caso:<22}{r['tiempo_s']:>11.4f}{r['mediana_s']:>13.4f}{r['memoria_pico_mb']:>11.1f}{'-' if previo is None else f'{previo:.4f}':>11}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks del planificador sobre granjas sintéticas")
+    parser.add_argument('--escalas', nargs='+', choices=list(granja_sintetica.ESCALAS), default=['chica', 'mediana'])
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--almacenamiento', choices=['sqlite', 'csv'], default='sqlite')
+    parser.add_argument('--umbral', type=float, default=UMBRAL_REGRESION)
+    parser.add_argument('--linea-base', default=LINEA_BASE_FILE)
+    parser.add_argument('--guardar-linea-base', action='store_true', help="Reemplaza en la línea base las escalas medidas")
+    parser.add_argument('--salida', help="Guarda las mediciones en este JSON")
+    args = parser.parse_args()
+    linea_base = cargar_linea_base(args.linea_base)
+    misma_maquina = not linea_base.get('maquina') or linea_base['maquina'] == info_maquina()
+    if not misma_maquina: print(f"Aviso: la línea base se midió en otra máquina ({linea_base['maquina']}): los tiempos se comparan normalizados por la calibración", file=sys.stderr)
+    mediciones, regresiones = {}, []
+    for escala in args.escalas:
+        clave = f"{args.almacenamiento}/{escala}"
+        # Proceso nuevo por escala: cachés, memoria y singletons de la app no se arrastran entre escalas
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as ex: mediciones[clave] = ex.submit(medir_escala, escala, args.almacenamiento, args.repeticiones).result()
+        base = linea_base['resultados'].get(clave, {})
+        imprimir(clave, mediciones[clave], base, misma_maquina)
+        regresiones += comparar(clave, mediciones[clave], base, args.umbral, misma_maquina)
+    if args.salida:
+        with open(args.salida, 'w') as f: json.dump({'maquina': info_maquina(), 'resultados': mediciones}, f, indent=2)
+    if args.guardar_linea_base:
+        linea_base['maquina'] = info_maquina(); linea_base['resultados'].update(mediciones)
+        with open(args.linea_base, 'w') as f: json.dump(linea_base, f, indent=2, sort_keys=True); f.write('\n')
+        print(f"\nLínea base actualizada: {args.linea_base}")
+    elif regresiones:
+        print(f"\nRegresiones (umbral {args.umbral:.0%}):\n  " + "\n  ".join(regresiones), file=sys.stderr); sys.exit(1)
+    else: print("\nSin regresiones respecto de la línea base.")
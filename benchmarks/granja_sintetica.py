@@ -0,0 +1,83 @@
+# Granja sintética para benchmarks: mismas tablas y columnas que data/*.csv, generadas con semilla fija a distintas escalas
+# Uso independiente: python benchmarks/granja_sintetica.py DESTINO [--escala mediana] [--semilla 0]  (escribe DESTINO/data/*.csv)
+import os
+import sys
+import argparse
+import datetime
+import numpy as np
+import pandas as pd
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# sectores x variedades (años de plantación por sector) = filas de requerimientos; válvulas = máximo de válvulas activas por año de plantación
+ESCALAS = {
+    'chica': dict(sectores=8, variedades=3, valvulas=4, productos=8, temporadas=1),
+    'mediana': dict(sectores=40, variedades=4, valvulas=6, productos=16, temporadas=2),
+    'grande': dict(sectores=150, variedades=5, valvulas=8, productos=32, temporadas=3),
+}
+MESES = ["Octubre", "Noviembre", "Diciembre", "Enero", "Febrero/Marzo"]
+ANIOS_PLANTACION = np.arange(1990, 2025)
+FECHA_INICIO_TEMPORADA = datetime.date(2025, 8, 25)  # fija para que los datos no dependan del día en que se corre
+FRACCION_TEMPORADA_APLICADA = 0.5  # la temporada en curso queda aplicada hasta la mitad de sus fechas
+
+def tablas_base(sectores, variedades, valvulas, productos, semilla=0, **_):
+    rng = np.random.default_rng(semilla)
+    # Cada sector tiene 'variedades' años distintos; las válvulas van por año de plantación como en data/valvulas.csv
+    anios = np.concatenate([np.sort(rng.choice(ANIOS_PLANTACION, variedades, replace=False)) for _ in range(sectores)])
+    n = len(anios)
+    df_req = pd.DataFrame({'Sector': np.repeat([f"Sector {i + 1:03d}" for i in range(sectores)], variedades), 'Anio': anios, 'Sup_ha': rng.integers(5, 60, n),
+                           'N': rng.integers(120, 221, n), 'P': rng.integers(20, 81, n), 'K': rng.integers(100, 261, n), 'Mg': rng.integers(10, 36, n)})
+    # Los cuatro primeros productos cubren un nutriente cada uno; el resto combina uno o dos nutrientes al azar
+    conc = np.zeros((productos, 4))
+    conc[np.arange(min(productos, 4)), np.arange(min(productos, 4))] = rng.uniform(0.05, 0.3, min(productos, 4))
+    for i in range(4, productos): conc[i, rng.choice(4, rng.integers(1, 3), replace=False)] = rng.uniform(0.03, 0.3)
+    df_fert = pd.DataFrame({'Producto': [f"PRODUCTO_{i + 1:03d}" for i in range(productos)], 'N': conc[:, 0].round(2), 'P2O5': conc[:, 1].round(2), 'K2O': conc[:, 2].round(2),
+                            'S': rng.uniform(0, 0.08, productos).round(2), 'MgO': conc[:, 3].round(2), 'Densidad': rng.uniform(1.1, 1.4, productos).round(3), 'Precio': rng.uniform(1.5, 3.5, productos).round(2)})
+    distribuciones = [pd.DataFrame({'Mes': MESES, **{nut: rng.dirichlet(np.ones(len(MESES))).round(2) for nut in ['N', 'P', 'K', 'Mg']}}) for _ in range(2)]
+    anios_valv = np.unique(anios)
+    activas = rng.integers(1, valvulas + 1, len(anios_valv))
+    sup = rng.uniform(3, 15, (len(anios_valv), valvulas)).round(1)
+    sup[np.arange(valvulas) >= activas[:, None]] = np.nan
+    df_valv = pd.DataFrame({'Año': anios_valv.astype(float), **{f"Valvula_{j + 1}": sup[:, j] for j in range(valvulas)}})
+    df_limites = pd.DataFrame({'Nutriente': ['N', 'P', 'K', 'Mg'], 'Limite_kg_ha_app': [40, 20, 35, 5]})
+    return {'requerimientos': df_req, 'fertilizantes': df_fert, 'distribucion_1': distribuciones[0], 'distribucion_2': distribuciones[1], 'valvulas': df_valv, 'limites_nutrientes': df_limites}
+
+def aplicaciones_de_temporadas(app, tablas, temporadas, semilla=0):
+    # Plan semanal de cada temporada calculado con el propio planificador; las pasadas quedan aplicadas completas y la actual hasta la mitad
+    rng = np.random.default_rng(semilla + 1)
+    plan_mensual = app.calcular_plan_mensual(tablas['requerimientos'], tablas['fertilizantes'], tablas['distribucion_1'], tablas['distribucion_2'], modo='vectorizado')
+    planes = []
+    for k in range(temporadas):
+        inicio = FECHA_INICIO_TEMPORADA.replace(year=FECHA_INICIO_TEMPORADA.year - k)
+        planes.append(app.generar_plan_semanal(plan_mensual, tablas['valvulas'], tablas['limites_nutrientes'], inicio.isoformat(), modo='vectorizado', df_fert=tablas['fertilizantes']))
+    plan_actual = planes[0]
+    df = pd.concat(planes[::-1], ignore_index=True)
+    fechas = pd.to_datetime(df['Fecha Estimada'])
+    corte = pd.Timestamp(plan_actual['Fecha Estimada'].min()) + (pd.Timestamp(plan_actual['Fecha Estimada'].max()) - pd.Timestamp(plan_actual['Fecha Estimada'].min())) * FRACCION_TEMPORADA_APLICADA
+    aplicada = (fechas < corte).to_numpy()
+    df.insert(0, 'id', np.arange(len(df)))
+    df['Fecha Estimada'] = fechas.dt.strftime('%Y-%m-%d')
+    df[app.COLUMNA_PLAN_ORIGINAL] = df['Litros Planeados']  # como cargar_seguimiento
+    df['Litros Reales Aplicados'] = np.where(aplicada, (df['Litros Planeados'] * rng.uniform(0.8, 1.2, len(df))).round(2), np.nan)
+    df['Fecha Aplicación Real'] = np.where(aplicada, (fechas + pd.to_timedelta(rng.integers(0, 3, len(df)), unit='D')).dt.strftime('%Y-%m-%d'), None)
+    df['Observaciones'] = None
+    plan_actual = plan_actual.assign(**{'Fecha Estimada': pd.to_datetime(plan_actual['Fecha Estimada']).dt.strftime('%Y-%m-%d')})
+    return plan_actual, df
+
+def escribir_granja(app, destino, escala='mediana', semilla=0):
+    # Escribe las tablas en destino con los nombres de data/; devuelve la cantidad de filas de cada una
+    parametros = ESCALAS[escala]
+    tablas = tablas_base(semilla=semilla, **parametros)
+    plan_semanal, aplicaciones = aplicaciones_de_temporadas(app, tablas, parametros['temporadas'], semilla)
+    os.makedirs(destino, exist_ok=True)
+    for nombre, df in {**tablas, 'plan_semanal_guardado': plan_semanal, 'aplicaciones_reales': aplicaciones}.items(): df.to_csv(os.path.join(destino, f"{nombre}.csv"), index=False)
+    with open(os.path.join(destino, 'fecha_inicio_riego.txt'), 'w') as f: f.write(FECHA_INICIO_TEMPORADA.isoformat())
+    return {'requerimientos': len(tablas['requerimientos']), 'fertilizantes': len(tablas['fertilizantes']), 'valvulas': len(tablas['valvulas']), 'plan_semanal': len(plan_semanal), 'aplicaciones': len(aplicaciones)}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Genera una granja sintética con las tablas de data/")
+    parser.add_argument('destino'); parser.add_argument('--escala', choices=list(ESCALAS), default='mediana'); parser.add_argument('--semilla', type=int, default=0)
+    args = parser.parse_args()
+    # La app crea data/ y la caché de trabajos relativas al directorio actual: se importa ya dentro del destino
+    os.makedirs(args.destino, exist_ok=True); os.chdir(args.destino); sys.path.insert(0, RAIZ)
+    import app_planificador
+    print(escribir_granja(app_planificador, 'data', args.escala, args.semilla))
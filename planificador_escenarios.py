@@ -0,0 +1,143 @@
+# planificador_escenarios.py
+# Planificación por lotes de escenarios "qué pasa si" (precios, fecha de inicio de riego, tablas de distribución) sin pasar por la UI
+# Uso: python planificador_escenarios.py escenarios.json [--salida resultados_escenarios.parquet] [--procesos N] [--directorio DIR]
+# escenarios.json (cada dimensión es opcional y se corre el producto cartesiano de todas):
+#   {"precios": [{}, {"*": 1.1}, {"NITRON": 1.25}],            factores sobre 'Precio'; "*" aplica a todos los productos
+#    "fechas_inicio_riego": ["2025-08-25", "2025-09-15"],
+#    "distribuciones": {"actual": null, "tardia": {"distribucion_1": "d1_tardia.csv", "distribucion_2": "d2_tardia.csv"}}}
+# Las rutas de distribuciones son relativas al JSON y --salida al directorio actual. Las tablas base se leen, sin escribir nada, del almacenamiento
+# de la app (PLANIFICADOR_STORAGE) en DIR/data, por defecto junto a este script; si ahí no hay datos el comando termina con error en lugar de crear una base.
+# Los planes se calculan en modo 'vectorizado': la corrida no escribe fragmentos en la memo compartida de la app (data/trabajos) ni compite por ella
+# Un escenario que falla no corta la corrida: queda en los resultados con una sola fila y el motivo en la columna 'Error'
+
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+import app_planificador as app
+
+COLUMNAS_ESCENARIO = ['Escenario', 'Precios', 'Fecha Inicio Riego', 'Distribución']
+COLUMNAS_RESULTADO = COLUMNAS_ESCENARIO + ['Producto', 'Mes', 'Aplicaciones', 'Litros Planeados', 'Kg Planeados', 'Costo_usd', 'Error']  # un escenario que falla deja una sola fila con el motivo en 'Error'
+TABLAS_DISTRIBUCION = ('distribucion_1', 'distribucion_2')
+_tablas = None  # tablas base de solo lectura del worker: heredadas por fork o recibidas una sola vez en el initializer
+_plan_mensual_previo = (None, None)  # (precios y distribución, plan mensual) del último escenario del worker
+
+def hay_datos():
+    # Con SQLite la base se crea (importando los CSV) al abrir el almacenamiento: sin base ni CSV no hay nada que leer
+    return any(os.path.exists(f) for f in app.TABLAS_CSV + ([app.DB_FILE] if app.STORAGE_BACKEND == 'sqlite' else []))
+def _leer_tabla(filepath, default_function):
+    # Como cargar_o_crear pero de solo lectura: una tabla que falta toma los valores por defecto sin guardarlos en el almacenamiento de la app
+    return app.almacenamiento().leer(filepath) if app.almacenamiento().existe(filepath) else default_function()
+def cargar_tablas_base():
+    return {'requerimientos': _leer_tabla(app.REQ_FILE, app.definir_requerimientos), 'fertilizantes': _leer_tabla(app.FERT_FILE, app.definir_fertilizantes),
+            'distribucion_1': _leer_tabla(app.DIST1_FILE, app.definir_distribucion1), 'distribucion_2': _leer_tabla(app.DIST2_FILE, app.definir_distribucion2),
+            'valvulas': _leer_tabla(app.VALV_FILE, app.definir_valvulas), 'limites_nutrientes': _leer_tabla(app.LIMITES_FILE, app.definir_limites),
+            'fecha_inicio_riego': app.leer_fecha_inicio() or datetime.date.today().isoformat(), 'distribuciones': {}}
+
+def expandir_grilla(grilla, tablas, directorio='.'):
+    # Valida la grilla y devuelve la lista de escenarios; las distribuciones alternativas se cargan una vez y viajan con las tablas base
+    precios = grilla.get('precios') or [{}]
+    productos = set(tablas['fertilizantes']['Producto'])
+    for factores in precios:
+        desconocidos = set(factores) - productos - {'*'}
+        if desconocidos: raise ValueError(f"Productos desconocidos en 'precios': {sorted(desconocidos)}")
+    fechas = grilla.get('fechas_inicio_riego') or [tablas['fecha_inicio_riego']]
+    for fecha in fechas: datetime.datetime.strptime(fecha, '%Y-%m-%d')
+    distribuciones = grilla.get('distribuciones') or {'actual': None}
+    for nombre, rutas in distribuciones.items():
+        if rutas is None: tablas['distribuciones'][nombre] = {}; continue
+        if set(rutas) - set(TABLAS_DISTRIBUCION): raise ValueError(f"Distribución '{nombre}': solo se admiten {TABLAS_DISTRIBUCION}")
+        tablas['distribuciones'][nombre] = {clave: pd.read_csv(os.path.join(directorio, ruta)) for clave, ruta in rutas.items()}
+    # La fecha varía más rápido: escenarios consecutivos comparten el plan mensual y el worker lo reutiliza
+    return [{'id': f"e{i + 1:04d}", 'precios': factores, 'fecha': fecha, 'distribucion': nombre} for i, (factores, nombre, fecha) in enumerate(itertools.product(precios, distribuciones, fechas))]
+
+def _iniciar_worker(tablas):
+    global _tablas, _plan_mensual_previo
+    _tablas, _plan_mensual_previo = tablas, (None, None)
+def correr_escenario(escenario):
+    # Un escenario que falla (p. ej. la capacidad de riego no alcanza con su fecha de inicio) no corta la corrida: queda registrado con su error
+    try: return _correr_escenario(escenario)
+    except Exception as e: return escenario_fallido(escenario, f"{type(e).__name__}: {e}")
+def _correr_escenario(escenario):
+    global _plan_mensual_previo
+    t = _tablas
+    df_fert = t['fertilizantes'].copy()
+    precio = pd.to_numeric(df_fert['Precio'], errors='coerce') * escenario['precios'].get('*', 1.0)
+    for producto, factor in escenario['precios'].items():
+        if producto != '*': precio[df_fert['Producto'] == producto] *= factor
+    df_fert['Precio'] = precio
+    distribucion = t['distribuciones'].get(escenario['distribucion'], {})
+    clave = (json.dumps(escenario['precios'], sort_keys=True), escenario['distribucion'])
+    if _plan_mensual_previo[0] == clave: plan_mensual = _plan_mensual_previo[1]
+    else:
+        plan_mensual = app.calcular_plan_mensual(t['requerimientos'], df_fert, distribucion.get('distribucion_1', t['distribucion_1']), distribucion.get('distribucion_2', t['distribucion_2']), modo='vectorizado')
+        _plan_mensual_previo = (clave, plan_mensual)
+    if 'Error' in plan_mensual.columns: return escenario_fallido(escenario, plan_mensual['Error'].iloc[0])
+    plan_semanal = app.generar_plan_semanal(plan_mensual, t['valvulas'], t['limites_nutrientes'], escenario['fecha'], modo='vectorizado', df_fert=df_fert)
+    if 'Error' in plan_semanal.columns: return escenario_fallido(escenario, plan_semanal['Error'].iloc[0])
+    return resumir_escenario(plan_semanal, df_fert, escenario)
+def _con_escenario(df, escenario):
+    for i, (columna, valor) in enumerate(zip(COLUMNAS_ESCENARIO, [escenario['id'], json.dumps(escenario['precios'], sort_keys=True), escenario['fecha'], escenario['distribucion']])): df.insert(i, columna, valor)
+    return df[COLUMNAS_RESULTADO]
+def escenario_fallido(escenario, error):
+    return _con_escenario(pd.DataFrame({'Producto': [None], 'Mes': [None], 'Aplicaciones': [0], 'Litros Planeados': [np.nan], 'Kg Planeados': [np.nan], 'Costo_usd': [np.nan], 'Error': [str(error)]}), escenario)
+def resumir_escenario(plan_semanal, df_fert, escenario):
+    # Totales por producto y mes calendario de aplicación; el costo sale de litros x densidad x precio del escenario
+    if plan_semanal.empty: return pd.DataFrame(columns=COLUMNAS_RESULTADO)
+    fert = df_fert.drop_duplicates('Producto').set_index('Producto')
+    litros = pd.to_numeric(plan_semanal['Litros Planeados'], errors='coerce').to_numpy(dtype=float)
+    kg = litros * plan_semanal['Producto'].map(pd.to_numeric(fert['Densidad'], errors='coerce')).to_numpy(dtype=float)
+    df = pd.DataFrame({'Producto': plan_semanal['Producto'].to_numpy(), 'Mes': app.fechas_desde_dias(app.dias_desde_fechas(plan_semanal['Fecha Estimada']), 'M'), 'Aplicaciones': np.ones(len(litros), dtype=np.int64),
+                       'Litros Planeados': litros, 'Kg Planeados': kg, 'Costo_usd': kg * plan_semanal['Producto'].map(fert['Precio']).to_numpy(dtype=float)})
+    resumen = df.groupby(['Producto', 'Mes'], as_index=False, sort=True).sum()
+    resumen['Error'] = None
+    return _con_escenario(resumen, escenario)
+
+def correr_escenarios(escenarios, tablas, procesos=None):
+    procesos = max(1, min(procesos or os.cpu_count() or 1, len(escenarios)))
+    if procesos == 1:
+        _iniciar_worker(tablas); resultados = [correr_escenario(e) for e in escenarios]
+    else:
+        # fork comparte las tablas base con los workers sin copiarlas; con spawn se envían una vez por worker
+        contexto = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto, initializer=_iniciar_worker, initargs=(tablas,)) as ex:
+            resultados = list(ex.map(correr_escenario, escenarios, chunksize=max(1, len(escenarios) // (procesos * 4))))
+    return pd.concat(resultados, ignore_index=True) if resultados else pd.DataFrame(columns=COLUMNAS_RESULTADO)
+
+def escribir_resultados(df, salida):
+    # Parquet si pyarrow está instalado; si no, CSV con el mismo nombre base
+    base, extension = os.path.splitext(salida)
+    if extension == '.parquet' and 'parquet' not in app.formatos_disponibles():
+        salida = base + '.csv'; print(f"pyarrow no está instalado: se escribe {salida}", file=sys.stderr)
+    if salida.endswith('.parquet'): app.escribir_parquet(df, salida)
+    else: app.escribir_csv(df, salida)
+    return salida
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Corre el planificador mensual y semanal para una grilla de escenarios")
+    parser.add_argument('escenarios', help="JSON con la grilla de escenarios")
+    parser.add_argument('--salida', default='resultados_escenarios.parquet')
+    parser.add_argument('--procesos', type=int, default=None, help="Procesos en paralelo (por defecto, uno por núcleo)")
+    parser.add_argument('--directorio', default=os.path.dirname(os.path.abspath(__file__)), help="Directorio de la app cuyo data/ tiene las tablas base (por defecto, el de este script)")
+    args = parser.parse_args()
+    with open(args.escenarios, encoding='utf-8') as f: grilla = json.load(f)
+    escenarios_json, salida = os.path.abspath(args.escenarios), os.path.abspath(args.salida)
+    os.chdir(args.directorio)  # las rutas de la app (data/...) son relativas al directorio actual
+    if not hay_datos(): sys.exit(f"No hay tablas del planificador en {os.path.abspath(app.DATA_PATH)}: indicar el directorio de la app con --directorio")
+    tablas = cargar_tablas_base()
+    escenarios = expandir_grilla(grilla, tablas, os.path.dirname(escenarios_json))
+    inicio = time.perf_counter()
+    resultados = correr_escenarios(escenarios, tablas, args.procesos)
+    salida = escribir_resultados(resultados, salida)
+    fallidos = resultados.loc[resultados['Error'].notna(), ['Escenario', 'Error']]
+    print(f"{len(escenarios)} escenarios en {time.perf_counter() - inicio:.1f} s -> {salida}" + (f" ({len(fallidos)} con error)" if len(fallidos) else ''))
+    print(resultados[resultados['Error'].isna()].groupby(COLUMNAS_ESCENARIO, sort=False)[['Litros Planeados', 'Costo_usd']].sum().round(2).to_string())
+    for escenario, error in fallidos.itertuples(index=False): print(f"{escenario}: {error}", file=sys.stderr)
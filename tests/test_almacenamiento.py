@@ -0,0 +1,102 @@
+# Almacenamiento de tablas en los dos backends (CSV y SQLite): tipos al releer lo que se editó en la UI. Uso: python -m pytest -q
+import os
+import sys
+import importlib
+import pytest
+import pandas as pd
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    # La app crea data/ y assets/ relativas al directorio actual: se importa dentro de un directorio temporal
+    previo = os.getcwd(); os.chdir(tmp_path_factory.mktemp('planificador'))
+    try: yield importlib.import_module('app_planificador')
+    finally: os.chdir(previo)
+
+@pytest.fixture(params=['csv', 'sqlite'])
+def almacen(app, request, tmp_path, monkeypatch):
+    # También como almacenamiento() de la app: las lecturas cacheadas del backend CSV pasan por él
+    almacen = app.AlmacenamientoCSV() if request.param == 'csv' else app.AlmacenamientoSQLite(str(tmp_path / 'planificador.sqlite'), data_path=str(tmp_path))
+    monkeypatch.setattr(app, '_almacenamiento', almacen)
+    return almacen
+
+def test_columnas_numericas_editadas_como_texto(app, almacen, tmp_path):
+    # DataTable devuelve como texto las celdas numéricas editadas: al releer vuelven a ser números, como re-infiere read_csv
+    ruta = str(tmp_path / os.path.basename(app.FERT_FILE))
+    fert = app.definir_fertilizantes().astype({'Precio': object}); fert.loc[0, 'Precio'] = '2.75'
+    almacen.escribir(ruta, fert)
+    leido = almacen.leer(ruta)
+    assert pd.api.types.is_float_dtype(leido['Precio']) and leido.loc[0, 'Precio'] == 2.75
+    assert leido['Producto'].tolist() == fert['Producto'].tolist()
+    ruta = str(tmp_path / os.path.basename(app.REQ_FILE))
+    req = app.definir_requerimientos().astype({'Anio': str})
+    almacen.escribir(ruta, req)
+    assert pd.api.types.is_integer_dtype(almacen.leer(ruta)['Anio'])
+
+def test_tabla_cacheada_no_cambia_al_escribir_sobre_la_entregada(app, almacen, tmp_path):
+    # La caché entrega copias superficiales: escribir sobre una tabla entregada (en el lugar o reemplazando columnas) no llega a la cacheada
+    ruta = str(tmp_path / os.path.basename(app.FERT_FILE))
+    almacen.escribir(ruta, app.definir_fertilizantes()); app.invalidar_cache(ruta)
+    entregada = app.cargar_o_crear(ruta, app.definir_fertilizantes)
+    entregada.loc[0, 'Precio'] = -1.0; entregada['Producto'] = 'otro'; entregada.drop(index=1, inplace=True)
+    aciertos = app.estadisticas_cache()['hits']
+    pd.testing.assert_frame_equal(app.cargar_o_crear(ruta, app.definir_fertilizantes), almacen.leer(ruta))
+    assert app.estadisticas_cache()['hits'] == aciertos + 1
+
+def test_migracion_de_numeros_guardados_como_texto(app, tmp_path):
+    ruta, db = str(tmp_path / os.path.basename(app.REQ_FILE)), str(tmp_path / 'planificador.sqlite')
+    almacen = app.AlmacenamientoSQLite(db, data_path=str(tmp_path))
+    with almacen._transaccion() as con:
+        con.execute('CREATE TABLE requerimientos ("Sector" TEXT, "Anio" TEXT)'); con.execute("INSERT INTO requerimientos VALUES ('Chacra Vieja', '2011')")
+        con.execute("DELETE FROM _parametros WHERE clave='_migrado_numeros'")
+    assert almacen.leer(ruta)['Anio'].tolist() == ['2011']
+    assert app.AlmacenamientoSQLite(db, data_path=str(tmp_path)).leer(ruta)['Anio'].tolist() == [2011]
+
+def test_registro_planes_rechaza_handles_fuera_de_formato(app, tmp_path):
+    # El handle viene del cliente: uno que sale de la carpeta de planes no llega a deserializar nada
+    registro = app.RegistroPlanes(str(tmp_path / 'planes'))
+    with open(tmp_path / 'ajeno.plan', 'wb') as f: f.write(app.zlib.compress(app.pickle.dumps(pd.DataFrame({'x': [1]}))))
+    for handle in ('../ajeno', 'mensual-../../ajeno', 'mensual-' + 'A' * 32, 'otro-' + '0' * 32, None, ['mensual-' + '0' * 32]):
+        assert registro.obtener(handle) is None and not registro.contiene(handle)
+    with pytest.raises(ValueError): registro.guardar('../ajeno', pd.DataFrame())
+    handle = 'mensual-' + app.huella(app.definir_requerimientos())
+    registro.guardar(handle, app.definir_requerimientos())
+    pd.testing.assert_frame_equal(registro.obtener(handle), app.definir_requerimientos())
+
+FILTROS_ESPERADOS = {  # filter_query de DataTable -> filas que deja pasar
+    '{Año Plantación} contains 2011': lambda df: df['Año Plantación'].astype(str).str.contains('2011'),
+    '{Litros Planeados} contains 12': lambda df: df['Litros Planeados'].astype(str).str.contains('12'),
+    '{Año Plantación} >= 2016': lambda df: df['Año Plantación'] >= 2016,
+    '{Año Plantación} = 2011': lambda df: df['Año Plantación'] == 2011,
+    '{Sector} icontains chacra isla': lambda df: df['Sector'].str.lower().str.contains('chacra isla'),
+    '{Sector} contains chacra': lambda df: df['Sector'].str.contains('chacra'),
+    '{Sector} ieq "CHACRA VIEJA"': lambda df: df['Sector'].str.lower() == 'chacra vieja',
+    '{Sector} seq "Chacra Vieja"': lambda df: df['Sector'] == 'Chacra Vieja',
+    '{Fecha Estimada} datestartswith 2024-11': lambda df: df['Fecha Estimada'].str.startswith('2024-11'),
+    '{Observaciones} is blank': lambda df: df['Observaciones'].isna(),
+}
+
+@pytest.fixture
+def aplicaciones(app):
+    filas = 60
+    return pd.DataFrame({'id': range(filas), 'Sector': ['Chacra Vieja', 'Chacra Isla', 'chacra isla'] * (filas // 3), 'Año Plantación': [2011, 2012, 2016, 2017, 2018, 2019] * (filas // 6),
+                         'Válvula': [f'Valvula_{i % 4 + 1}' for i in range(filas)], 'Fecha Estimada': [f'2024-{10 + i % 3}-{i % 28 + 1:02d}' for i in range(filas)],
+                         'Litros Planeados': [12.5 + 0.25 * i for i in range(filas)], 'Observaciones': [None if i % 5 else 'revisar' for i in range(filas)]})
+
+@pytest.mark.parametrize('filtro', list(FILTROS_ESPERADOS))
+def test_filtros_de_texto_sobre_columnas_numericas(app, almacen, aplicaciones, tmp_path, filtro):
+    # DataTable manda sin comillas '{Año Plantación} contains 2011' en columnas sin tipo: se compara el texto '2011', no '2011.0'
+    ruta = str(tmp_path / os.path.basename(app.APLIC_REALES_FILE))
+    almacen.escribir(ruta, aplicaciones)
+    pagina, total = almacen.consultar_pagina(ruta, filtros=[app._parsear_filtro(filtro)], orden=[('id', True)])
+    esperadas = aplicaciones[FILTROS_ESPERADOS[filtro](aplicaciones).to_numpy(dtype=bool)]
+    assert total == len(esperadas) > 0 and pagina['id'].tolist() == esperadas['id'].tolist()
+    assert app.paginar_frame(aplicaciones, [app._parsear_filtro(filtro)])[1] == total
+
+@pytest.mark.parametrize('filtro', ['{Sector} is prime', '{Sector} between 1', 'Sector contains x'])
+def test_filtro_no_soportado_se_rechaza(app, filtro):
+    with pytest.raises(ValueError): app._parsear_filtro(filtro)
+    data, cols, page_count = app.pagina_de_tabla(pd.DataFrame({'Sector': ['a']}), None, 0, 10, [], filtro)
+    assert [c['id'] for c in cols] == ['Error'] and page_count == 1
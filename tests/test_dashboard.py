@@ -0,0 +1,69 @@
+# Cubo agregado del dashboard compartido entre workers. Uso: python -m pytest -q
+import os
+import sys
+import importlib
+import multiprocessing
+import subprocess
+import pytest
+import pandas as pd
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(RAIZ, 'benchmarks')); sys.path.insert(0, RAIZ)
+import granja_sintetica
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    # La app crea data/ y assets/ relativas al directorio actual al importarse. Si otro módulo de tests ya la importó, data/ se crea acá y el
+    # almacenamiento y las cachés del proceso arrancan de cero en este directorio; al terminar vuelven los del módulo anterior
+    previo = os.getcwd(); os.chdir(tmp_path_factory.mktemp('planificador'))
+    try:
+        modulo = importlib.import_module('app_planificador'); os.makedirs(modulo.DATA_PATH, exist_ok=True)
+        with pytest.MonkeyPatch.context() as mp:
+            for singleton in ('_almacenamiento', '_cache_trabajos', '_registro_planes'): mp.setattr(modulo, singleton, None)
+            modulo.invalidar_cache(); yield modulo
+        modulo.invalidar_cache()
+    finally: os.chdir(previo)
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="simula un guardado en otro worker con un proceso fork")
+def test_guardado_en_otro_worker_no_reconstruye_el_cubo(app, monkeypatch):
+    tablas = granja_sintetica.tablas_base(semilla=0, **granja_sintetica.ESCALAS['chica'])
+    _, aplicaciones = granja_sintetica.aplicaciones_de_temporadas(app, tablas, temporadas=2)
+    app.guardar_tabla(app.FERT_FILE, tablas['fertilizantes']); app.guardar_tabla(app.APLIC_REALES_FILE, aplicaciones)
+    app.descartar_cubo(); app.cubo_dashboard()
+    def guardar_en_otro_worker():
+        # Como guardar_datos_reales: cambios por celda + delta sobre el cubo vigente
+        with app.almacenamiento().bloqueo(app.APLIC_REALES_FILE):
+            antes, firma = app.cargar_o_crear(app.APLIC_REALES_FILE, lambda: pd.DataFrame()), app._firma_cubo()
+            despues = antes.copy(); pendientes = despues['Litros Reales Aplicados'].isna().to_numpy()
+            despues.loc[pendientes, 'Litros Reales Aplicados'] = despues.loc[pendientes, 'Litros Planeados']; despues.loc[pendientes, 'Fecha Aplicación Real'] = despues.loc[pendientes, 'Fecha Estimada']
+            app.guardar_cambios_tabla(app.APLIC_REALES_FILE, app.cambios_por_celda(antes, despues, app.COLUMNAS_DIARIO_SEGUIMIENTO))
+            app.actualizar_cubo(antes, despues, firma)
+    proceso = multiprocessing.get_context('fork').Process(target=guardar_en_otro_worker); proceso.start(); proceso.join()
+    assert proceso.exitcode == 0
+    agregar = app._agregar_al_cubo
+    monkeypatch.setattr(app, '_agregar_al_cubo', lambda *args: pytest.fail("el cubo se reconstruyó desde el historial"))
+    cubo = app.cubo_dashboard()
+    monkeypatch.undo()
+    completo = agregar(app.almacenamiento().consultar(app.APLIC_REALES_FILE, solo_aplicadas=True), app.cargar_o_crear(app.FERT_FILE, app.definir_fertilizantes))
+    pd.testing.assert_frame_equal(cubo.sort_index(), completo.sort_index(), check_dtype=False, check_exact=False)
+
+def test_gestor_trabajos_como_el_constructor_publico(app, tmp_path):
+    # GestorTrabajos no llama al __init__ de DiskcacheManager: debe dejar los mismos atributos que él en la versión de Dash instalada
+    import diskcache
+    publico = app.DiskcacheManager(diskcache.Cache(str(tmp_path / 'trabajos')), expire=30)
+    assert set(vars(app.GestorTrabajos(expire=30))) == set(vars(publico)) and app.GestorTrabajos(expire=30).expire == publico.expire
+
+def test_trabajo_unico_libera_candados_huerfanos_y_tiene_plazo(app):
+    cache, propio = app.cache_trabajos(), (os.getpid(), app._inicio_proceso(os.getpid()))
+    terminado = subprocess.Popen([sys.executable, '-c', '']); terminado.wait()
+    # Dueño muerto, pid reutilizado por otro proceso y candado de versiones anteriores (solo el pid): se liberan sin esperar el plazo
+    for clave, duenio in (('muerto', (terminado.pid, 0.0, 'a')), ('reutilizado', (os.getpid(), propio[1] + 1, 'b')), ('anterior', terminado.pid)):
+        cache.set(f'candado-{clave}', duenio)
+        assert app.trabajo_unico(clave, lambda: clave, plazo_s=0) == clave and cache.get(f'candado-{clave}') is None
+    # Dueño vivo: se espera hasta el plazo y el candado queda
+    cache.set('candado-vivo', propio + ('c',))
+    with pytest.raises(TimeoutError): app.trabajo_unico('vivo', lambda: pytest.fail("calculó con el candado tomado"), plazo_s=0.3)
+    assert cache.get('candado-vivo') == propio + ('c',)
+    # Un candado que otro trabajo tomó después de vencer el propio no se borra al terminar
+    def calcular(): cache.set('candado-tomado', propio + ('otro',)); return 1
+    assert app.trabajo_unico('tomado', calcular) == 1 and cache.get('candado-tomado') == propio + ('otro',)
@@ -0,0 +1,127 @@
+# Equivalencia de los modos de cálculo de los planes: 'referencia' (recorrido fila a fila original), 'vectorizado' e 'incremental' (en frío y memoizado)
+# sobre las granjas sintéticas de los benchmarks, y reutilización de fragmentos entre trabajos en segundo plano. Uso: python -m pytest -q
+import os
+import sys
+import importlib
+import multiprocessing
+import pytest
+import numpy as np
+import pandas as pd
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(RAIZ, 'benchmarks')); sys.path.insert(0, RAIZ)
+import granja_sintetica
+
+MODOS = ['referencia', 'vectorizado', 'incremental']
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    # La app crea data/ y assets/ relativas al directorio actual: se importa dentro de un directorio temporal
+    previo = os.getcwd(); os.chdir(tmp_path_factory.mktemp('planificador'))
+    try: yield importlib.import_module('app_planificador')
+    finally: os.chdir(previo)
+
+@pytest.fixture(scope='module', params=['chica', 'mediana'])
+def tablas(request):
+    return granja_sintetica.tablas_base(semilla=0, **granja_sintetica.ESCALAS[request.param])
+
+def planes_mensuales(app, t):
+    args = (t['requerimientos'], t['fertilizantes'], t['distribucion_1'], t['distribucion_2'])
+    app._memo_mensual.limpiar()
+    planes = {modo: app.calcular_plan_mensual(*args, modo=modo) for modo in MODOS}
+    planes['incremental_memo'] = app.calcular_plan_mensual(*args, modo='incremental')
+    return planes
+
+def planes_semanales(app, t, plan_mensual, df_limites):
+    fecha = granja_sintetica.FECHA_INICIO_TEMPORADA.isoformat()
+    semanal = lambda modo: app.generar_plan_semanal(plan_mensual, t['valvulas'], df_limites, fecha, modo=modo, df_fert=t['fertilizantes'])
+    app._memo_semanal.limpiar()
+    planes = {modo: semanal(modo) for modo in MODOS}
+    planes['incremental_memo'] = semanal('incremental')
+    return planes
+
+def test_plan_mensual_equivalente(app, tablas):
+    planes = planes_mensuales(app, tablas)
+    assert len(planes['referencia']) > 0 and 'Mensaje' not in planes['referencia'].columns
+    for modo, df in planes.items(): pd.testing.assert_frame_equal(df, planes['referencia'], check_exact=True, obj=modo)
+
+def test_plan_semanal_equivalente(app, tablas):
+    plan_mensual = planes_mensuales(app, tablas)['referencia']
+    planes = planes_semanales(app, tablas, plan_mensual, tablas['limites_nutrientes'])
+    assert len(planes['referencia']) > 0 and 'Error' not in planes['referencia'].columns
+    for modo, df in planes.items(): pd.testing.assert_frame_equal(df, planes['referencia'], check_exact=True, obj=modo)
+
+@pytest.mark.parametrize('limite', [0, -1, np.nan, ''])
+def test_limite_invalido_es_error_en_todos_los_modos(app, tablas, limite):
+    # Un límite vacío o <= 0 no descarta el nutriente en silencio: todos los modos devuelven el mismo 'Error'
+    plan_mensual = planes_mensuales(app, tablas)['referencia']
+    df_limites = tablas['limites_nutrientes'].astype({'Limite_kg_ha_app': object}); df_limites.loc[df_limites['Nutriente'] == 'N', 'Limite_kg_ha_app'] = limite
+    planes = planes_semanales(app, tablas, plan_mensual, df_limites)
+    assert list(planes['referencia'].columns) == ['Error'] and 'N' in planes['referencia']['Error'].iloc[0]
+    for modo, df in planes.items(): pd.testing.assert_frame_equal(df, planes['referencia'], obj=modo)
+
+def test_plan_compacto_conserva_los_litros(app, tablas):
+    # El plan mensual registrado (compacto) alimenta el semanal: ida y vuelta no cambia ningún litro calculado
+    plan_mensual = planes_mensuales(app, tablas)['referencia']
+    registrado = app.expandir_plan(app.compactar_plan(plan_mensual))
+    pd.testing.assert_frame_equal(registrado, plan_mensual, check_exact=True, check_dtype=False)
+    semanales = [planes_semanales(app, tablas, plan, tablas['limites_nutrientes'])['vectorizado'] for plan in (plan_mensual, registrado)]
+    litros = semanales[0].columns.intersection(app.COLUMNAS_CANTIDAD)
+    pd.testing.assert_frame_equal(app.expandir_plan(app.compactar_plan(semanales[1]))[litros], semanales[0][litros], check_exact=True)
+
+def en_proceso_nuevo(trabajo):
+    # Como DiskcacheManager: cada trabajo corre en un proceso aparte que hereda el estado del servidor pero no le devuelve nada
+    proceso = multiprocessing.get_context('fork').Process(target=trabajo); proceso.start(); proceso.join()
+    assert proceso.exitcode == 0
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="los trabajos en segundo plano de Dash corren en procesos con fork")
+def test_regenerar_en_trabajos_reutiliza_fragmentos(app, tablas):
+    req = tablas['requerimientos'].copy()
+    for filepath, df in ((app.REQ_FILE, req), (app.FERT_FILE, tablas['fertilizantes']), (app.DIST1_FILE, tablas['distribucion_1']), (app.DIST2_FILE, tablas['distribucion_2'])): app.guardar_tabla(filepath, df)
+    app._memo_mensual.limpiar()
+    generar = lambda: en_proceso_nuevo(lambda: app.generar_y_almacenar_plan_mensual(lambda progreso: None, 1, 0))
+    inicial = app._memo_mensual.estadisticas; generar(); primero = app._memo_mensual.estadisticas
+    assert primero['calculados'] > inicial['calculados'] and primero['reutilizados'] == inicial['reutilizados']
+    # Un requerimiento cambiado: el segundo trabajo recalcula solo sus meses y toma el resto de lo que dejó el primero
+    req.loc[0, 'N'] += 10; app.guardar_tabla(app.REQ_FILE, req)
+    generar(); segundo = app._memo_mensual.estadisticas
+    assert segundo['reutilizados'] > primero['reutilizados'] and segundo['calculados'] - primero['calculados'] < primero['calculados'] - inicial['calculados']
+    df_req, df_fert, df_dist1, df_dist2 = app.tablas_plan_mensual()
+    plan = app.registro_planes().obtener('mensual-' + app.huella(df_req, df_fert, df_dist1, df_dist2))
+    pd.testing.assert_frame_equal(plan, app.compactar_plan(app.calcular_plan_mensual(df_req, df_fert, df_dist1, df_dist2, modo='referencia')), check_exact=True)
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="los trabajos en segundo plano de Dash corren en procesos con fork")
+def test_regenerar_semanal_en_trabajos_reutiliza_fragmentos(app, tablas):
+    valv = tablas['valvulas'].copy()
+    for filepath, df in ((app.REQ_FILE, tablas['requerimientos']), (app.FERT_FILE, tablas['fertilizantes']), (app.DIST1_FILE, tablas['distribucion_1']), (app.DIST2_FILE, tablas['distribucion_2']), (app.VALV_FILE, valv)): app.guardar_tabla(filepath, df)
+    handle_mensual = app.generar_y_almacenar_plan_mensual(lambda progreso: None, 1, 0)
+    limites, fecha = tablas['limites_nutrientes'].to_dict('records'), granja_sintetica.FECHA_INICIO_TEMPORADA.isoformat()
+    app._memo_semanal.limpiar()
+    generar = lambda: en_proceso_nuevo(lambda: app.generar_y_almacenar_plan_semanal(lambda progreso: None, 1, 0, handle_mensual, limites, fecha))
+    inicial = app._memo_semanal.estadisticas; generar(); primero = app._memo_semanal.estadisticas
+    assert primero['calculados'] > inicial['calculados'] and primero['reutilizados'] == inicial['reutilizados']
+    # Una válvula cambiada: solo se recalculan las filas mensuales de su año de plantación
+    valv.iloc[0, 1] += 1; app.guardar_tabla(app.VALV_FILE, valv)
+    generar(); segundo = app._memo_semanal.estadisticas
+    assert segundo['reutilizados'] > primero['reutilizados'] and segundo['calculados'] - primero['calculados'] < primero['calculados'] - inicial['calculados']
+    df_valv, df_fert, df_limites, programacion = app.cargar_o_crear(app.VALV_FILE, app.definir_valvulas), app.cargar_o_crear(app.FERT_FILE, app.definir_fertilizantes), pd.DataFrame(limites), app.programacion_desde_formulario()
+    plan = app.registro_planes().obtener('semanal-' + app.huella(handle_mensual, df_valv, df_limites, fecha, df_fert, programacion))
+    referencia = app.generar_plan_semanal(app.expandir_plan(app.registro_planes().obtener(handle_mensual)), df_valv, df_limites, fecha, modo='referencia', df_fert=df_fert, programacion=programacion)
+    pd.testing.assert_frame_equal(plan, app.compactar_plan(referencia).sort_values(by=['Fecha Estimada', 'Válvula'], kind='stable', ignore_index=True), check_exact=True)
+
+def test_memo_compartida_ensambla_una_pieza_por_lote(app, tablas, monkeypatch):
+    # Un lote que el proceso ya tiene no se vuelve a deserializar como otro objeto, y _ensamblar toma cada lote en una sola pieza
+    plan_mensual, fecha, memo = planes_mensuales(app, tablas)['referencia'], granja_sintetica.FECHA_INICIO_TEMPORADA.isoformat(), app._memo_semanal
+    valv = tablas['valvulas'].copy(); memo.limpiar()
+    semanal = lambda modo: app.generar_plan_semanal(plan_mensual, valv, tablas['limites_nutrientes'], fecha, modo=modo, df_fert=tablas['fertilizantes'])
+    semanal('incremental'); valv.iloc[0, 1] += 1; semanal('incremental')
+    claves = list(memo._datos)
+    for clave in claves[::2]: del memo._datos[clave]  # la mitad salió de la LRU del proceso: vuelve de la memo compartida
+    tramos = memo.obtener(claves)
+    assert len({id(lote) for lote, _, _ in tramos.values()}) == len(memo._lotes) == 2
+    piezas, concat = [], pd.concat
+    monkeypatch.setattr(pd, 'concat', lambda objs, *args, **kwargs: piezas.append(len(objs)) or concat(objs, *args, **kwargs))
+    ensamblado = app._ensamblar([tramos[c] for c in claves])
+    monkeypatch.undo()
+    assert piezas == [2]
+    pd.testing.assert_frame_equal(ensamblado, pd.concat([lote.iloc[ini:fin] for lote, ini, fin in (tramos[c] for c in claves)], ignore_index=True), check_exact=True)
@@ -0,0 +1,61 @@
+# Planificador de escenarios por lotes (planificador_escenarios.py) sobre la granja sintética chica. Uso: python -m pytest -q
+import os
+import sys
+import importlib
+import pytest
+import pandas as pd
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(RAIZ, 'benchmarks')); sys.path.insert(0, RAIZ)
+import granja_sintetica
+
+@pytest.fixture(scope='module')
+def escenarios_mod(tmp_path_factory):
+    # La app crea data/ y assets/ relativas al directorio actual: se importa dentro de un directorio temporal
+    previo = os.getcwd(); os.chdir(tmp_path_factory.mktemp('planificador'))
+    try: yield importlib.import_module('planificador_escenarios')
+    finally: os.chdir(previo)
+
+@pytest.fixture
+def tablas():
+    tablas = granja_sintetica.tablas_base(semilla=0, **granja_sintetica.ESCALAS['chica'])
+    tablas.update(fecha_inicio_riego=granja_sintetica.FECHA_INICIO_TEMPORADA.isoformat(), distribuciones={})
+    return tablas
+
+def test_expandir_grilla(escenarios_mod, tablas, tmp_path):
+    producto = tablas['fertilizantes']['Producto'].iloc[0]
+    tablas['distribucion_1'].to_csv(tmp_path / 'd1.csv', index=False)
+    grilla = {'precios': [{}, {'*': 1.1}, {producto: 1.25}], 'fechas_inicio_riego': ['2025-08-25', '2025-09-15'], 'distribuciones': {'actual': None, 'alternativa': {'distribucion_1': 'd1.csv'}}}
+    escenarios = escenarios_mod.expandir_grilla(grilla, tablas, str(tmp_path))
+    assert len(escenarios) == 12 and len({e['id'] for e in escenarios}) == 12
+    assert [e['fecha'] for e in escenarios[:2]] == ['2025-08-25', '2025-09-15']  # la fecha varía más rápido
+    pd.testing.assert_frame_equal(tablas['distribuciones']['alternativa']['distribucion_1'], tablas['distribucion_1'])
+    for invalida in ({'precios': [{'NO EXISTE': 2}]}, {'fechas_inicio_riego': ['25/08/2025']}, {'distribuciones': {'x': {'distribucion_3': 'd1.csv'}}}):
+        with pytest.raises(ValueError): escenarios_mod.expandir_grilla(invalida, tablas, str(tmp_path))
+
+@pytest.mark.parametrize('procesos', [1, 2])
+def test_correr_escenarios(escenarios_mod, tablas, procesos):
+    app = escenarios_mod.app
+    escenarios = escenarios_mod.expandir_grilla({'precios': [{}, {'*': 2.0}], 'fechas_inicio_riego': ['2025-08-25', '2025-09-15']}, tablas)
+    memos = app._memo_mensual.estadisticas, app._memo_semanal.estadisticas
+    resultados = escenarios_mod.correr_escenarios(escenarios, tablas, procesos)
+    assert list(resultados.columns) == escenarios_mod.COLUMNAS_RESULTADO and set(resultados['Escenario']) == {e['id'] for e in escenarios}
+    # La corrida no pasa por la memo compartida de la app
+    assert (app._memo_mensual.estadisticas, app._memo_semanal.estadisticas) == memos
+    por_escenario = resultados.groupby('Escenario')[['Litros Planeados', 'Costo_usd']].sum()
+    base, doble = por_escenario.loc[escenarios[0]['id']], por_escenario.loc[escenarios[2]['id']]
+    assert doble['Costo_usd'] == pytest.approx(2 * base['Costo_usd']) or doble['Litros Planeados'] != pytest.approx(base['Litros Planeados'])
+
+@pytest.mark.parametrize('procesos', [1, 2])
+def test_escenario_fallido_no_corta_la_corrida(escenarios_mod, tablas, tmp_path, procesos):
+    # Una distribución sin las columnas esperadas hace fallar sus escenarios; los demás corren igual y cada fallido deja una fila con su error
+    pd.DataFrame({'Sin': [1], 'Columnas': [2]}).to_csv(tmp_path / 'rota.csv', index=False)
+    grilla = {'fechas_inicio_riego': ['2025-08-25', '2025-09-15'], 'distribuciones': {'actual': None, 'rota': {'distribucion_1': 'rota.csv', 'distribucion_2': 'rota.csv'}}}
+    escenarios = escenarios_mod.expandir_grilla(grilla, tablas, str(tmp_path))
+    resultados = escenarios_mod.correr_escenarios(escenarios, tablas, procesos)
+    assert list(resultados.columns) == escenarios_mod.COLUMNAS_RESULTADO and set(resultados['Escenario']) == {e['id'] for e in escenarios}
+    fallidos = resultados[resultados['Error'].notna()]
+    assert set(fallidos['Distribución']) == {'rota'} and fallidos['Escenario'].is_unique and len(fallidos) == 2
+    assert fallidos['Litros Planeados'].isna().all() and (fallidos['Error'].str.len() > 0).all()
+    corridos = resultados[resultados['Error'].isna()]
+    assert set(corridos['Distribución']) == {'actual'} and corridos['Litros Planeados'].sum() > 0
@@ -0,0 +1,96 @@
+# Auto-ajuste del plan al guardar litros reales en el seguimiento. Uso: python -m pytest -q
+import os
+import sys
+import importlib
+import pytest
+import numpy as np
+import pandas as pd
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    # La app crea data/ y assets/ relativas al directorio actual: se importa dentro de un directorio temporal
+    previo = os.getcwd(); os.chdir(tmp_path_factory.mktemp('planificador'))
+    try: yield importlib.import_module('app_planificador')
+    finally: os.chdir(previo)
+
+def seguimiento(app, planeados, fechas=None):
+    df = pd.DataFrame({'id': range(len(planeados)), 'Sector': 'Chacra Vieja', 'Válvula': 'Valvula_1', 'Fecha Estimada': fechas or [f'2024-11-{i + 1:02d}' for i in range(len(planeados))],
+                       'Litros Planeados': [float(p) for p in planeados], 'Litros Reales Aplicados': '', 'Fecha Aplicación Real': '', 'Observaciones': ''})
+    df.insert(df.columns.get_loc('Litros Reales Aplicados'), app.COLUMNA_PLAN_ORIGINAL, df['Litros Planeados'])
+    return df
+
+def guardar(app, df, ediciones):
+    # Como guardar_datos_reales, sin pasar por el almacenamiento: {id: litros reales} -> tabla guardada
+    df, editadas = app.aplicar_ediciones(df, {str(i): {'Litros Reales Aplicados': v} for i, v in ediciones.items()})
+    return app.auto_ajustar_plan(df, editadas=editadas)
+
+def test_reeditar_un_real_rehace_la_cadena(app):
+    df = guardar(app, seguimiento(app, [10, 10, 10]), {0: 12, 1: 15})
+    assert df['Litros Planeados'].tolist() == [10, 12, 13]
+    df = guardar(app, df, {0: 13})
+    assert df['Litros Planeados'].tolist() == [10, 13, 12]
+    assert df[app.COLUMNA_PLAN_ORIGINAL].tolist() == [10, 10, 10]
+
+def test_cargar_fuera_de_orden_da_la_misma_cadena(app):
+    de_una_vez = guardar(app, seguimiento(app, [10, 10, 10]), {0: 12, 1: 15})
+    df = guardar(app, seguimiento(app, [10, 10, 10]), {1: 15})
+    df = guardar(app, df, {0: 12})
+    pd.testing.assert_frame_equal(df, de_una_vez)
+
+def test_borrar_un_real_quita_su_arrastre(app):
+    df = guardar(app, seguimiento(app, [10, 10, 10]), {0: 12, 1: 15})
+    df = guardar(app, df, {1: ''})
+    assert df['Litros Planeados'].tolist() == [10, 12, 10]
+    df = guardar(app, df, {0: None})
+    assert df['Litros Planeados'].tolist() == [10, 10, 10]
+
+def test_tabla_sin_columna_de_originales(app):
+    # Seguimientos guardados antes de la columna: el ajuste ya aplicado se deshace en lugar de sumarse otra vez
+    ajustada = guardar(app, seguimiento(app, [10, 10, 10]), {0: 12, 1: 15})
+    migrada = app.con_plan_original(ajustada.drop(columns=app.COLUMNA_PLAN_ORIGINAL))
+    pd.testing.assert_frame_equal(migrada[ajustada.columns], ajustada)
+    assert guardar(app, migrada, {0: 13})['Litros Planeados'].tolist() == [10, 13, 12]
+    sin_fechas = seguimiento(app, [10, 10], fechas=['', '']).drop(columns=app.COLUMNA_PLAN_ORIGINAL)
+    assert app.auto_ajustar_plan(sin_fechas)[app.COLUMNA_PLAN_ORIGINAL].tolist() == [10, 10]
+
+def ajuste_por_filas(df):
+    # El bucle iterrows original, recorriendo los riegos por fecha y comparando cada real con el plan ya ajustado de su fila (la cadena)
+    df_modificado = df.copy(); df_modificado['Fecha Estimada'] = pd.to_datetime(df_modificado['Fecha Estimada'])
+    for index, row in df_modificado.sort_values(by='Fecha Estimada', kind='stable').iterrows():
+        litros_reales = pd.to_numeric(row['Litros Reales Aplicados'], errors='coerce')
+        if pd.notna(litros_reales):
+            diferencia = litros_reales - df_modificado.loc[index, 'Litros Planeados']
+            if diferencia != 0:
+                df_futuro = df_modificado[(df_modificado['Fecha Estimada'] > row['Fecha Estimada']) & (df_modificado['Válvula'] == row['Válvula']) & (df_modificado['Sector'] == row['Sector'])].sort_values(by='Fecha Estimada', kind='stable')
+                if not df_futuro.empty: df_modificado.loc[df_futuro.index[0], 'Litros Planeados'] += diferencia
+    return df_modificado['Litros Planeados']
+
+@pytest.mark.parametrize('semilla', range(5))
+def test_cadenas_iguales_al_ajuste_por_filas(app, semilla):
+    # Varios grupos con cadenas largas de reales, fechas repetidas (más de un producto por riego) y filas desordenadas
+    rng = np.random.default_rng(semilla); filas = 120
+    df = seguimiento(app, rng.integers(5, 50, filas), fechas=[f'2024-11-{d:02d}' for d in rng.integers(1, 20, filas)])
+    df['Sector'] = rng.choice(['Chacra Vieja', 'Chacra Isla'], filas); df['Válvula'] = rng.choice(['Valvula_1', 'Valvula_2', 'Valvula_3'], filas)
+    con_real = rng.random(filas) < 0.7
+    df['Litros Reales Aplicados'] = np.where(con_real, rng.integers(5, 50, filas), np.nan)
+    esperado = ajuste_por_filas(df)
+    pd.testing.assert_series_equal(app.auto_ajustar_plan(df)['Litros Planeados'], esperado, check_dtype=False)
+    # Guardado a guardado, tocando solo algunos grupos, se llega a lo mismo
+    df_parcial = df.assign(**{'Litros Reales Aplicados': np.nan})
+    for lote in np.array_split(rng.permutation(np.flatnonzero(con_real)), 4):
+        df_parcial, editadas = app.aplicar_ediciones(df_parcial, {str(i): {'Litros Reales Aplicados': df.at[i, 'Litros Reales Aplicados']} for i in lote})
+        df_parcial = app.auto_ajustar_plan(df_parcial, editadas=editadas)
+    pd.testing.assert_series_equal(df_parcial['Litros Planeados'], esperado, check_dtype=False)
+
+def test_ordenes_no_vuelven_a_decodificar_los_logos(app, monkeypatch):
+    # Los logos se decodifican una vez por proceso: las órdenes siguientes (y cada página) reusan esa información
+    import fpdf.image_parsing
+    monkeypatch.chdir(RAIZ)  # los logos están en assets/ del repositorio
+    filas = [['Chacra Vieja'] * 40, ['Valvula_1'] * 40, ['Urea'] * 40, ['12.50'] * 40]
+    primera = app._render_ordenes([('a.pdf', None, filas)])[0][1]
+    monkeypatch.setattr(fpdf.image_parsing, 'get_img_info', lambda *args, **kwargs: pytest.fail("el logo se volvió a decodificar"))
+    (_, otra), = app._render_ordenes([('b.pdf', None, filas)])
+    assert len(otra) == len(primera) and otra.count(b'/Subtype /Image') == len(app.LOGOS_ORDEN)